@@ -0,0 +1,79 @@
+#!/bin/env python3
+"""Compare writing a generate_hwmap style readout map with one
+db.update_dal call per object against staging the objects in an
+ObjectBatch.
+
+Needs a DUNE DAQ environment (oksdbinterfaces and the appdal schemas on
+DUNEDAQ_SHARE_PATH).
+
+   python benchmarks/batch_update.py 10000 100000
+"""
+import os
+import sys
+import tempfile
+import time
+
+import oksdbinterfaces
+from oksconfgen.batch import ObjectBatch
+
+schemafiles = [
+    "schema/coredal/dunedaq.schema.xml",
+    "schema/appdal/application.schema.xml",
+    "schema/appdal/fdmodules.schema.xml",
+]
+
+
+def build_map(oksfile, n_streams, streams_per_app, batched):
+    dal = oksdbinterfaces.dal.module("generated", schemafiles[2])
+    db = oksdbinterfaces.Configuration("oksconfig")
+    db.create_db(oksfile, schemafiles)
+    if batched:
+        batch = ObjectBatch(db)
+        write = batch.add
+    else:
+        write = db.update_dal
+
+    stream_pars = dal.StreamParameters("dummyStream-1", mode="fix_rate")
+    write(stream_pars)
+    groups = []
+    streams = []
+    for source_id in range(n_streams):
+        app = source_id // streams_per_app
+        geo_dal = dal.GeoId(f"geoId-{source_id}", detector_id=3, crate_id=app,
+                            slot_id=0, stream_id=source_id % streams_per_app)
+        write(geo_dal)
+        stream = dal.DROStreamConf(f"DROStream-{source_id}", source_id=source_id,
+                                   stream_params=stream_pars, geo_id=geo_dal)
+        write(stream)
+        streams.append(stream)
+        if len(streams) == streams_per_app or source_id == n_streams - 1:
+            nic_dal = dal.ReadoutInterface(f"ROInterface-{app}", contains=streams)
+            write(nic_dal)
+            rogroup_dal = dal.ReadoutGroup(f"group-{app}", contains=[nic_dal])
+            write(rogroup_dal)
+            groups.append(rogroup_dal)
+            streams = []
+    write(dal.ReadoutMap("readoutmap", groups=groups))
+
+    if batched:
+        batch.commit()
+    else:
+        db.commit()
+
+
+def main(scales):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for n_streams in scales:
+            results = {}
+            for batched in (False, True):
+                oksfile = os.path.join(tmpdir, f"hwmap-{n_streams}-{batched}.data.xml")
+                start = time.perf_counter()
+                build_map(oksfile, n_streams, 64, batched)
+                results[batched] = time.perf_counter() - start
+            print(f"{n_streams:>8} streams: update_dal {results[False]:8.2f} s, "
+                  f"ObjectBatch {results[True]:8.2f} s, "
+                  f"speedup {results[False] / results[True]:5.1f}x")
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or [10000, 100000])
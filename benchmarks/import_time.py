@@ -0,0 +1,153 @@
+#!/bin/env python3
+"""Startup benchmark for the oksconfgen scripts and modules.
+
+Runs every script with --help and imports every oksconfgen module in a
+fresh interpreter under -X importtime, and reports the total import time
+and the slowest top level imports as JSON. Each measurement is repeated
+and the fastest run kept to filter out noise.
+
+Every case is checked against benchmarks/import_budget.json: its total
+import time must be within the budget in ms and none of the modules that
+are only needed once a script does real work (oksdbinterfaces, the asset
+database, ...) may have been imported. A case that fails to run counts
+as over budget. Exits with status 1 if any case is over budget.
+
+   python benchmarks/import_time.py
+   python benchmarks/import_time.py --case script:generate_readoutOKS --repeat 20
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+here = os.path.dirname(os.path.abspath(__file__))
+top = os.path.dirname(here)
+scripts_dir = os.path.join(top, "scripts")
+modules_dir = os.path.join(top, "python", "oksconfgen")
+
+
+def list_cases():
+    """case name -> command line run for it"""
+    cases = {}
+    for script in sorted(os.listdir(scripts_dir)):
+        path = os.path.join(scripts_dir, script)
+        if os.path.isfile(path) and os.access(path, os.X_OK):
+            cases[f"script:{script}"] = [path, "--help"]
+    for module in sorted(os.listdir(modules_dir)):
+        if module.endswith(".py") and module != "__init__.py":
+            name = "oksconfgen." + module.removesuffix(".py")
+            cases[f"module:{name}"] = ["-c", f"import {name}"]
+    return cases
+
+
+def parse_importtime(stderr):
+    """Return the total import time in us and name -> cumulative us of
+    the top level imports from -X importtime output"""
+    imports = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        _, cumulative, name = line.removeprefix("import time:").split("|")
+        if not name.startswith("  "):
+            imports[name.strip()] = int(cumulative)
+    # site and the encodings are imported by every interpreter
+    for name in ["site", "encodings", "_frozen_importlib_external", "zipimport"]:
+        imports.pop(name, None)
+    return sum(imports.values()), imports
+
+
+def measure(command, env):
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime"] + command,
+        env=env, capture_output=True, text=True,
+    )
+    total, imports = parse_importtime(proc.stderr)
+    imported = {
+        line.split("|")[2].strip()
+        for line in proc.stderr.splitlines()
+        if line.startswith("import time:") and "self [us]" not in line
+    }
+    error = proc.stderr.strip().splitlines()[-1] if proc.returncode != 0 else None
+    return error, total, imports, imported
+
+
+def check(case, result, budget):
+    """Return the reasons case is over budget"""
+    problems = []
+    kind = case.split(":")[0]
+    limit = budget["cases"].get(case, budget["default_ms"][kind])
+    if result["import_ms"] > limit:
+        problems.append(f"imports take {result['import_ms']:.1f} ms, budget {limit} ms")
+    for module in budget["forbidden"]:
+        if module in result["imported"]:
+            problems.append(f"imports {module}")
+    return problems
+
+
+def main():
+    cases = list_cases()
+    parser = argparse.ArgumentParser(description="oksconfgen startup benchmark")
+    parser.add_argument("--case", action="append", choices=list(cases),
+                        help="Case to run, repeat for several (default all)")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="Runs per case, the fastest is kept")
+    parser.add_argument("--budget", default=os.path.join(here, "import_budget.json"),
+                        help="JSON file with the import time budget")
+    parser.add_argument("--real", action="store_true",
+                        help="Use the real oksdbinterfaces instead of the in-memory stand-in")
+    parser.add_argument("--output", "-o", help="Write the JSON results to this file")
+    args = parser.parse_args()
+
+    with open(args.budget) as f:
+        budget = json.load(f)
+
+    env = dict(os.environ)
+    paths = [os.path.join(top, "python")]
+    if not args.real:
+        paths.insert(0, os.path.join(here, "stand_in"))
+    env["PYTHONPATH"] = ":".join(paths + [p for p in [env.get("PYTHONPATH")] if p])
+    # Never hand the scripts to a running daemon
+    env["OKSCONFGEN_DAEMON"] = "off"
+
+    report = {"python": sys.version.split()[0], "results": [], "over_budget": []}
+    for case in args.case or list(cases):
+        best = None
+        for _ in range(args.repeat):
+            error, total, imports, imported = measure(cases[case], env)
+            if error is not None:
+                best = (error, total, imports, imported)
+                break
+            if best is None or total < best[1]:
+                best = (error, total, imports, imported)
+        error, total, imports, imported = best
+        if error is not None:
+            report["over_budget"].append({"case": case, "problems": [f"failed: {error}"]})
+            print(f"{case:>45} FAILED: {error}", file=sys.stderr)
+            continue
+        slowest = sorted(imports.items(), key=lambda i: i[1], reverse=True)[:5]
+        result = {
+            "case": case,
+            "import_ms": total / 1000,
+            "slowest": {name: us / 1000 for name, us in slowest},
+            "imported": sorted(m for m in budget["forbidden"] if m in imported),
+        }
+        problems = check(case, {**result, "imported": imported}, budget)
+        if problems:
+            report["over_budget"].append({"case": case, "problems": problems})
+        report["results"].append(result)
+        print(f"{case:>45} {result['import_ms']:8.1f} ms  "
+              f"{'OVER BUDGET: ' + '; '.join(problems) if problems else 'ok'}",
+              file=sys.stderr)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    if report["over_budget"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
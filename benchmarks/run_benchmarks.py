@@ -0,0 +1,217 @@
+#!/bin/env python3
+"""Benchmark suite for the oksconfgen generators.
+
+Runs dromap2oks (also with the streaming XML writer), generate_hwmap (also
+in bulk mode), generate_readoutOKS and consolidate at a range of scales and reports wall and CPU time, peak
+RSS, DAL objects written and objects written per second as JSON. Every measurement runs
+in a fresh process (after a separate process has prepared its inputs) so
+that peak RSS only covers the entry point being measured.
+
+By default the in-memory oksdbinterfaces stand-in in benchmarks/stand_in
+is used so the suite runs on any Linux box. Use --real to run against
+the oksdbinterfaces of the current DUNE DAQ environment instead.
+
+   python benchmarks/run_benchmarks.py --output results.json
+   python benchmarks/run_benchmarks.py --case dromap2oks --scale 1000 --scale 100000
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+# case -> (description of the scale, default scales)
+cases = {
+    "dromap2oks": ("streams", [1000, 10000, 100000]),
+    "dromap2oks_writer": ("streams", [1000, 10000, 100000]),
+    "generate_hwmap": ("streams", [1000, 10000, 100000]),
+    "generate_hwmap_bulk": ("streams", [1000, 10000, 100000]),
+    "generate_readoutOKS": ("readout groups", [10, 100, 1000]),
+    "consolidate": ("input files", [2, 8, 32]),
+}
+
+streams_per_group = 64
+streams_per_wib = 4
+
+
+def write_readout_map(jsonfile, n_streams, source_id_offset=0, per_group=streams_per_group):
+    """Write a synthetic ethernet readout map with n_streams streams, one
+    NIC per per_group streams"""
+    with open(jsonfile, "w") as f:
+        f.write("[\n")
+        for stream in range(n_streams):
+            nic = stream // per_group
+            wib = stream // streams_per_wib
+            entry = {
+                "src_id": stream + source_id_offset,
+                "geo_id": {
+                    "det_id": 3,
+                    "crate_id": nic,
+                    "slot_id": (stream % per_group) // streams_per_wib,
+                    "stream_id": stream % streams_per_wib,
+                },
+                "kind": "eth",
+                "parameters": {
+                    "protocol": "udp",
+                    "mode": "fix_rate",
+                    "rx_host": f"np04-srv-{nic:04d}",
+                    "rx_mac": f"6c:fe:54:47:{nic // 256:02x}:{nic % 256:02x}",
+                    "rx_ip": f"10.73.{nic // 256}.{nic % 256}",
+                    "rx_iface": 0,
+                    "rx_pcie_dev": "0000:ca:00.0",
+                    "tx_host": f"wib-{wib:05d}",
+                    "tx_mac": f"00:00:00:{wib // 65536 % 256:02x}:{wib // 256 % 256:02x}:{wib % 256:02x}",
+                    "tx_ip": f"10.74.{wib // 256 % 256}.{wib % 256}",
+                },
+            }
+            f.write(("," if stream > 0 else "") + json.dumps(entry) + "\n")
+        f.write("]\n")
+
+
+def setup(case, scale, workdir):
+    """Prepare the inputs of case in workdir"""
+    if case in ("dromap2oks", "dromap2oks_writer"):
+        write_readout_map(os.path.join(workdir, "map.json"), scale)
+    elif case == "generate_readoutOKS":
+        from oksconfgen.dromap2oks import dro_json_to_oks
+        write_readout_map(os.path.join(workdir, "map.json"), scale * 8, per_group=8)
+        dro_json_to_oks(os.path.join(workdir, "map.json"), "map.data.xml", 0, False, [1, 2, 3, 4])
+    elif case == "consolidate":
+        from oksconfgen.dromap2oks import dro_json_to_oks
+        for n in range(scale):
+            jsonfile = os.path.join(workdir, f"map{n}.json")
+            write_readout_map(jsonfile, 256, source_id_offset=n * 256)
+            dro_json_to_oks(jsonfile, f"map{n}.data.xml", 0, True, [1, 2, 3, 4])
+
+
+def run(case, scale, workdir):
+    """Run case and return the output file name"""
+    if case == "dromap2oks":
+        from oksconfgen.dromap2oks import dro_json_to_oks
+        dro_json_to_oks(os.path.join(workdir, "map.json"), "out.data.xml", 0, False, [1, 2, 3, 4])
+    elif case == "dromap2oks_writer":
+        from oksconfgen.dromap2oks import dro_json_to_oks
+        dro_json_to_oks(os.path.join(workdir, "map.json"), "out.data.xml", 0, False, [1, 2, 3, 4],
+                        writer=True)
+    elif case == "generate_hwmap":
+        from oksconfgen.generate_hwmap import generate_hwmap
+        generate_hwmap("out.data.xml", streams_per_group, max(1, scale // streams_per_group))
+    elif case == "generate_hwmap_bulk":
+        from oksconfgen.generate_hwmap import generate_hwmap
+        generate_hwmap("out.data.xml", streams_per_group, max(1, scale // streams_per_group), bulk=True)
+    elif case == "generate_readoutOKS":
+        from oksconfgen.generate_readoutOKS import generate_readout
+        generate_readout("map.data.xml", "out.data.xml", [], False, False)
+    elif case == "consolidate":
+        from oksconfgen.consolidate import consolidate_files
+        consolidate_files("out.data.xml", *[f"map{n}.data.xml" for n in range(scale)])
+    return "out.data.xml"
+
+
+def child(mode, case, scale, workdir):
+    os.chdir(workdir)
+    if mode == "setup":
+        setup(case, scale, workdir)
+        return
+
+    from oksconfgen.batch import ObjectBatch
+    written = [0]
+    flush = ObjectBatch.flush
+
+    def counting_flush(self):
+        written[0] += len(self)
+        flush(self)
+
+    ObjectBatch.flush = counting_flush
+
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    output = run(case, scale, workdir)
+    wall = time.perf_counter() - start
+    cpu = time.process_time() - cpu_start
+    result = {
+        "case": case,
+        "scale": scale,
+        "scale_unit": cases[case][0],
+        "wall_s": wall,
+        "cpu_s": cpu,
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "objects": written[0],
+        "objects_per_s": written[0] / wall if wall > 0 else None,
+        "output_bytes": os.path.getsize(output) if os.path.exists(output) else None,
+    }
+    print("BENCHMARK_RESULT " + json.dumps(result))
+
+
+def spawn(mode, case, scale, workdir, real):
+    env = dict(os.environ)
+    paths = [os.path.join(os.path.dirname(here), "python")]
+    if not real:
+        paths.insert(0, os.path.join(here, "stand_in"))
+        env["DUNEDAQ_SHARE_PATH"] = workdir
+    env["PYTHONPATH"] = ":".join(paths + [p for p in [env.get("PYTHONPATH")] if p])
+    proc = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--child", mode, case, str(scale), workdir],
+        env=env, capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"{mode} of {case} at scale {scale} failed:\n{proc.stderr}")
+    for line in proc.stdout.splitlines():
+        if line.startswith("BENCHMARK_RESULT "):
+            return json.loads(line.removeprefix("BENCHMARK_RESULT "))
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="oksconfgen benchmark suite")
+    parser.add_argument("--case", action="append", choices=list(cases),
+                        help="Case to run, repeat for several (default all)")
+    parser.add_argument("--scale", action="append", type=int,
+                        help="Scale to run each case at, repeat for several (default per case)")
+    parser.add_argument("--real", action="store_true",
+                        help="Use the real oksdbinterfaces instead of the in-memory stand-in")
+    parser.add_argument("--label", default="",
+                        help="Label stored with the results, e.g. the release being measured")
+    parser.add_argument("--output", "-o", help="Write the JSON results to this file")
+    parser.add_argument("--child", nargs=4, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        mode, case, scale, workdir = args.child
+        child(mode, case, int(scale), workdir)
+        return
+
+    report = {
+        "label": args.label,
+        "backend": "oksdbinterfaces" if args.real else "stand-in",
+        "python": platform.python_version(),
+        "host": platform.node(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "results": [],
+    }
+    for case in args.case or list(cases):
+        for scale in args.scale or cases[case][1]:
+            with tempfile.TemporaryDirectory() as workdir:
+                spawn("setup", case, scale, workdir, args.real)
+                result = spawn("run", case, scale, workdir, args.real)
+            report["results"].append(result)
+            print(f"{case:>20} {scale:>8} {result['scale_unit']:<15} "
+                  f"{result['wall_s']:9.3f} s {result['peak_rss_kb'] / 1024:9.1f} MiB "
+                  f"{result['objects']:>9} objects {result['objects_per_s'] or 0:12.0f} obj/s",
+                  file=sys.stderr)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
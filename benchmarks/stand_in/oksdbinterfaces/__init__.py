@@ -0,0 +1,215 @@
+"""Minimal in-memory stand-in for oksdbinterfaces used by the benchmarks.
+
+It implements just enough of Configuration and dal.module for the
+oksconfgen generators to run without a DUNE DAQ installation: DAL
+classes are plain Python classes created on demand and databases live in a
+process wide registry keyed by file name. No schema checking is done.
+
+commit() pickles the database to its file, so databases written by one
+process can be loaded by another as long as they also use the stand-in.
+OKS .data.xml files (as written by oksconfgen.oks_writer) can be loaded
+too."""
+
+import os
+import pickle
+import xml.etree.ElementTree as ET
+
+# file name -> (includes, {(class, uid): object})
+_files = {}
+_classes = {}
+
+
+def _make_dal(class_name, values):
+    obj = _dal_class(class_name).__new__(_dal_class(class_name))
+    obj.__dict__.update(values)
+    return obj
+
+
+class DalBase:
+    def __init__(self, id, **kwargs):
+        self.__dict__["id"] = id
+        self.__dict__.update(kwargs)
+
+    def className(self):
+        return type(self).__name__
+
+    def __repr__(self):
+        return f"<{self.className()} {self.id}>"
+
+    def __reduce__(self):
+        return (_make_dal, (self.className(), self.__dict__))
+
+
+def _dal_class(name):
+    if name not in _classes:
+        _classes[name] = type(name, (DalBase,), {})
+    return _classes[name]
+
+
+class _Module:
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return _dal_class(name)
+
+    def __dir__(self):
+        return list(_classes)
+
+
+class dal:
+    @staticmethod
+    def module(name, schema, *args, **kwargs):
+        return _Module()
+
+
+class _Ref:
+    """Relationship read from an XML file, resolved once its database is
+    loaded"""
+
+    def __init__(self, class_name, uid):
+        self.key = (class_name, uid)
+
+
+_xml_types = {
+    "bool": lambda v: v == "1",
+    "float": float,
+    "double": float,
+}
+
+
+def _xml_value(oks_type, value):
+    if oks_type in _xml_types:
+        return _xml_types[oks_type](value)
+    if oks_type[1:].isdigit():
+        return int(value)
+    return value
+
+
+def _load_xml(filename):
+    root = ET.parse(filename).getroot()
+    if root.tag != "oks-data":
+        raise ValueError(f"{filename} is not an OKS data file")
+    includes = [f.get("path") for f in root.iter("file")]
+    objects = {}
+    for elem in root.iter("obj"):
+        values = {}
+        for child in elem:
+            if child.tag == "attr":
+                oks_type = child.get("type")
+                if len(child) > 0:
+                    values[child.get("name")] = [_xml_value(oks_type, d.get("val")) for d in child]
+                else:
+                    values[child.get("name")] = _xml_value(oks_type, child.get("val"))
+            elif child.get("id"):
+                values[child.get("name")] = _Ref(child.get("class"), child.get("id"))
+            else:
+                values[child.get("name")] = [_Ref(r.get("class"), r.get("id")) for r in child]
+        objects[(elem.get("class"), elem.get("id"))] = _dal_class(elem.get("class"))(elem.get("id"), **values)
+    return includes, objects
+
+
+def _find(filename):
+    if filename in _files:
+        return filename
+    for path in [""] + os.environ.get("DUNEDAQ_SHARE_PATH", "").split(":"):
+        candidate = os.path.join(path, filename)
+        if candidate in _files:
+            return candidate
+        if os.path.isfile(candidate):
+            try:
+                with open(candidate, "rb") as f:
+                    _files[candidate] = pickle.load(f)
+            except Exception:
+                try:
+                    _files[candidate] = _load_xml(candidate)
+                except Exception:
+                    # Not a data file (e.g. a real schema file)
+                    continue
+            return candidate
+    return None
+
+
+class Configuration:
+    def __init__(self, spec="oksconfig"):
+        self.file = None
+        self.includes = []
+        self.objects = {}
+        self.own = {}
+        if ":" in spec:
+            self.file = spec.split(":", 1)[1]
+            name = _find(self.file)
+            if name is None:
+                raise RuntimeError(f"Cannot load database {self.file}")
+            self.includes = list(_files[name][0])
+            self.own = dict(_files[name][1])
+            self._load_includes(self.includes, set())
+            self.objects.update(self.own)
+            self._resolve_refs()
+
+    def _load_includes(self, includes, seen):
+        for include in includes:
+            name = _find(include)
+            if name is None or name in seen:
+                continue
+            seen.add(name)
+            self._load_includes(_files[name][0], seen)
+            self.objects.update(_files[name][1])
+
+    def _resolve_refs(self):
+        def resolve(value):
+            return self.objects.get(value.key) if isinstance(value, _Ref) else value
+
+        for obj in self.objects.values():
+            for name, value in vars(obj).items():
+                if isinstance(value, list):
+                    obj.__dict__[name] = [resolve(v) for v in value]
+                else:
+                    obj.__dict__[name] = resolve(value)
+
+    def create_db(self, filename, includes):
+        self.file = filename
+        self.includes = list(includes)
+        self.own = {}
+        self.objects = {}
+        self._load_includes(self.includes, set())
+        self._resolve_refs()
+
+    def get_includes(self, filename=None):
+        if filename is None:
+            return list(self.includes)
+        name = _find(filename)
+        return list(_files[name][0]) if name is not None else []
+
+    def update_dal(self, dal_obj, ignore_error=True, at=None, cache=None, recurse=True):
+        key = (dal_obj.className(), dal_obj.id)
+        self.objects[key] = dal_obj
+        self.own[key] = dal_obj
+        if recurse:
+            for value in vars(dal_obj).values():
+                for obj in value if isinstance(value, list) else [value]:
+                    if isinstance(obj, DalBase) and (obj.className(), obj.id) not in self.own:
+                        self.update_dal(obj)
+
+    add_dal = update_dal
+
+    def destroy_dal(self, dal_obj):
+        key = (dal_obj.className(), dal_obj.id)
+        self.objects.pop(key, None)
+        self.own.pop(key, None)
+
+    def get_dal(self, class_name, uid):
+        try:
+            return self.objects[(class_name, uid)]
+        except KeyError:
+            raise RuntimeError(f"Object {uid}@{class_name} not found") from None
+
+    def get_dals(self, class_name):
+        return [obj for (cls, uid), obj in self.objects.items() if cls == class_name]
+
+    def get_all_dals(self):
+        return {f"{uid}@{cls}": obj for (cls, uid), obj in self.objects.items()}
+
+    def commit(self):
+        _files[self.file] = (list(self.includes), dict(self.own))
+        with open(self.file, "wb") as f:
+            pickle.dump(_files[self.file], f)
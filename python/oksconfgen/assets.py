@@ -1,11 +1,151 @@
 
-from os.path import exists,abspath,dirname,expandvars
-
-from daq_assettools.asset_file import AssetFile
-from daq_assettools.asset_database import Database
-from sqlite3 import OperationalError
-
-def resolve_asset_file(data_file, verbose = False):
+from os.path import exists,abspath,dirname,expandvars,expanduser,join
+import os
+import json
+import time
+
+ASSET_DB_FILE = '/cvmfs/dunedaq.opensciencegrid.org/assets/dunedaq-asset-db.sqlite'
+
+# Location of the on-disk asset cache, set to an empty string to disable it
+CACHE_ENV = 'OKSCONFGEN_ASSET_CACHE'
+DEFAULT_CACHE_FILE = join(os.environ.get('XDG_CACHE_HOME', expanduser('~/.cache')), 'oksconfgen', 'asset_cache.json')
+# Seconds a cached entry stays valid and number of entries kept
+TTL_ENV = 'OKSCONFGEN_ASSET_CACHE_TTL'
+DEFAULT_TTL = 7*24*3600
+MAX_ENTRIES_ENV = 'OKSCONFGEN_ASSET_CACHE_ENTRIES'
+DEFAULT_MAX_ENTRIES = 1000
+
+_asset_db = None
+_asset_cache = None
+
+
+def get_asset_db():
+    """Return the asset Database, opening it on first use"""
+    global _asset_db
+    if _asset_db is None:
+        from daq_assettools.asset_database import Database
+        _asset_db = Database(ASSET_DB_FILE)
+    return _asset_db
+
+
+class AssetCache:
+    """Persistent cache of asset query -> file path results.
+
+    Entries older than ttl seconds or whose file no longer exists are
+    ignored, and once more than max_entries are stored the least
+    recently used ones are dropped."""
+
+    def __init__(self, cache_file, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES):
+        self.cache_file = cache_file
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = None
+        self._dirty = False
+
+    def _load(self):
+        if self._entries is not None:
+            return
+        self._entries = {}
+        if not self.cache_file:
+            return
+        try:
+            with open(self.cache_file) as f:
+                self._entries = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+    @staticmethod
+    def key(query):
+        return '&'.join(f'{k}={query[k]}' for k in sorted(query))
+
+    def get(self, query):
+        self._load()
+        entry = self._entries.get(self.key(query))
+        now = time.time()
+        if entry is None or now - entry['created'] > self.ttl or not exists(entry['path']):
+            self.misses += 1
+            return None
+        self.hits += 1
+        entry['used'] = now
+        self._dirty = True
+        return entry['path']
+
+    def put(self, query, path):
+        self._load()
+        now = time.time()
+        self._entries[self.key(query)] = {'path': path, 'created': now, 'used': now}
+        if len(self._entries) > self.max_entries:
+            lru = sorted(self._entries, key=lambda k: self._entries[k]['used'])
+            for k in lru[:len(self._entries) - self.max_entries]:
+                del self._entries[k]
+        self._dirty = True
+
+    def save(self):
+        if not self.cache_file or not self._dirty:
+            return
+        try:
+            os.makedirs(dirname(self.cache_file), exist_ok=True)
+            tmpfile = f'{self.cache_file}.{os.getpid()}'
+            with open(tmpfile, 'w') as f:
+                json.dump(self._entries, f)
+            os.replace(tmpfile, self.cache_file)
+        except OSError as e:
+            print(f"Could not write asset cache {self.cache_file}: {e}")
+        self._dirty = False
+
+    def clear(self):
+        self._entries = {}
+        self._dirty = True
+
+
+def _env_int(name, default):
+    value = os.environ.get(name, '')
+    if value == '':
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        print(f"Ignoring {name}={value}, not an integer")
+        return default
+
+
+def get_asset_cache():
+    """Return the process wide AssetCache"""
+    global _asset_cache
+    if _asset_cache is None:
+        _asset_cache = AssetCache(
+            os.environ.get(CACHE_ENV, DEFAULT_CACHE_FILE),
+            ttl=_env_int(TTL_ENV, DEFAULT_TTL),
+            max_entries=_env_int(MAX_ENTRIES_ENV, DEFAULT_MAX_ENTRIES),
+        )
+    return _asset_cache
+
+
+def asset_cache_counts():
+    """Return the (hits, misses) of the process wide AssetCache so far"""
+    cache = get_asset_cache()
+    return cache.hits, cache.misses
+
+
+def report_asset_cache(since=(0, 0)):
+    """Print the hits and misses of the process wide AssetCache since the
+    asset_cache_counts since, if there were any"""
+    cache = get_asset_cache()
+    hits = cache.hits - since[0]
+    misses = cache.misses - since[1]
+    if hits + misses > 0:
+        print(f"Asset cache {cache.cache_file}: {hits} hits, {misses} misses")
+
+
+def resolve_asset_file(data_file, verbose = False, use_cache = True, refresh_cache = False):
+    """Resolve data_file, which may be an asset:// or file:// URI or a
+    plain path, to a file name.
+
+    asset:// lookups are answered from the asset cache when possible.
+    use_cache=False bypasses the cache entirely and refresh_cache=True
+    ignores any cached result but stores the new one."""
     from urllib.parse import urlparse, parse_qsl
     data_file_url = urlparse(data_file)
 
@@ -14,9 +154,22 @@ def resolve_asset_file(data_file, verbose = False):
 
     if data_file_url.scheme == 'asset':
         asset_query = dict(parse_qsl(data_file_url.query))
-        asset_db = Database('/cvmfs/dunedaq.opensciencegrid.org/assets/dunedaq-asset-db.sqlite')
         asset_query['status'] = 'valid'
 
+        cache = get_asset_cache()
+        if use_cache and not refresh_cache:
+            cached = cache.get(asset_query)
+            if verbose:
+                print(f"Asset cache hits={cache.hits} misses={cache.misses}")
+            if cached is not None:
+                if verbose:
+                    print(f"Found asset in cache {cached}")
+                cache.save()
+                return cached
+
+        from sqlite3 import OperationalError
+
+        asset_db = get_asset_db()
         try:
             files = asset_db.get_files(asset_query)
             if not files:
@@ -29,7 +182,11 @@ def resolve_asset_file(data_file, verbose = False):
                 print(f"Found asset in {dirname(asset_db.database_file)}")
 
             root_dir = dirname(asset_db.database_file)
-            return f'{root_dir}/{files[0]["path"]}/{files[0]["name"]}'
+            filename = f'{root_dir}/{files[0]["path"]}/{files[0]["name"]}'
+            if use_cache:
+                cache.put(asset_query, filename)
+                cache.save()
+            return filename
 
         except OperationalError:
             raise RuntimeError(f"Couldn\'t find the asset {data_file}")
@@ -0,0 +1,96 @@
+from oksconfgen.instrument import get_profiler, phase
+
+
+class ObjectBatch:
+    """Staging buffer for DAL objects destined for an
+    oksdbinterfaces.Configuration.
+
+    Objects are collected with add(), deduplicated by (class, uid) and
+    written by flush() with a single non-recursive update_dal call each,
+    instead of every generator calling db.update_dal (which by default
+    re-writes every object reachable through relationships) for each
+    object it creates.
+
+    Re-adding an object with an existing (class, uid) replaces the staged
+    one. flush() writes the objects in the order they were first added
+    except that any staged object referred to through a relationship is
+    written before the object referring to it.
+
+    A batch created with ordered=True trusts the caller to add related
+    objects before the objects referring to them and writes the staged
+    objects in order without walking their relationships."""
+
+    def __init__(self, db, recurse=False, ordered=False):
+        self.db = db
+        self.recurse = recurse
+        self.ordered = ordered
+        self._staged = {}
+        self.written = 0
+
+    def add(self, *dals):
+        for dal in dals:
+            self._staged[(dal.className(), dal.id)] = dal
+
+    def get(self, class_name, uid):
+        """Return the staged object (class_name, uid) or None"""
+        return self._staged.get((class_name, uid))
+
+    def __contains__(self, key):
+        return key in self._staged
+
+    def __len__(self):
+        return len(self._staged)
+
+    def _related(self, dal):
+        for value in vars(dal).values():
+            for obj in value if isinstance(value, list) else [value]:
+                if hasattr(obj, "className") and hasattr(obj, "id"):
+                    key = (obj.className(), obj.id)
+                    if key in self._staged:
+                        yield key
+
+    def flush(self):
+        """Write all staged objects to the database"""
+        with phase("update_dal"):
+            self._flush()
+
+    def _flush(self):
+        get_profiler().count_objects(self._staged.values())
+        if self.ordered:
+            for dal in self._staged.values():
+                self.db.update_dal(dal, recurse=self.recurse)
+            self.written += len(self._staged)
+            self._staged = {}
+            return
+        done = set()
+        for key in self._staged:
+            if key in done:
+                continue
+            # Depth first walk so that related objects are written first
+            done.add(key)
+            stack = [(key, self._related(self._staged[key]))]
+            while stack:
+                current, related = stack[-1]
+                for next_key in related:
+                    if next_key not in done:
+                        done.add(next_key)
+                        stack.append((next_key, self._related(self._staged[next_key])))
+                        break
+                else:
+                    stack.pop()
+                    self.db.update_dal(self._staged[current], recurse=self.recurse)
+        self.written += len(self._staged)
+        self._staged = {}
+
+    def discard(self):
+        """Drop the staged objects and, writing with an OksWriter, the
+        file written so far"""
+        self._staged = {}
+        if hasattr(self.db, "discard"):
+            self.db.discard()
+
+    def commit(self):
+        """Flush the staged objects and commit the database"""
+        self.flush()
+        with phase("commit"):
+            self.db.commit()
@@ -0,0 +1,105 @@
+import os
+
+from oksconfgen.includes import find_file
+
+# (module name, schema file) -> (stamp, DAL module, schema files)
+_dal_modules = {}
+# database file -> (stamp, Configuration)
+_databases = {}
+
+
+def _mtime(filename, relative_to=None):
+    path = find_file(filename, relative_to)
+    if path is None:
+        return None
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _stamp(files):
+    return [(f, _mtime(f, relative_to)) for f, relative_to in files]
+
+
+def _schema_files(schemafile):
+    """(file, including file) for schemafile and every schema it includes"""
+    from oksconfgen.fingerprint import file_record
+
+    files = []
+    seen = set()
+    stack = [(schemafile, None)]
+    while stack:
+        path, including = stack.pop()
+        filename = find_file(path, including)
+        if filename is None:
+            files.append((path, including))
+            continue
+        filename = os.path.abspath(filename)
+        if filename in seen:
+            continue
+        seen.add(filename)
+        files.append((path, including))
+        stack.extend((include, filename) for include in reversed(file_record(filename)[3]))
+    return files
+
+
+def get_dal_module(schemafile, name="generated"):
+    """Return oksdbinterfaces.dal.module(name, schemafile). The module is
+    generated once per process and reused for as long as neither the
+    schema file nor any schema it includes has changed, which matters in
+    the daemon."""
+    import oksdbinterfaces
+
+    cached = _dal_modules.get((name, schemafile))
+    if cached is None or cached[0] != _stamp(cached[2]):
+        files = _schema_files(schemafile)
+        cached = (_stamp(files), oksdbinterfaces.dal.module(name, schemafile), files)
+        _dal_modules[(name, schemafile)] = cached
+    return cached[1]
+
+
+def _included_files(db, oksfile):
+    """(file, including file) for oksfile and everything it includes"""
+    files = [(oksfile, None)]
+    seen = {oksfile}
+    stack = [oksfile]
+    while stack:
+        current = stack.pop()
+        try:
+            includes = db.get_includes(current)
+        except Exception:
+            continue
+        for include in includes:
+            if include not in seen:
+                seen.add(include)
+                files.append((include, current))
+                stack.append(include)
+    return files
+
+
+def get_database(oksfile):
+    """Return an oksdbinterfaces.Configuration of oksfile for reading.
+
+    The Configuration is reused for as long as neither oksfile nor any
+    file it includes has changed, so callers must not modify it."""
+    import oksdbinterfaces
+
+    key = os.path.abspath(oksfile)
+    cached = _databases.get(key)
+    if cached is not None and cached[0] == _stamp(cached[2]):
+        return cached[1]
+    db = oksdbinterfaces.Configuration("oksconfig:" + oksfile)
+    files = _included_files(db, oksfile)
+    _databases[key] = (_stamp(files), db, files)
+    return db
+
+
+def stats():
+    return {"dal_modules": len(_dal_modules), "databases": len(_databases)}
+
+
+def clear():
+    """Drop all cached DAL modules and databases"""
+    _dal_modules.clear()
+    _databases.clear()
@@ -1,83 +1,213 @@
-import oksdbinterfaces
-import sys
+from collections import namedtuple
 
+from oksconfgen.batch import ObjectBatch
+from oksconfgen.cache import get_dal_module
+from oksconfgen.include_graph import get_include_graph
+from oksconfgen.instrument import get_profiler, phase
 
-def get_all_includes(db, file):
-    includes = db.get_includes(file)
-    for include in includes:
-        if "data.xml" in include:
-            includes += get_all_includes(db, include)
 
-    return list(set(includes))
+def get_all_includes(db, file, name=None):
+    """Return every file included directly or indirectly by file (the top
+    level file of db if None), included files first"""
+    return get_include_graph().walk(db, file, name)
 
 
-def consolidate_db(oksfile, output_file):
-    sys.setrecursionlimit(10000)  # for example
+def consolidate_db(oksfile, output_file, include_graph=None):
+    import oksdbinterfaces
+
     print("Reading database")
-    db = oksdbinterfaces.Configuration("oksconfig:" + oksfile)
+    with phase("load"):
+        db = oksdbinterfaces.Configuration("oksconfig:" + oksfile)
 
     schemafiles = []
-    includes = get_all_includes(db, None)
+    with phase("include resolution"):
+        includes = get_all_includes(db, None, oksfile)
+    if include_graph is not None:
+        get_include_graph().dump(include_graph)
     schemafiles += [i for i in includes if "schema.xml" in i]
     print(f"Included schemas: {schemafiles}")
 
     print("Creating new database")
-    new_db = oksdbinterfaces.Configuration("oksconfig")
-    new_db.create_db(output_file, schemafiles)
+    with phase("create_db"):
+        new_db = oksdbinterfaces.Configuration("oksconfig")
+        new_db.create_db(output_file, schemafiles)
 
-    new_db.commit()
+        new_db.commit()
 
     print("Reading dal objects from old db")
-    dals = db.get_all_dals()
+    with phase("load"):
+        dals = db.get_all_dals()
 
     print(f"Copying objects to new db")
     for dal in dals:
 
         print(f"Loading object {dal} into cache")
-        db.get_dal(dals[dal].className(), dals[dal].id)
+        with phase("load"):
+            db.get_dal(dals[dal].className(), dals[dal].id)
 
         print(f"Copying object: {dal}")
-        new_db.add_dal(dals[dal])
+        with phase("update_dal"):
+            new_db.add_dal(dals[dal])
+    get_profiler().count_objects(dals.values())
 
     print("Saving database")
-    new_db.commit()
+    with phase("commit"):
+        new_db.commit()
+    get_profiler().add_output(output_file)
     print("DONE")
 
 
-def consolidate_files(oksfile, *input_files):
+# Reference to another object in an ObjectRecord
+ObjectRef = namedtuple("ObjectRef", ["class_name", "uid"])
+
+# Picklable copy of a DAL object, relationships are held as ObjectRefs
+ObjectRecord = namedtuple("ObjectRecord", ["class_name", "uid", "values"])
+
+
+def _encode_value(value):
+    if hasattr(value, "className") and hasattr(value, "id"):
+        return ObjectRef(value.className(), value.id)
+    return value
+
+
+def encode_dal(dal):
+    """Return an ObjectRecord holding the attributes and relationships
+    of dal"""
+    values = {}
+    for name, value in vars(dal).items():
+        if name == "id" or name.startswith("_"):
+            continue
+        if isinstance(value, list):
+            values[name] = [_encode_value(v) for v in value]
+        else:
+            values[name] = _encode_value(value)
+    return ObjectRecord(dal.className(), dal.id, values)
+
+
+def load_database(input_file):
+    """Load input_file and return its includes and ObjectRecords for all
+    of its objects. Run in a worker process by consolidate_files."""
+    import oksdbinterfaces
+
+    db = oksdbinterfaces.Configuration("oksconfig:" + input_file)
+    includes = get_all_includes(db, None, input_file)
+    dals = db.get_all_dals()
+    return includes, [encode_dal(dals[dal]) for dal in dals], get_include_graph().edges
+
+
+def decode_records(records, dal_classes, db):
+    """Rebuild DAL objects from ObjectRecords. ObjectRefs are resolved
+    against the rebuilt objects first and then against db."""
+    dals = {}
+    for record in records:
+        attributes = {
+            name: value for name, value in record.values.items()
+            if not isinstance(value, ObjectRef)
+            and not (isinstance(value, list) and any(isinstance(v, ObjectRef) for v in value))
+        }
+        dals[(record.class_name, record.uid)] = dal_classes[record.class_name](record.uid, **attributes)
+
+    def resolve(ref):
+        if ref in dals:
+            return dals[ref]
+        dals[ref] = db.get_dal(ref.class_name, ref.uid)
+        return dals[ref]
+
+    for record in records:
+        dal = dals[(record.class_name, record.uid)]
+        for name, value in record.values.items():
+            if isinstance(value, ObjectRef):
+                setattr(dal, name, resolve(value))
+            elif isinstance(value, list) and any(isinstance(v, ObjectRef) for v in value):
+                setattr(dal, name, [resolve(v) for v in value])
+    return [dals[(record.class_name, record.uid)] for record in records]
+
+
+def get_dal_classes(schemafiles):
+    """Return a class name -> DAL class dictionary for all classes defined
+    by schemafiles"""
+    dal_classes = {}
+    for schemafile in schemafiles:
+        module = get_dal_module(schemafile, "consolidated")
+        for name in dir(module):
+            if name not in dal_classes and isinstance(getattr(module, name), type):
+                dal_classes[name] = getattr(module, name)
+    return dal_classes
+
+
+def consolidate_files(oksfile, *input_files, workers=1, include_graph=None):
+    """Consolidate the objects of all input_files into oksfile. With
+    workers > 1 the input databases are loaded in that many worker
+    processes and their objects merged in one pass. If include_graph is
+    given the include graph of the input files is written to it."""
+    import oksdbinterfaces
+
     includes = []
     dbs = []
 
     print(f"Consolidating {len(input_files)} databases into output database {oksfile}. Input databases: {input_files}")
-    sys.setrecursionlimit(10000)  # for example
-
-    for input_file in input_files:
-        dbs.append(oksdbinterfaces.Configuration("oksconfig:" + input_file))
-        includes += get_all_includes(dbs[len(dbs) - 1], None)
-        
-    includes = list(set(includes))
-    includes = [i for i in includes if i not in input_files]    
-    print(f"Included files: {includes}")
 
-    new_db = oksdbinterfaces.Configuration("oksconfig")
-    new_db.create_db(oksfile, includes)
-
-    new_db.commit()
-
-    for db in dbs:
-        #print(f"Reading dal objects from old db")
-        dals = db.get_all_dals()
+    graph = get_include_graph()
+    if workers > 1:
+        from concurrent.futures import ProcessPoolExecutor
+
+        print(f"Loading input databases with {workers} workers")
+        with phase("load"), ProcessPoolExecutor(max_workers=workers) as executor:
+            loaded = list(executor.map(load_database, input_files))
+        for file_includes, records, edges in loaded:
+            includes += file_includes
+            for file in edges:
+                graph.edges.setdefault(file, edges[file])
+    else:
+        for input_file in input_files:
+            with phase("load"):
+                dbs.append(oksdbinterfaces.Configuration("oksconfig:" + input_file))
+            with phase("include resolution"):
+                includes += get_all_includes(dbs[len(dbs) - 1], None, input_file)
+
+    if include_graph is not None:
+        graph.dump(include_graph)
+
+    # Keep the first occurrence of each file, which comes after the files it includes
+    includes = list(dict.fromkeys(includes))
+    includes = [i for i in includes if i not in input_files]
+    print(f"Included files: {includes}")
 
-        #print(f"Copying objects to new db")
-        for dal in dals:
+    with phase("create_db"):
+        new_db = oksdbinterfaces.Configuration("oksconfig")
+        new_db.create_db(oksfile, includes)
 
-            try: 
-                new_db.get_dal(dals[dal].className(), dals[dal].id)
-                #print(f"ERROR: Database already contains object {dals[dal].id} of type {dals[dal].className()}")                
-            except:            
-                #print(f"Copying object: {dal}")
-                new_db.add_dal(dals[dal])
         new_db.commit()
 
+        # Objects already provided by the included files are not copied
+        existing = new_db.get_all_dals()
+        seen = set((existing[dal].className(), existing[dal].id) for dal in existing)
+    batch = ObjectBatch(new_db)
+
+    with phase("merge"):
+        if workers > 1:
+            records = []
+            for file_includes, file_records, edges in loaded:
+                for record in file_records:
+                    key = (record.class_name, record.uid)
+                    if key not in seen:
+                        seen.add(key)
+                        records.append(record)
+            dal_classes = get_dal_classes([i for i in includes if "schema.xml" in i])
+            batch.add(*decode_records(records, dal_classes, new_db))
+
+        for db in dbs:
+            #print(f"Reading dal objects from old db")
+            dals = db.get_all_dals()
+
+            #print(f"Copying objects to new db")
+            for dal in dals:
+                key = (dals[dal].className(), dals[dal].id)
+                if key not in seen:
+                    #print(f"Copying object: {dal}")
+                    seen.add(key)
+                    batch.add(dals[dal])
+
     print(f"Saving database {oksfile}")
-    new_db.commit()
\ No newline at end of file
+    batch.commit()
+    get_profiler().add_output(oksfile)
@@ -1,6 +1,5 @@
-import oksdbinterfaces
-import os
-import glob
+from oksconfgen.includes import find_include, get_index, search_dirs
+from oksconfgen.instrument import get_profiler, phase
 
 
 def generate_file(oksfile, include):
@@ -10,35 +9,26 @@ def generate_file(oksfile, include):
 
     includefiles = ["schema/coredal/dunedaq.schema.xml"]
 
-    searchdirs = [path for path in os.environ["DUNEDAQ_SHARE_PATH"].split(":")]
-    searchdirs.append(os.path.dirname(oksfile))
-    for inc in include:
-        # print (f"Searching for {inc}")
-        match = False
-        inc = inc.removesuffix(".xml")
-        if inc.endswith(".data"):
-            ftype = "data"
-        elif inc.endswith(".schema"):
-            ftype = "schema"
-        else:
-            ftype = "*"
-            inc = inc + "*"
-        for path in searchdirs:
-            matches = glob.glob(f"{inc}.xml", root_dir=path)
-            if len(matches) == 0:
-                matches = glob.glob(f"{ftype}/{inc}.xml", root_dir=path)
+    with phase("include resolution"):
+        searchdirs = search_dirs(oksfile)
+        for inc in include:
+            # print (f"Searching for {inc}")
+            matches = find_include(inc, searchdirs, data_dirs=["data"])
             for filename in matches:
                 print(f"Adding {filename} to include list")
                 includefiles.append(filename)
-                match = True
-            if match:
-                break
-        if not match:
-            print(f"Error could not find include file for {inc}")
-            return
-    db = oksdbinterfaces.Configuration("oksconfig")
+            if len(matches) == 0:
+                print(f"Error could not find include file for {inc}")
+                return
+        get_index().save()
     if not oksfile.endswith(".data.xml"):
         oksfile = oksfile + ".data.xml"
     print(f"Creating OKS database file {oksfile}")
-    db.create_db(oksfile, includefiles)
-    db.commit()
+    import oksdbinterfaces
+
+    with phase("create_db"):
+        db = oksdbinterfaces.Configuration("oksconfig")
+        db.create_db(oksfile, includefiles)
+    with phase("commit"):
+        db.commit()
+    get_profiler().add_output(oksfile)
@@ -0,0 +1,203 @@
+import json
+import os
+import socket
+import sys
+from importlib import import_module
+
+# Client side, imported by every script. The server side is in
+# oksconfgen.daemon_server, only imported by serve.
+
+# Socket of the daemon, default $XDG_RUNTIME_DIR/oksconfgen-<uid>.sock
+SOCKET_ENV = "OKSCONFGEN_DAEMON_SOCKET"
+# Set to "off" to stop the scripts from using a running daemon
+DAEMON_ENV = "OKSCONFGEN_DAEMON"
+
+# operation -> (module, function) run for it by the daemon
+OPERATIONS = {
+    "createOKSdb": ("oksconfgen.createOKSdb", "generate_file"),
+    "generate_readoutOKS": ("oksconfgen.generate_readoutOKS", "generate_readout"),
+    "dromap2oks": ("oksconfgen.dromap2oks", "dro_json_to_oks"),
+    "check_map": ("oksconfgen.map_check", "check_map"),
+    "generate_hwmap": ("oksconfgen.generate_hwmap", "generate_hwmap"),
+    "generate_hosts": ("oksconfgen.generate_hosts", "generate_hosts"),
+    "consolidate": ("oksconfgen.consolidate", "consolidate_db"),
+    "consolidate_files": ("oksconfgen.consolidate", "consolidate_files"),
+    "oks_enable": ("oksconfgen.enable", "enable"),
+    "oks_enable_manifest": ("oksconfgen.enable", "enable_manifest"),
+    "get_apps": ("oksconfgen.get_session_apps", "get_database_apps"),
+    "get_app_inventory": ("oksconfgen.get_session_apps", "get_app_inventory"),
+    "get_enabled": ("oksconfgen.resource_tree", "get_effective_state"),
+    "oks_diff": ("oksconfgen.oks_diff", "oks_diff"),
+}
+
+# Environment variables the operations depend on. The daemon only runs
+# a request if the client's values of all of them, and the oksconfgen
+# sources (fingerprint.code_fingerprint), match its own.
+ENVIRONMENT = [
+    "PYTHONPATH",
+    "DUNEDAQ_SHARE_PATH",
+    "DUNEDAQ_DB_PATH",
+    "TDAQ_DB_PATH",
+    "OKSCONFGEN_INCLUDE_CACHE",
+    "OKSCONFGEN_ASSET_CACHE",
+    "OKSCONFGEN_ASSET_CACHE_TTL",
+    "OKSCONFGEN_ASSET_CACHE_ENTRIES",
+    "XDG_CACHE_HOME",
+]
+
+# Schemas loaded when the daemon starts
+PRELOAD_SCHEMAS = [
+    "schema/appdal/fdmodules.schema.xml",
+]
+
+
+def socket_path():
+    if os.environ.get(SOCKET_ENV):
+        return os.environ[SOCKET_ENV]
+    run_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if not run_dir:
+        import tempfile
+        run_dir = tempfile.gettempdir()
+    return os.path.join(run_dir, f"oksconfgen-{os.getuid()}.sock")
+
+
+def environment():
+    """Return the values of the ENVIRONMENT variables, "" if unset"""
+    return {name: os.environ.get(name, "") for name in ENVIRONMENT}
+
+
+def _send(f, message):
+    f.write((json.dumps(message, default=str) + "\n").encode())
+    f.flush()
+
+
+def _connect(path, timeout=0.5):
+    try:
+        owner = os.stat(path).st_uid
+    except OSError:
+        return None
+    if owner != os.getuid():
+        # Anyone can create the socket in a shared directory such as /tmp
+        print(f"Not using the daemon socket {path}, it belongs to another user", file=sys.stderr)
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(path)
+    except OSError:
+        sock.close()
+        return None
+    sock.settimeout(None)
+    return sock
+
+
+def request(message, path=None):
+    """Send message to the daemon and return its reply (printing any
+    output and error output it sends), or None if no daemon is listening
+    on path"""
+    sock = _connect(path or socket_path())
+    if sock is None:
+        return None
+    with sock, sock.makefile("rwb") as f:
+        _send(f, message)
+        for line in f:
+            reply = json.loads(line)
+            if "stdout" in reply:
+                sys.stdout.write(reply["stdout"])
+                sys.stdout.flush()
+            elif "stderr" in reply:
+                sys.stderr.write(reply["stderr"])
+                sys.stderr.flush()
+            else:
+                return reply
+    return None
+
+
+def run_in_daemon(operation, args, kwargs=None, profile=False, profile_json=None):
+    """Run operation (see OPERATIONS) in the daemon if one is running.
+
+    Returns (True, result of the operation) if the daemon ran it, having
+    printed its output, or (False, None) if the caller has to run it
+    itself: no daemon is running, it was disabled with OKSCONFGEN_DAEMON=off
+    or the daemon has different values of the ENVIRONMENT variables or
+    oksconfgen sources. Exits if the operation failed in the daemon.
+
+    Only the output the operation writes to sys.stdout and sys.stderr is
+    passed on; output written directly to the file descriptors, such as
+    that of the C++ OKS libraries, goes to the daemon's terminal."""
+    if os.environ.get(DAEMON_ENV, "") == "off":
+        return False, None
+    from oksconfgen.fingerprint import code_fingerprint
+
+    reply = request({
+        "operation": operation,
+        "args": list(args),
+        "kwargs": kwargs or {},
+        "cwd": os.getcwd(),
+        "environment": environment(),
+        "code": code_fingerprint(),
+        "profile": profile,
+        "profile_json": profile_json,
+    })
+    if reply is None or reply.get("fallback"):
+        return False, None
+    if "error" in reply:
+        print(reply["error"], file=sys.stderr)
+        sys.exit(1)
+    return True, reply.get("result")
+
+
+def run_operation(operation, args, kwargs=None, profile=False, profile_json=None):
+    """Run operation (see OPERATIONS) with args and kwargs in the daemon if
+    one is running (see run_in_daemon) and in this process otherwise,
+    profiling it if asked to. Returns the result of the operation."""
+    handled, result = run_in_daemon(operation, args, kwargs, profile, profile_json)
+    if handled:
+        return result
+    from oksconfgen.instrument import enable_profiling, report_profile
+
+    if profile or profile_json:
+        enable_profiling()
+    result = _call(operation, args, kwargs)
+    report_profile(profile_json)
+    return result
+
+
+def _call(operation, args, kwargs):
+    module_name, function_name = OPERATIONS[operation]
+    return getattr(import_module(module_name), function_name)(*args, **(kwargs or {}))
+
+
+def serve(path=None):
+    """Run the daemon on the Unix socket path until asked to shut down"""
+    path = path or socket_path()
+    if _connect(path) is not None:
+        print(f"A daemon is already listening on {path}")
+        return
+    if os.path.exists(path):
+        os.unlink(path)
+
+    from oksconfgen.cache import get_dal_module
+    from oksconfgen.daemon_server import DaemonServer
+    from oksconfgen.fingerprint import code_fingerprint
+
+    # Fingerprint the sources now, before they can change under the
+    # modules this process has loaded
+    code_fingerprint()
+
+    for schema in PRELOAD_SCHEMAS:
+        try:
+            get_dal_module(schema)
+        except Exception as e:
+            print(f"Could not preload {schema}: {e}")
+
+    server = DaemonServer(path)
+    print(f"oksconfgen daemon listening on {path}")
+    try:
+        while server.running:
+            server.handle_request()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(path)
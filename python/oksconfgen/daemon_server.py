@@ -0,0 +1,104 @@
+import json
+import os
+import socketserver
+import traceback
+from contextlib import redirect_stderr, redirect_stdout
+
+from oksconfgen.daemon import OPERATIONS, _call, _send, environment
+from oksconfgen.fingerprint import code_fingerprint
+
+
+class _OutputWriter:
+    """File-like object forwarding the output (stream "stdout") or error
+    output ("stderr") of an operation to the client"""
+
+    def __init__(self, f, stream="stdout"):
+        self.f = f
+        self.stream = stream
+
+    def write(self, text):
+        if text:
+            _send(self.f, {self.stream: text})
+        return len(text)
+
+    def flush(self):
+        pass
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            message = json.loads(self.rfile.readline())
+        except ValueError:
+            return
+        operation = message.get("operation")
+        if operation == "ping":
+            _send(self.wfile, {"result": self.server.status()})
+        elif operation == "shutdown":
+            self.server.running = False
+            _send(self.wfile, {"result": "stopping"})
+        elif operation not in OPERATIONS:
+            _send(self.wfile, {"error": f"Unknown operation {operation}"})
+        else:
+            theirs = message.get("environment") or {}
+            differ = [name for name, value in environment().items() if theirs.get(name, "") != value]
+            if message.get("code") != code_fingerprint():
+                differ.append("oksconfgen sources")
+            if len(differ) > 0:
+                _send(self.wfile, {"fallback": f"Not the daemon's {', '.join(differ)}"})
+            else:
+                _send(self.wfile, self.server.run(message, self.wfile))
+
+
+class DaemonServer(socketserver.UnixStreamServer):
+    """Unix socket server running the oksconfgen operations one at a time
+    in a single long lived process, so that the modules imported, the DAL
+    modules generated from the schemas, the read only databases and the
+    include index stay loaded between invocations.
+
+    Directory listings, DAL modules and databases are reloaded once the
+    files they came from have changed (by mtime)."""
+
+    def __init__(self, path):
+        self.path = path
+        self.running = True
+        self.requests = 0
+        old_umask = os.umask(0o077)
+        try:
+            super().__init__(path, _Handler)
+        finally:
+            os.umask(old_umask)
+
+    def status(self):
+        from oksconfgen import cache
+        return {
+            "pid": os.getpid(),
+            "socket": self.path,
+            "environment": environment(),
+            "code": code_fingerprint(),
+            "requests": self.requests,
+            **cache.stats(),
+        }
+
+    def run(self, message, f):
+        from oksconfgen.include_graph import reset_include_graph
+        from oksconfgen.includes import get_index
+        from oksconfgen.instrument import enable_profiling, report_profile, reset_profiling
+
+        self.requests += 1
+        cwd = os.getcwd()
+        try:
+            os.chdir(message["cwd"])
+            get_index().refresh()
+            reset_include_graph()
+            reset_profiling()
+            with redirect_stdout(_OutputWriter(f)), redirect_stderr(_OutputWriter(f, "stderr")):
+                if message.get("profile") or message.get("profile_json"):
+                    enable_profiling()
+                result = _call(message["operation"], message["args"], message["kwargs"])
+                report_profile(message.get("profile_json"))
+            return {"result": result}
+        except Exception:
+            return {"error": traceback.format_exc()}
+        finally:
+            os.chdir(cwd)
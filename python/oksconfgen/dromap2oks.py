@@ -1,248 +1,536 @@
-import oksdbinterfaces
 import os
 import json
 import sys
 
-def dro_json_to_oks(jsonfile, oksfile, source_id_offset, nomap, lcores):
-    """Simple script to convert a JSON readout map file to an OKS file."""
+from oksconfgen.batch import ObjectBatch
+from oksconfgen.cache import get_dal_module
+from oksconfgen.instrument import get_profiler, phase
+from oksconfgen.lcores import DEFAULT_LCORES
+
+
+def iter_json_array(f, chunk_size=1 << 16):
+    """Generator yielding the elements of the JSON array in the open file
+    f one at a time, reading it chunk_size characters at a time so that
+    only the element being decoded is held in memory"""
+    decoder = json.JSONDecoder()
+    buffer = ""
+    pos = 0
+    started = False
+    eof = False
+    while True:
+        # Skip whitespace and separators, reading more input as needed
+        while True:
+            while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                pos += 1
+            if pos < len(buffer) or eof:
+                break
+            buffer = f.read(chunk_size)
+            pos = 0
+            eof = buffer == ""
+        if eof and pos >= len(buffer):
+            raise ValueError("Unexpected end of file in JSON array")
+        if not started:
+            if buffer[pos] != "[":
+                raise ValueError("Readout map file is not a JSON array")
+            started = True
+            pos += 1
+            continue
+        if buffer[pos] == "]":
+            return
+        while True:
+            try:
+                element, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                more = f.read(chunk_size)
+                eof = more == ""
+                buffer = buffer[pos:] + more
+                pos = 0
+                continue
+            # A number may have been cut short at the end of the buffer
+            if not eof and buffer[end:].strip("0123456789+-.eE") == "":
+                more = f.read(chunk_size)
+                if more != "":
+                    buffer = buffer[pos:] + more
+                    pos = 0
+                    continue
+                eof = True
+            break
+        yield element
+        pos = end
+
+
+def _geo_dal(dal, source_id, geo_id):
+    return dal.GeoId(f"geoId-{source_id}",
+                     detector_id=geo_id["det_id"],
+                     crate_id=geo_id["crate_id"],
+                     slot_id=geo_id["slot_id"],
+                     stream_id=geo_id["stream_id"]
+                     )
+
+
+def partition_json_to_oks(jsonfile, dal, batch, group_name, source_id_offset, lcores, interface_streams,
+                          host_nics, allocator=None):
+    """Convert the readout map jsonfile grouping its streams by interface
+    whatever the order of the entries, and return the ReadoutGroups.
+
+    interface_streams and host_nics are those of a
+    map_check.MapChecker scan of the map. The streams of each NIC
+    (rx_host, rx_mac) or Felix card/slr are buffered until the last of
+    them is read, then the interface is written with its streams in
+    source_id order and the buffer dropped. Identical Ethernet stream
+    parameters of a NIC share one EthStreamParameters (and so one
+    rx_queue) however they are spread over the map. NICs sharing an
+    rx_host are named nic-<rx_host>-<n>, n counting their rx_macs in
+    sorted order. Hermes controllers are written last, one per tx_host.
+    The lcores of the rx_queues are assigned by allocator (an
+    lcores.LcoreAllocator) if given, else dealt out from lcores."""
+
+    groups = []
+    # interface -> [(source_id, src_id, geo_id, parameters key)]
+    open_streams = {}
+    # parameters key -> parameters, for the open interfaces
+    parameters = {}
+    common = {}
+    # tx_host -> {tx_mac: (source_id, stream, nic)} and -> (source_id, geo_id) of its last stream
+    hermes_links = {}
+    hermes_last = {}
+
+    def add_eth(interface, streams):
+        rx_host, rx_mac = interface[1:]
+        if len(common) == 0:
+            common["stats"] = dal.NICStatsConf(f"nicStats-{group_name}")
+            common["config"] = dal.NICInterfaceConfiguration(
+                f"nicConfig-{group_name}",
+                stats_conf=common["stats"]
+            )
+            common["addrtab"] = dal.IpbusAddressTable("Hermes-addrtab")
+            batch.add(*common.values())
+        macs = sorted(host_nics[rx_host])
+        nic_id = f"nic-{rx_host}" if len(macs) == 1 else f"nic-{rx_host}-{macs.index(rx_mac)}"
+        first = parameters[streams[0][3]]
+        nic_dal = dal.NICInterface(
+            nic_id,
+            rx_hostname=rx_host,
+            rx_mac=rx_mac,
+            rx_ip=first["rx_ip"],
+            rx_iface=first["rx_iface"],
+            rx_pcie_addr=first["rx_pcie_dev"],
+            contains=[],
+            configuration=common["config"]
+        )
+        # parameters key -> EthStreamParameters, the rx_queues in order of first source_id
+        stream_pars = {}
+        queue_streams = {}
+        for source_id, src_id, geo_id, key in streams:
+            queue_streams[key] = queue_streams.get(key, 0) + 1
+            if key not in stream_pars:
+                pars = parameters[key]
+                rx_queue = len(stream_pars)
+                stream_pars[key] = dal.EthStreamParameters(
+                    f"pars-{source_id}",
+                    protocol=pars["protocol"],
+                    mode=pars["mode"],
+                    tx_hostname=pars["tx_host"],
+                    tx_mac=pars["tx_mac"],
+                    tx_ip=pars["tx_ip"],
+                    lcore=lcores[rx_queue % len(lcores)],
+                    rx_queue=rx_queue
+                )
+                last_pars_source_id = source_id
+            geo_dal = _geo_dal(dal, source_id, geo_id)
+            stream = dal.DROStreamConf(
+                f"DROStream-{source_id}",
+                source_id=src_id,
+                stream_params=stream_pars[key],
+                geo_id=geo_dal
+            )
+            batch.add(geo_dal, stream_pars[key], stream)
+            nic_dal.contains.append(stream)
+
+            pars = parameters[key]
+            links = hermes_links.setdefault(pars["tx_host"], {})
+            if pars["tx_mac"] not in links:
+                links[pars["tx_mac"]] = (source_id, stream, nic_dal)
+            last = hermes_last.get(pars["tx_host"])
+            if last is None or source_id > last[0]:
+                hermes_last[pars["tx_host"]] = (source_id, geo_id)
+        if allocator is not None:
+            assigned = allocator.assign(rx_host, rx_mac, first["rx_pcie_dev"], list(queue_streams.values()))
+            for pars_dal, lcore in zip(stream_pars.values(), assigned):
+                pars_dal.lcore = lcore
+        print(f"Adding nic {rx_mac} with id {nic_id}")
+        batch.add(nic_dal)
+        return nic_dal, last_pars_source_id
+
+    def add_felix(interface, streams):
+        felix_dal = dal.FelixInterface(
+            f"felix-{streams[-1][0]}",
+            card=interface[1],
+            slr=interface[2],
+            contains=[]
+        )
+        for source_id, src_id, geo_id, key in streams:
+            pars = parameters[key]
+            stream_pars = dal.FelixStreamParameters(
+                f"flxpars-{source_id}",
+                protocol=pars["protocol"],
+                mode=pars["mode"],
+                link=pars["link"]
+            )
+            geo_dal = _geo_dal(dal, source_id, geo_id)
+            stream = dal.DROStreamConf(
+                f"DROStream-{source_id}",
+                source_id=src_id,
+                stream_params=stream_pars,
+                geo_id=geo_dal
+            )
+            batch.add(geo_dal, stream_pars, stream)
+            felix_dal.contains.append(stream)
+        print(f"Adding FelixInterface {felix_dal.id} slr={interface[2]}")
+        batch.add(felix_dal)
+        return felix_dal, streams[-1][0]
+
+    with open(jsonfile) as f, phase("build"):
+        for entry in iter_json_array(f):
+            kind = entry["kind"]
+            pars = entry["parameters"]
+            if kind == "eth":
+                interface = ("eth", pars["rx_host"], pars["rx_mac"])
+            elif kind == "flx":
+                interface = ("flx", pars["card"], pars["slr"])
+            else:
+                raise RuntimeError(f'Unknown kind of readout {kind}!')
+            key = tuple(sorted(pars.items()))
+            parameters.setdefault(key, pars)
+            streams = open_streams.setdefault(interface, [])
+            streams.append((entry["src_id"] + source_id_offset, entry["src_id"], entry["geo_id"], key))
+            if len(streams) < interface_streams[interface]:
+                continue
+
+            del open_streams[interface]
+            streams.sort(key=lambda s: s[0])
+            add_interface = add_eth if kind == "eth" else add_felix
+            interface_dal, source_id = add_interface(interface, streams)
+            rogroup_dal = dal.ReadoutGroup(f"group-{source_id}", contains=[interface_dal])
+            batch.add(rogroup_dal)
+            groups.append((source_id, rogroup_dal))
+            batch.flush()
+            if len(open_streams) == 0:
+                parameters.clear()
+
+        for tx_host in sorted(hermes_links):
+            geo_id = hermes_last[tx_host][1]
+            hermes_id = f"hermes_{geo_id['det_id']}_{geo_id['crate_id']}_{geo_id['slot_id']}"
+            links = []
+            for source_id, stream, nic_dal in sorted(hermes_links[tx_host].values(), key=lambda l: l[0]):
+                links.append(dal.HermesLinkConf(
+                    f"{hermes_id}-{len(links)}",
+                    link_id=len(links),
+                    source=stream,
+                    destination=nic_dal
+                ))
+            hermes_controller_dal = dal.HermesController(
+                hermes_id,
+                uri=f"ipbusudp-2.0://{tx_host}:50001",
+                address_table=common["addrtab"],
+                links=links
+            )
+            batch.add(*links)
+            batch.add(hermes_controller_dal)
+
+    return [g for source_id, g in sorted(groups, key=lambda g: g[0])]
+
+
+def dro_json_to_oks(jsonfile, oksfile, source_id_offset, nomap, lcores, writer=False, validate=False,
+                    check=True, errors_json=None, partition=False, topology=None, max_lcore_streams=0,
+                    lcore_report=None):
+    """Simple script to convert a JSON readout map file to an OKS file.
+
+    The readout map is read and converted in a single streaming pass:
+    NIC and Felix interfaces (and their ReadoutGroups) are written as soon
+    as the rx_mac or card/slr of the streams changes and Hermes
+    controllers as soon as the tx_host changes, so memory use does not
+    grow with the size of the map.
+
+    With writer=True the objects are streamed to oksfile by an OksWriter
+    instead of being held by an oksdbinterfaces.Configuration until the
+    end, and with validate=True as well the result is read back to check
+    it, returning an error if it fails.
+
+    Unless check=False the map is first checked in a separate quick pass
+    (see map_check.MapChecker). If problems are found they are all
+    reported, and written to errors_json if given, and returned without
+    converting anything.
+
+    With partition=True the streams are grouped into interfaces by
+    rx_host/rx_mac and card/slr whatever the order of the map, and
+    identical stream parameters of a NIC are shared, so that any ordering
+    of the same map gives the same objects (see partition_json_to_oks).
+    This needs the counts of the check pass, which is then always run;
+    NICs sharing an rx_host or whose streams are not contiguous are not
+    errors in this mode.
+
+    The lcores of the rx_queues of each NIC are dealt out in turn from
+    lcores (DEFAULT_LCORES if empty) unless a topology (a file or "local",
+    see topology.load_topology) or max_lcore_streams is given, in which
+    case they are balanced by stream count over the lcores of the NIC's
+    NUMA node by an lcores.LcoreAllocator. Its assignment is then
+    reported, and written to lcore_report as JSON if given."""
 
     group_name = os.path.basename(jsonfile).removesuffix(".json")
     if oksfile == "":
         oksfile = group_name + ".data.xml"
 
+    if check or partition:
+        from oksconfgen.map_check import scan_readout_map, report_errors
+
+        with phase("check"):
+            checker = scan_readout_map(jsonfile, contiguous=not partition)
+        if check and len(checker.errors) > 0:
+            report_errors(jsonfile, checker.errors, errors_json)
+            return checker.errors
+
     print(
         f"Converting RO map from {jsonfile} to OKS in {oksfile} offsetting source_ids by {source_id_offset}"
     )
 
-    with open(jsonfile) as f:
-        jsonmap = json.loads(f.read())
-        f.close()
+    allocator = None
+    if topology or max_lcore_streams > 0:
+        from oksconfgen.lcores import LcoreAllocator
+        from oksconfgen.topology import load_topology
+
+        allocator = LcoreAllocator(lcores, load_topology(topology) if topology else None, max_lcore_streams)
+    lcores = list(lcores) or DEFAULT_LCORES
 
     schemafiles = [
         "schema/coredal/dunedaq.schema.xml",
         "schema/appdal/application.schema.xml",
         "schema/appdal/fdmodules.schema.xml",
     ]
-    dal = oksdbinterfaces.dal.module("generated", schemafiles[2])
-    db = oksdbinterfaces.Configuration("oksconfig")
-    db.create_db(oksfile, schemafiles)
+    with phase("create_db"):
+        dal = get_dal_module(schemafiles[2])
+        if writer:
+            from oksconfgen.oks_writer import OksWriter
+            db = OksWriter(oksfile, schemafiles)
+        else:
+            import oksdbinterfaces
+            db = oksdbinterfaces.Configuration("oksconfig")
+            db.create_db(oksfile, schemafiles)
+    batch = ObjectBatch(db)
+
+    if partition:
+        groups = partition_json_to_oks(jsonfile, dal, batch, group_name, source_id_offset, lcores,
+                                       checker.interface_streams, checker.host_nics, allocator)
+        return _finish(db, batch, dal, groups, oksfile, nomap, writer, validate, allocator, lcore_report)
 
     groups = []
     eth_streams = []
+    # EthStreamParameters of the open NIC and the number of streams using each
+    queue_pars = []
+    queue_streams = []
     flx_streams = []
     last_eth_pars = None
     last_felix_pars = None
-    last_hermes_id = None
     eth_streams_found = False
     flx_streams_found = False
-    nic_dals = {}
-    stream_dals = {}
+    nic_dal = None
     rx_queue = 0
-    for entry in jsonmap:
-        source_id = entry["src_id"] + source_id_offset
-        geo_id = entry["geo_id"]
-        geo_dal = dal.GeoId(f"geoId-{source_id}",
-                            detector_id=geo_id["det_id"],
-                            crate_id=geo_id["crate_id"],
-                            slot_id=geo_id["slot_id"],
-                            stream_id=geo_id["stream_id"]
-                            )
-        db.update_dal(geo_dal)
-
-        if entry["kind"] == "eth":
-            eth_source_id = source_id
-            if not eth_streams_found:
-                eth_streams_found = True
-                nic_stats_dal = dal.NICStatsConf(f"nicStats-{group_name}")
-                db.update_dal(nic_stats_dal)
-                nic_config_dal = dal.NICInterfaceConfiguration(
-                    f"nicConfig-{group_name}",
-                    stats_conf=nic_stats_dal
-                )
-                db.update_dal(nic_config_dal)
-            pars = entry["parameters"]
-            if last_eth_pars != None:
-                #print(f"streams in nic {pars['rx_mac']} = {len(streams)}")
-                if pars["rx_mac"] != last_eth_pars["rx_mac"]:
-                    nic_name = f"nic-{last_eth_pars['rx_host']}"
-                    print(f"New nic adding nic {last_eth_pars['rx_mac']} with id {nic_name}")
-                    nic_dal = dal.NICInterface(
-                        nic_name,
-                        rx_hostname=last_eth_pars["rx_host"],
-                        rx_mac=last_eth_pars["rx_mac"],
-                        rx_ip=last_eth_pars["rx_ip"],
-                        rx_iface=last_eth_pars["rx_iface"],
-                        rx_pcie_addr=last_eth_pars["rx_pcie_dev"],
-                        contains=eth_streams,
-                        configuration=nic_config_dal
-                    )
-                    db.update_dal(nic_dal)
-                    nic_dals[nic_name] = nic_dal
-                    rogroup_dal = dal.ReadoutGroup(
-                        f"group-{last_eth_source_id}",
-                        contains=[nic_dal]
-                    )
-                    db.update_dal(rogroup_dal)
-                    groups.append(rogroup_dal)
-                    eth_streams = []
-                    rx_queue = 0
-            if pars != last_eth_pars:
-                # Only create a new dal object if the parameters are different to the last one
-                stream_pars = dal.EthStreamParameters(
-                    f"pars-{source_id}",
-                    protocol = pars["protocol"],
-                    mode = pars["mode"],
-                    tx_hostname = pars["tx_host"],
-                    tx_mac = pars["tx_mac"],
-                    tx_ip = pars["tx_ip"],
-                    lcore = lcores[rx_queue%len(lcores)],
-                    rx_queue = rx_queue
-                )
-                db.update_dal(stream_pars)
-                rx_queue = rx_queue + 1
-                last_eth_pars = pars
-                last_eth_source_id = source_id
-        elif entry["kind"] == "flx":
-            flx_source_id = source_id
-            flx_streams_found = True
-            pars = entry["parameters"]
-            if not last_felix_pars == None:
-                if (
-                    pars["card"] != last_felix_pars["card"]
-                    or pars["slr"] != last_felix_pars["slr"]
-                ):
-                    print(
-                        f'Adding FelixInterface felix-{last_felix_source_id} slr={last_felix_pars["slr"]}'
-                    )
-                    felix_dal = dal.FelixInterface(
-                        f"felix-{last_felix_source_id}",
-                        card=last_felix_pars["card"],
-                        slr=last_felix_pars["slr"],
-                        contains=flx_streams
-                    )
-                    db.update_dal(felix_dal)
-                    rogroup_dal = dal.ReadoutGroup(
-                        f"group-{last_felix_source_id}",
-                        contains=[felix_dal]
-                    )
-                    db.update_dal(rogroup_dal)
-                    groups.append(rogroup_dal)
-                    flx_streams = []
-            stream_pars = dal.FelixStreamParameters(
-                f"flxpars-{source_id}",
-                protocol=pars["protocol"],
-                mode=pars["mode"],
-                link=pars["link"]
-            )
-            db.update_dal(stream_pars)
-            last_felix_pars = pars
-            last_felix_source_id = source_id
-        else:
-            raise RuntimeError(f'Unknown kind of readout {entry["kind"]}!')
+    # Hermes controller state
+    address_table_dal = None
+    hermes_id = None
+    hermes_pars = None
+    last_tx_mac = None
+    link_number = 0
+    links = []
 
-        stream = dal.DROStreamConf(
-            f"DROStream-{source_id}",
-            source_id=entry["src_id"],
-            stream_params=stream_pars,
-            geo_id=geo_dal
-        )
-        db.update_dal(stream)
-        if entry["kind"] == "eth":
-            eth_streams.append(stream)
-        else:
-            flx_streams.append(stream)
-        last_source_id = source_id
-        stream_dals[source_id] = stream
+    def add_group(interface_dal, source_id):
+        rogroup_dal = dal.ReadoutGroup(f"group-{source_id}", contains=[interface_dal])
+        batch.add(rogroup_dal)
+        groups.append(rogroup_dal)
+        # Hold back the flush while a NIC is open so that it is only
+        # written once, when complete
+        if nic_dal is None or interface_dal is nic_dal:
+            batch.flush()
 
-    if eth_streams_found:
-        nic_name = f"nic-{last_eth_pars['rx_host']}"
-        print(
-            f"Ending by adding nic {last_eth_pars['rx_mac']} with id {nic_name}"
+    def add_nic(source_id):
+        # nic_dal was staged with no streams when its first stream was
+        # seen so that Hermes links can refer to it, re-stage it complete
+        nic_dal.contains = eth_streams
+        if allocator is not None:
+            assigned = allocator.assign(nic_dal.rx_hostname, nic_dal.rx_mac, nic_dal.rx_pcie_addr, queue_streams)
+            for pars_dal, lcore in zip(queue_pars, assigned):
+                pars_dal.lcore = lcore
+        batch.add(nic_dal)
+        add_group(nic_dal, source_id)
+
+    def add_felix(source_id):
+        felix_dal = dal.FelixInterface(
+            f"felix-{source_id}",
+            card=last_felix_pars["card"],
+            slr=last_felix_pars["slr"],
+            contains=flx_streams
         )
-        nic_dal = dal.NICInterface(
-            nic_name,
-            rx_hostname=last_eth_pars["rx_host"],
-            rx_mac=last_eth_pars["rx_mac"],
-            rx_ip=last_eth_pars["rx_ip"],
-            rx_iface=last_eth_pars["rx_iface"],
-            rx_pcie_addr=last_eth_pars["rx_pcie_dev"],
-            contains=eth_streams,
-            configuration=nic_config_dal
+        batch.add(felix_dal)
+        add_group(felix_dal, source_id)
+
+    def add_hermes_controller():
+        # print(f"Adding HermesController {hermes_id} for {hermes_pars['tx_host']=}")
+        hermes_controller_dal = dal.HermesController(
+            hermes_id,
+            uri=f"ipbusudp-2.0://{hermes_pars['tx_host']}:50001",
+            address_table=address_table_dal,
+            links=links
         )
-        nic_dals[nic_name] = nic_dal
-        db.update_dal(nic_dal)
-        rogroup_dal = dal.ReadoutGroup(f"group-{eth_source_id}", contains=[nic_dal])
-        db.update_dal(rogroup_dal)
-        groups.append(rogroup_dal)
+        batch.add(*links)
+        batch.add(hermes_controller_dal)
+
+    with open(jsonfile) as f, phase("build"):
+        for entry in iter_json_array(f):
+            source_id = entry["src_id"] + source_id_offset
+            geo_id = entry["geo_id"]
+            geo_dal = _geo_dal(dal, source_id, geo_id)
+            batch.add(geo_dal)
 
-        address_table_dal = dal.IpbusAddressTable("Hermes-addrtab")
-        db.update_dal(address_table_dal)
-        # Loop over the json again to generate the Hermes links and controllers
-        last_pars = None
-        link_number = 0
-        links = []
-        last_tx_mac = None
-        for entry in jsonmap:
             if entry["kind"] == "eth":
+                eth_source_id = source_id
                 pars = entry["parameters"]
-                if last_pars != None:
-                    if pars["tx_host"] != last_pars['tx_host']:
-                        # print(f"Adding HermesController {hermes_id} for {pars['tx_host']=} {last_pars['tx_host']=}")
-                        hermes_controller_dal = dal.HermesController(
-                            hermes_id,
-                            uri=f"ipbusudp-2.0://{last_pars['tx_host']}:50001",
-                            address_table=address_table_dal,
-                            links=links
+                if not eth_streams_found:
+                    eth_streams_found = True
+                    nic_stats_dal = dal.NICStatsConf(f"nicStats-{group_name}")
+                    batch.add(nic_stats_dal)
+                    nic_config_dal = dal.NICInterfaceConfiguration(
+                        f"nicConfig-{group_name}",
+                        stats_conf=nic_stats_dal
+                    )
+                    batch.add(nic_config_dal)
+                    address_table_dal = dal.IpbusAddressTable("Hermes-addrtab")
+                    batch.add(address_table_dal)
+                if last_eth_pars != None:
+                    #print(f"streams in nic {pars['rx_mac']} = {len(streams)}")
+                    if pars["rx_mac"] != last_eth_pars["rx_mac"]:
+                        print(f"New nic adding nic {last_eth_pars['rx_mac']} with id {nic_dal.id}")
+                        add_nic(last_eth_source_id)
+                        nic_dal = None
+                        eth_streams = []
+                        queue_pars = []
+                        queue_streams = []
+                        rx_queue = 0
+                if nic_dal is None:
+                    nic_dal = dal.NICInterface(
+                        f"nic-{pars['rx_host']}",
+                        rx_hostname=pars["rx_host"],
+                        rx_mac=pars["rx_mac"],
+                        rx_ip=pars["rx_ip"],
+                        rx_iface=pars["rx_iface"],
+                        rx_pcie_addr=pars["rx_pcie_dev"],
+                        contains=[],
+                        configuration=nic_config_dal
+                    )
+                    batch.add(nic_dal)
+                if pars != last_eth_pars:
+                    # Only create a new dal object if the parameters are different to the last one
+                    stream_pars = dal.EthStreamParameters(
+                        f"pars-{source_id}",
+                        protocol = pars["protocol"],
+                        mode = pars["mode"],
+                        tx_hostname = pars["tx_host"],
+                        tx_mac = pars["tx_mac"],
+                        tx_ip = pars["tx_ip"],
+                        lcore = lcores[rx_queue%len(lcores)],
+                        rx_queue = rx_queue
+                    )
+                    batch.add(stream_pars)
+                    queue_pars.append(stream_pars)
+                    queue_streams.append(0)
+                    rx_queue = rx_queue + 1
+                    last_eth_pars = pars
+                    last_eth_source_id = source_id
+            elif entry["kind"] == "flx":
+                flx_source_id = source_id
+                flx_streams_found = True
+                pars = entry["parameters"]
+                if not last_felix_pars == None:
+                    if (
+                        pars["card"] != last_felix_pars["card"]
+                        or pars["slr"] != last_felix_pars["slr"]
+                    ):
+                        print(
+                            f'Adding FelixInterface felix-{last_felix_source_id} slr={last_felix_pars["slr"]}'
                         )
-                        db.update_dal(hermes_controller_dal)
-                        links = []
-                        link_number = 0
+                        add_felix(last_felix_source_id)
+                        flx_streams = []
+                stream_pars = dal.FelixStreamParameters(
+                    f"flxpars-{source_id}",
+                    protocol=pars["protocol"],
+                    mode=pars["mode"],
+                    link=pars["link"]
+                )
+                batch.add(stream_pars)
+                last_felix_pars = pars
+                last_felix_source_id = source_id
+            else:
+                raise RuntimeError(f'Unknown kind of readout {entry["kind"]}!')
 
-                geo_id = entry["geo_id"]
+            stream = dal.DROStreamConf(
+                f"DROStream-{source_id}",
+                source_id=entry["src_id"],
+                stream_params=stream_pars,
+                geo_id=geo_dal
+            )
+            batch.add(stream)
+            if entry["kind"] == "eth":
+                eth_streams.append(stream)
+                queue_streams[-1] += 1
+
+                # Group the Hermes links into controllers as we go
+                if hermes_pars != None and pars["tx_host"] != hermes_pars["tx_host"]:
+                    add_hermes_controller()
+                    links = []
+                    link_number = 0
                 hermes_id = f"hermes_{geo_id['det_id']}_{geo_id['crate_id']}_{geo_id['slot_id']}"
-                source_id = entry["src_id"] + source_id_offset
-                nic_name = f"nic-{pars['rx_host']}"
-                hermes_link_id = f"{hermes_id}-{link_number}"
                 if pars["tx_mac"] != last_tx_mac:
                     link_dal = dal.HermesLinkConf(
-                        hermes_link_id,
+                        f"{hermes_id}-{link_number}",
                         link_id=link_number,
-                        source=stream_dals[source_id],
-                        destination=nic_dals[nic_name]
+                        source=stream,
+                        destination=nic_dal
                     )
-                    db.update_dal(link_dal)
                     links.append(link_dal)
                     link_number = link_number + 1
-                last_pars = pars
+                hermes_pars = pars
                 last_tx_mac = pars["tx_mac"]
-                last_tx_host = pars["tx_host"]
-        if pars["tx_host"] != last_tx_host:
-            # print(f"Adding HermesController {hermes_id}")
-            hermes_controller_dal = dal.HermesController(
-                hermes_id,
-                uri=f"ipbusudp-2.0://{last_pars['tx_host']}:50001",
-                address_table=address_table_dal,
-                links=hermes_links
-            )
-            db.update_dal(hermes_controller_dal)
+            else:
+                flx_streams.append(stream)
 
+    if eth_streams_found:
+        print(
+            f"Ending by adding nic {last_eth_pars['rx_mac']} with id {nic_dal.id}"
+        )
+        add_nic(eth_source_id)
+        add_hermes_controller()
 
     if flx_streams_found and len(flx_streams) > 0:
         print(f"Adding final FelixInterface felix-{flx_source_id}")
-        felix_dal = dal.FelixInterface(
-            f"felix-{flx_source_id}",
-            card=last_felix_pars["card"],
-            slr=last_felix_pars["slr"],
-            contains=flx_streams
-        )
-        db.update_dal(felix_dal)
-        rogroup_dal = dal.ReadoutGroup(f"group-{flx_source_id}", contains=[felix_dal])
-        db.update_dal(rogroup_dal)
-        groups.append(rogroup_dal)
+        add_felix(flx_source_id)
+
+    return _finish(db, batch, dal, groups, oksfile, nomap, writer, validate, allocator, lcore_report)
 
+
+def _finish(db, batch, dal, groups, oksfile, nomap, writer, validate, allocator, lcore_report):
+    if allocator is not None:
+        from oksconfgen.lcores import report_lcores
+
+        report_lcores(allocator, lcore_report)
     if not nomap:
         map_dal = dal.ReadoutMap("readoutmap", groups=groups)
-        db.update_dal(map_dal)
-
+        batch.add(map_dal)
 
-    db.commit()
+    batch.commit()
+    get_profiler().add_output(oksfile)
+    if writer and validate:
+        with phase("validate"):
+            if not db.validate():
+                return [f"Validation of {oksfile} failed"]
+    return None
@@ -1,52 +1,154 @@
-import oksdbinterfaces
-import coredal
+import re
+import json
+import fnmatch
 
-import os
-import glob
+from oksconfgen.instrument import get_profiler, phase
+
+
+def read_manifest(manifest):
+    """Parse the text of an enable/disable manifest into a list of
+    (session, disable, resources) operations.
+
+    Either a JSON list of {"session": ..., "disable": ..., "resources": [...]}
+    objects, or one operation per line:
+
+        disable <session> <resource> [<resource> ...]
+        enable  <session> <resource> [<resource> ...]
+
+    where # starts a comment and a session of - or "" means the first
+    Session of the database. Resources may be uids, glob patterns or
+    regular expressions prefixed with re: (see select_resources)."""
+    if manifest.lstrip().startswith("["):
+        return [
+            (op.get("session", ""), bool(op.get("disable", False)), list(op["resources"]))
+            for op in json.loads(manifest)
+        ]
+    operations = []
+    for lineno, line in enumerate(manifest.splitlines(), 1):
+        fields = line.split("#", 1)[0].split()
+        if len(fields) == 0:
+            continue
+        if fields[0] not in ("enable", "disable") or len(fields) < 3:
+            raise ValueError(f"Manifest line {lineno}: expected 'enable|disable <session> <resource>...', got '{line.strip()}'")
+        session = "" if fields[1] == "-" else fields[1]
+        operations.append((session, fields[0] == "disable", fields[2:]))
+    return operations
+
+
+def select_resources(index, pattern):
+    """Return the entries of index (uid -> Resource DAL or anything else
+    keyed by uid) selected by pattern: a uid, a glob pattern such as
+    DROStream-* or a regular expression prefixed with re:, matched
+    against the whole uid"""
+    if pattern.startswith("re:"):
+        regex = re.compile(pattern[3:])
+        return [index[uid] for uid in sorted(index) if regex.fullmatch(uid)]
+    if any(c in pattern for c in "*?["):
+        return [index[uid] for uid in fnmatch.filter(sorted(index), pattern)]
+    if pattern in index:
+        return [index[pattern]]
+    return []
+
+
+def _key(dal):
+    return (dal.id, dal.className())
+
+
+def apply_operations(db, oksfile, operations):
+    """Apply (session, disable, resources) operations to the disabled
+    relationships of the Sessions of db. Every Resource is looked up in a
+    single uid index and each Session is updated once, however many
+    operations touch it. Returns the Sessions to update, or None if a
+    Session was not found, in which case nothing is changed."""
+    sessions = {s.id: s for s in db.get_dals(class_name="Session")}
+    if len(sessions) == 0:
+        print(f"Error could not find any Session in file {oksfile}")
+        return None
+    first = next(iter(sessions.values()))
+    for session_name, disable, resources in operations:
+        if session_name != "" and session_name not in sessions:
+            print(f"Error could not find Session {session_name} in file {oksfile}")
+            return None
+
+    index = {r.id: r for r in db.get_dals(class_name="ResourceBase")}
+    # session id -> (disabled list, keys of the disabled list)
+    state = {}
+    for session_name, disable, resources in operations:
+        session = sessions[session_name] if session_name != "" else first
+        if session.id not in state:
+            disabled = list(session.disabled)
+            state[session.id] = (disabled, {_key(d) for d in disabled})
+        disabled, disabled_keys = state[session.id]
+        for res in resources:
+            selected = select_resources(index, res)
+            if len(selected) == 0:
+                print(f"Error could not find Resource {res} in file {oksfile}")
+                continue
+            for res_dal in selected:
+                key = _key(res_dal)
+                if disable:
+                    if key in disabled_keys:
+                        print(f"{res_dal.id} is already in disabled relationship of Session {session.id}")
+                    else:
+                        # Add to the Session's disabled list
+                        print(f"Adding {res_dal.id} to disabled relationship of Session {session.id}")
+                        disabled.append(res_dal)
+                        disabled_keys.add(key)
+                else:
+                    if key not in disabled_keys:
+                        print(f"{res_dal.id} is not in disabled relationship of Session {session.id}")
+                    else:
+                        # Remove from the Session's disabled list
+                        print(f"Removing {res_dal.id} from disabled relationship of Session {session.id}")
+                        disabled_keys.discard(key)
+
+    updated = []
+    for session_id, (disabled, disabled_keys) in state.items():
+        # Drop the removed (or re-added) Resources in one pass, keeping the order
+        kept = []
+        for d in disabled:
+            if _key(d) in disabled_keys:
+                disabled_keys.discard(_key(d))
+                kept.append(d)
+        session = sessions[session_id]
+        session.disabled = kept
+        updated.append(session)
+    return updated
+
+
+def enable_operations(oksfile, operations):
+    """Apply (session, disable, resources) operations (see
+    apply_operations) to oksfile and commit once"""
+    import oksdbinterfaces
+    import coredal
+
+    with phase("load"):
+        db = oksdbinterfaces.Configuration("oksconfig:" + oksfile)
+    sessions = apply_operations(db, oksfile, operations)
+    if sessions is None:
+        return
+    with phase("update_dal"):
+        for session in sessions:
+            db.update_dal(session)
+    get_profiler().count_objects(sessions)
+    with phase("commit"):
+        db.commit()
+    get_profiler().add_output(oksfile)
 
 
 def enable(oksfile, disable, resource, session_name):
     """Script to enable or disable (-d) Resources from the first Session of the
     specified OKS database file"""
-    db = oksdbinterfaces.Configuration("oksconfig:" + oksfile)
-    if session_name == "":
-        session_dals = db.get_dals(class_name="Session")
-        if len(session_dals) == 0:
-            print(f"Error could not find any Session in file {oksfile}")
-            return
-        session = session_dals[0]
-    else:
-        try:
-            session = db.get_dal("Session", session_name)
-        except:
-            print(f"Error could not find Session {session_name} in file {oksfile}")
-            return
-    disabled = session.disabled
-    for res in resource:
-        try:
-            res_dal = db.get_dal("ResourceBase", res)
-        except:
-            print(f"Error could not find Resource {res} in file {oksfile}")
-            continue
+    enable_operations(oksfile, [(session_name, disable, list(resource))])
+
 
-        if disable:
-            if res_dal in disabled:
-                print(
-                    f"{res} is already in disabled relationship of Session {session.id}"
-                )
-            else:
-                # Add to the Segment's disabled list
-                print(f"Adding {res} to disabled relationship of Session {session.id}")
-                disabled.append(res_dal)
-        else:
-            if res_dal not in disabled:
-                print(f"{res} is not in disabled relationship of Session {session.id}")
-            else:
-                # Remove from the Segments disabled list
-                print(
-                    f"Removing {res} from disabled relationship of Session {session.id}"
-                )
-                disabled.remove(res_dal)
-    session.disabled = disabled
-    db.update_dal(session)
-    db.commit()
+def enable_manifest(oksfile, manifest):
+    """Apply the enable/disable operations of the manifest text (see
+    read_manifest) to oksfile in one go"""
+    try:
+        operations = read_manifest(manifest)
+    except (ValueError, KeyError) as e:
+        print(f"Error reading manifest: {e}")
+        return
+    print(f"Applying {len(operations)} operations to {oksfile}")
+    enable_operations(oksfile, operations)
@@ -0,0 +1,112 @@
+import hashlib
+import json
+import os
+import re
+
+
+def _is_dal(value):
+    return hasattr(value, "className") and hasattr(value, "id")
+
+
+def _encode(value):
+    if _is_dal(value):
+        return f"{value.id}@{value.className()}"
+    if isinstance(value, list):
+        return [_encode(v) for v in value]
+    return value
+
+
+def dal_fingerprint(*dals):
+    """Return a sha256 hex digest over the attributes and relationships of
+    dals and of every object reachable from them through relationships"""
+    digest = hashlib.sha256()
+    seen = set()
+    stack = list(reversed(dals))
+    while stack:
+        obj = stack.pop()
+        key = (obj.className(), obj.id)
+        if key in seen:
+            continue
+        seen.add(key)
+        values = vars(obj)
+        record = [key]
+        related = []
+        for name in sorted(values):
+            if name.startswith("_"):
+                continue
+            value = values[name]
+            record.append([name, _encode(value)])
+            for v in value if isinstance(value, list) else [value]:
+                if _is_dal(v):
+                    related.append(v)
+        digest.update(json.dumps(record, default=str).encode())
+        stack.extend(reversed(related))
+    return digest.hexdigest()
+
+
+def value_fingerprint(value):
+    """Return a sha256 hex digest of a JSON serialisable value"""
+    return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode()).hexdigest()
+
+
+# Include paths in the <include> section of an OKS schema or data file
+_INCLUDE_RE = re.compile(rb'<file\s+path="([^"]*)"')
+
+_code_fingerprint = None
+
+
+def code_fingerprint():
+    """Return a sha256 hex digest of the oksconfgen sources, which
+    stands for the version of the generators"""
+    global _code_fingerprint
+    if _code_fingerprint is None:
+        digest = hashlib.sha256()
+        package_dir = os.path.dirname(os.path.abspath(__file__))
+        for name in sorted(os.listdir(package_dir)):
+            if name.endswith(".py"):
+                with open(os.path.join(package_dir, name), "rb") as f:
+                    digest.update(name.encode() + b"\0" + f.read())
+        _code_fingerprint = digest.hexdigest()
+    return _code_fingerprint
+
+
+def file_record(filename, known=None):
+    """Return [size, mtime_ns, sha256 hex digest, include paths] of
+    filename. known maps file names to records from an earlier call,
+    which are reused without reading the file if its size and mtime are
+    unchanged."""
+    stat = os.stat(filename)
+    previous = (known or {}).get(filename)
+    if previous is not None and previous[0] == stat.st_size and previous[1] == stat.st_mtime_ns:
+        return previous
+    with open(filename, "rb") as f:
+        content = f.read()
+    includes = [path.decode() for path in _INCLUDE_RE.findall(content)]
+    return [stat.st_size, stat.st_mtime_ns, hashlib.sha256(content).hexdigest(), includes]
+
+
+def files_fingerprint(files, relative_to=None, known=None):
+    """Return (digest, records) over the contents of the OKS files
+    (include paths) and of everything they include, where records maps
+    each file read to its file_record. The digest is None if a file
+    cannot be found."""
+    from oksconfgen.includes import find_file
+
+    records = {}
+    resolved = []
+    stack = [(path, relative_to) for path in reversed(files)]
+    seen = set()
+    while stack:
+        path, including = stack.pop()
+        filename = find_file(path, including)
+        if filename is None:
+            print(f"Cannot find {path} to fingerprint it")
+            return None, records
+        filename = os.path.abspath(filename)
+        if filename in seen:
+            continue
+        seen.add(filename)
+        records[filename] = file_record(filename, known)
+        resolved.append([path, records[filename][2]])
+        stack.extend((inc, filename) for inc in reversed(records[filename][3]))
+    return value_fingerprint(resolved), records
@@ -0,0 +1,106 @@
+import os
+import json
+
+from oksconfgen.batch import ObjectBatch
+from oksconfgen.cache import get_dal_module
+from oksconfgen.instrument import get_profiler, phase
+from oksconfgen.topology import node_cpus, parse_hwloc, parse_lscpu, read_local_topology
+
+
+def host_dals(dal, host, description, virtual_host=None):
+    """Return the DAL objects describing host (see topology.describe)
+    and its VirtualHosts.
+
+    The PhysicalHost host contains a ProcessingResource <host>-housekeeping
+    of its housekeeping CPUs and one <host>-numa<node> of the readout CPUs
+    of each NUMA node. There is a VirtualHost v<host>-numa<node> using
+    each node's resource, or with virtual_host a single VirtualHost of
+    that name using all of them, so readout threads are never pinned to
+    the housekeeping CPUs."""
+    resources = []
+    for node in description["numa_nodes"]:
+        cpus = node_cpus(description, node)
+        if len(cpus) > 0:
+            resources.append((node, dal.ProcessingResource(f"{host}-numa{node}", cpu_cores=cpus)))
+    contains = [res for node, res in resources]
+    if len(description["housekeeping"]) > 0:
+        contains.append(dal.ProcessingResource(f"{host}-housekeeping", cpu_cores=description["housekeeping"]))
+    physical = dal.PhysicalHost(host, contains=contains)
+    if virtual_host is not None:
+        virtuals = [dal.VirtualHost(virtual_host, runs_on=physical, uses=[res for node, res in resources])]
+    else:
+        virtuals = [
+            dal.VirtualHost(f"v{host}-numa{node}", runs_on=physical, uses=[res])
+            for node, res in resources
+        ]
+    return contains + [physical] + virtuals, virtuals
+
+
+def _split_source(source):
+    """Split a HOST=FILE source, returning (None, FILE) if it has no host"""
+    host, sep, filename = source.partition("=")
+    if sep == "" or os.path.exists(source):
+        return None, source
+    return host, filename
+
+
+def read_topologies(local=False, lscpu=(), hwloc=(), housekeeping_cores=1):
+    """Return host -> description (see topology.describe) of this machine
+    if local, of the HOST=FILE lscpu -p dumps lscpu and of the [HOST=]FILE
+    hwloc XML dumps hwloc. An hwloc dump without a host is named after
+    the HostName it records, else after its file."""
+    topologies = {}
+    if local:
+        import socket
+
+        topologies[socket.gethostname()] = read_local_topology(housekeeping_cores=housekeeping_cores)
+    for source in lscpu:
+        host, filename = _split_source(source)
+        if host is None:
+            host = os.path.basename(filename).split(".")[0]
+        with open(filename) as f:
+            topologies[host] = parse_lscpu(f.read(), housekeeping_cores)
+    for source in hwloc:
+        host, filename = _split_source(source)
+        with open(filename) as f:
+            recorded, description = parse_hwloc(f.read(), housekeeping_cores)
+        topologies[host or recorded or os.path.basename(filename).split(".")[0]] = description
+    return topologies
+
+
+def generate_hosts(oksfile, local=False, lscpu=(), hwloc=(), housekeeping_cores=1, topology_json=None):
+    """Generate the PhysicalHost, ProcessingResource and VirtualHost
+    objects (see host_dals) of the hosts described by the sources of
+    read_topologies in oksfile. With topology_json the descriptions are
+    also written there for dromap2oks --topology."""
+    try:
+        with phase("read topology"):
+            topologies = read_topologies(local, lscpu, hwloc, housekeeping_cores)
+    except (OSError, ValueError) as e:
+        print(f"Error reading host topology: {e}")
+        return
+    if len(topologies) == 0:
+        print("Error no host topology given")
+        return
+
+    schemafiles = ["schema/coredal/dunedaq.schema.xml"]
+    with phase("create_db"):
+        import oksdbinterfaces
+
+        dal = get_dal_module(schemafiles[0])
+        db = oksdbinterfaces.Configuration("oksconfig")
+        db.create_db(oksfile, schemafiles)
+    batch = ObjectBatch(db)
+    with phase("build"):
+        for host, description in topologies.items():
+            dals, virtuals = host_dals(dal, host, description)
+            batch.add(*dals)
+            nodes = ", ".join(f"{node}: {len(cpus)}" for node, cpus in description["numa_nodes"].items())
+            print(f"Host {host}: CPUs per NUMA node {nodes}, housekeeping CPUs {description['housekeeping']}, "
+                  f"VirtualHosts {', '.join(v.id for v in virtuals)}")
+    batch.commit()
+    get_profiler().add_output(oksfile)
+
+    if topology_json:
+        with open(topology_json, "w") as f:
+            json.dump({"hosts": topologies}, f, indent=2)
@@ -1,66 +1,192 @@
-import oksdbinterfaces
 import os
 import json
 import sys
+from array import array
+
+from oksconfgen.batch import ObjectBatch
+from oksconfgen.cache import get_dal_module
+from oksconfgen.instrument import get_profiler, phase
+
+
+def app_layout(n_streams, n_apps=1, det_id=3, streams_per_app=None, det_ids=None):
+    """Return a (detector_id, crate_id, n_streams) tuple for each app.
+
+    streams_per_app gives the number of streams of each app, overriding
+    n_streams and n_apps. The apps are split evenly over the detectors
+    in det_ids (default [det_id]) in order, each app reading one crate
+    numbered from 0 within its detector."""
+    if streams_per_app is None:
+        streams_per_app = [n_streams] * n_apps
+    if not det_ids:
+        det_ids = [det_id]
+    n_apps = len(streams_per_app)
+    layout = []
+    first_app = 0
+    for app, app_streams in enumerate(streams_per_app):
+        det = det_ids[app * len(det_ids) // n_apps]
+        if app == 0 or det != layout[-1][0]:
+            first_app = app
+        layout.append((det, app - first_app, app_streams))
+    return layout
+
+
+def stream_columns(layout, streams_per_slot=None):
+    """Return the app, detector_id, crate_id, slot_id and stream_id of
+    every stream of layout (see app_layout) as arrays indexed by
+    source_id. Without streams_per_slot all streams of an app are in
+    slot 0."""
+    columns = {name: array("l") for name in ["app", "detector_id", "crate_id", "slot_id", "stream_id"]}
+    for app, (det, crate, app_streams) in enumerate(layout):
+        columns["app"].extend([app] * app_streams)
+        columns["detector_id"].extend([det] * app_streams)
+        columns["crate_id"].extend([crate] * app_streams)
+        if streams_per_slot:
+            columns["slot_id"].extend(n // streams_per_slot for n in range(app_streams))
+            columns["stream_id"].extend(n % streams_per_slot for n in range(app_streams))
+        else:
+            columns["slot_id"].extend([0] * app_streams)
+            columns["stream_id"].extend(range(app_streams))
+    return columns
+
 
 def generate_hwmap(oksfile, n_streams, n_apps = 1, det_id = 3, app_host = "localhost",
-                             eth_protocol = "udp", flx_mode = "fix_rate"):
+                             eth_protocol = "udp", flx_mode = "fix_rate",
+                             streams_per_app = None, det_ids = None, streams_per_slot = None,
+                             bulk = False, batch_size = 1 << 16, writer = False, validate = False):
+    """Generate a synthetic hardware map with one ReadoutInterface and
+    ReadoutGroup per app, see app_layout for the topology parameters.
+
+    With bulk=True the ids and attributes of all streams are computed up
+    front as columns (see stream_columns) and the objects are created
+    from them and written batch_size objects at a time. The output is
+    identical to that of the default per stream loop.
+
+    With writer=True the objects are streamed to oksfile by an OksWriter,
+    validate=True reads the result back to check it. Returns the errors
+    if that fails."""
 
     schemafiles = [
         "schema/coredal/dunedaq.schema.xml",
         "schema/appdal/application.schema.xml",
         "schema/appdal/fdmodules.schema.xml",
     ]
-    dal = oksdbinterfaces.dal.module("generated", schemafiles[2])
-    db = oksdbinterfaces.Configuration("oksconfig")
-    db.create_db(oksfile, schemafiles)
+    with phase("create_db"):
+        dal = get_dal_module(schemafiles[2])
+        if writer:
+            from oksconfgen.oks_writer import OksWriter
+            db = OksWriter(oksfile, schemafiles)
+        else:
+            import oksdbinterfaces
+            db = oksdbinterfaces.Configuration("oksconfig")
+            db.create_db(oksfile, schemafiles)
 
-    group_name = os.path.basename(oksfile).removesuffix(".data.xml")
-    groups = []
-    streams = []
-    source_id = 0
+    layout = app_layout(n_streams, n_apps, det_id, streams_per_app, det_ids)
+    if bulk:
+        # Objects are generated after the ones they refer to
+        batch = ObjectBatch(db, ordered=True)
+        generate_bulk(dal, batch, layout, streams_per_slot, flx_mode, batch_size)
+    else:
+        batch = ObjectBatch(db)
+        generate_loop(dal, batch, layout, streams_per_slot, flx_mode)
+    batch.commit()
+    get_profiler().add_output(oksfile)
+    if writer and validate:
+        with phase("validate"):
+            if not db.validate():
+                return [f"Validation of {oksfile} failed"]
+    return None
 
-    stream_pars = dal.StreamParameters(
-        f"dummyStream-1",
-        mode=flx_mode,
-    )
 
-    db.update_dal(stream_pars)
+def generate_loop(dal, batch, layout, streams_per_slot, flx_mode):
+    """Default mode of generate_hwmap: create the objects of layout one
+    stream at a time"""
+    with phase("build"):
+        groups = []
+        streams = []
+        source_id = 0
 
-    for app in range(n_apps):
+        stream_pars = dal.StreamParameters(
+            f"dummyStream-1",
+            mode=flx_mode,
+        )
 
-        for stream_no in range(n_streams):
+        batch.add(stream_pars)
 
-            geo_dal = dal.GeoId(
-                f"geioId-{source_id}",
-                detector_id=det_id,
-                crate_id=app,
-                slot_id=0,
-                stream_id=stream_no,
-            )
-            db.update_dal(geo_dal)
-            stream = dal.DROStreamConf(
-                f"DROStream-{source_id}",
-                source_id=source_id,
-                stream_params=stream_pars,
-                geo_id=geo_dal,
+        for app, (app_det_id, crate_id, app_streams) in enumerate(layout):
+
+            for stream_no in range(app_streams):
+
+                geo_dal = dal.GeoId(
+                    f"geioId-{source_id}",
+                    detector_id=app_det_id,
+                    crate_id=crate_id,
+                    slot_id=stream_no // streams_per_slot if streams_per_slot else 0,
+                    stream_id=stream_no % streams_per_slot if streams_per_slot else stream_no,
+                )
+                batch.add(geo_dal)
+                stream = dal.DROStreamConf(
+                    f"DROStream-{source_id}",
+                    source_id=source_id,
+                    stream_params=stream_pars,
+                    geo_id=geo_dal,
+                )
+                batch.add(stream)
+                streams.append(stream)
+                source_id = source_id + 1
+
+            print(f"New nic adding nic with id nic-{app}")
+            nic_dal = dal.ReadoutInterface(
+                f"ROInterface-{app}",
+                contains=streams,
             )
-            db.update_dal(stream)
-            streams.append(stream)
-            source_id = source_id + 1
-
-        print(f"New nic adding nic with id nic-{app}")
-        nic_dal = dal.ReadoutInterface(
-            f"ROInterface-{app}",
-            contains=streams,
-        )
-        db.update_dal(nic_dal)
-        rogroup_dal = dal.ReadoutGroup(f"group-{app}", contains=[nic_dal])
-        db.update_dal(rogroup_dal)
-        groups.append(rogroup_dal)
-        streams = []
+            batch.add(nic_dal)
+            rogroup_dal = dal.ReadoutGroup(f"group-{app}", contains=[nic_dal])
+            batch.add(rogroup_dal)
+            groups.append(rogroup_dal)
+            streams = []
 
-    map_dal = dal.ReadoutMap("readoutmap", groups=groups)
-    db.update_dal(map_dal)
-    db.commit()
+        map_dal = dal.ReadoutMap("readoutmap", groups=groups)
+        batch.add(map_dal)
 
+
+def generate_bulk(dal, batch, layout, streams_per_slot, flx_mode, batch_size):
+    """Bulk mode of generate_hwmap: create the objects of layout from
+    column arrays, flushing batch whenever batch_size objects are staged"""
+    with phase("build"):
+        columns = stream_columns(layout, streams_per_slot)
+        n_total = len(columns["app"])
+        stream_pars = dal.StreamParameters(f"dummyStream-1", mode=flx_mode)
+        batch.add(stream_pars)
+
+        GeoId = dal.GeoId
+        DROStreamConf = dal.DROStreamConf
+        geo_dals = [
+            GeoId(f"geioId-{source_id}", detector_id=det, crate_id=crate,
+                  slot_id=slot, stream_id=stream_no)
+            for source_id, det, crate, slot, stream_no in zip(
+                range(n_total), columns["detector_id"], columns["crate_id"],
+                columns["slot_id"], columns["stream_id"],
+            )
+        ]
+        stream_dals = [
+            DROStreamConf(f"DROStream-{source_id}", source_id=source_id,
+                          stream_params=stream_pars, geo_id=geo_dal)
+            for source_id, geo_dal in enumerate(geo_dals)
+        ]
+
+    print(f"Adding {len(layout)} nics with {n_total} streams")
+    groups = []
+    first = 0
+    for app, (det, crate, app_streams) in enumerate(layout):
+        with phase("build"):
+            streams = stream_dals[first:first + app_streams]
+            for geo_dal, stream in zip(geo_dals[first:first + app_streams], streams):
+                batch.add(geo_dal, stream)
+            nic_dal = dal.ReadoutInterface(f"ROInterface-{app}", contains=streams)
+            rogroup_dal = dal.ReadoutGroup(f"group-{app}", contains=[nic_dal])
+            batch.add(nic_dal, rogroup_dal)
+            groups.append(rogroup_dal)
+            first += app_streams
+        if len(batch) >= batch_size:
+            batch.flush()
+    batch.add(dal.ReadoutMap("readoutmap", groups=groups))
@@ -1,9 +1,15 @@
-from calendar import day_abbr
-from curses import qiflush
-import oksdbinterfaces
 import os
-import glob
-from oksconfgen.assets import resolve_asset_file
+import json
+from oksconfgen.assets import asset_cache_counts, report_asset_cache, resolve_asset_file
+from oksconfgen.batch import ObjectBatch
+from oksconfgen.cache import get_dal_module
+from oksconfgen.fingerprint import code_fingerprint, dal_fingerprint, file_record, files_fingerprint, value_fingerprint
+from oksconfgen.includes import find_include, get_index, search_dirs
+from oksconfgen.instrument import get_profiler, phase
+from oksconfgen.placement import group_streams, place_groups, report_placement
+
+# Interface types generate_data_reader has a data reader configuration for
+READOUT_INTERFACES = ["ReadoutInterface", "NICInterface", "FelixInterface"]
 
 
 def generate_readout(
@@ -14,6 +20,15 @@ def generate_readout(
     session,
     emulated_file_name="asset://?checksum=e96fd6efd3f98a9a3bfaba32975b476e",
     tpg_enabled=True,
+    asset_cache="use",
+    incremental=False,
+    shards=1,
+    writer=False,
+    validate=False,
+    force=False,
+    placement="balanced",
+    sizing=None,
+    local_topology=False,
 ):
     """Simple script to create an OKS configuration file for all
   ReadoutApplications defined in a readout map.
@@ -42,6 +57,51 @@ def generate_readout(
   NB: Currently FSM generation is not implemented so you must include
   an fsm file in order to generate a Segment
 
+  asset_cache selects how the emulated data file asset is resolved:
+  "use" the local asset cache, "refresh" it or bypass it with "off".
+  The cache hits and misses of the run are reported.
+
+  With incremental=True an existing output file generated with the same
+  includes and options is updated in place: only the applications of
+  ReadoutGroups whose contents (or assigned host and ids) changed are
+  regenerated and those of removed groups are deleted. The fingerprints
+  used for this are kept in <oksfile>.genstate.json.
+
+  With shards > 1 the ReadoutApplications are generated in that many
+  worker processes, see generate_sharded.
+
+  With writer=True the generated objects are streamed to the output
+  file(s) by an OksWriter rather than held in memory until the end, and
+  with validate=True as well every file written is read back to check
+  it. This always regenerates the whole output. If a file fails
+  validation the errors are returned and the generation state and
+  inputs are not recorded, so the next run regenerates it.
+
+  A fingerprint of the inputs (the readout map and included files and
+  everything they include, the emulated data file, the options and the
+  oksconfgen sources) is kept in <oksfile>.inputs.json. If it is
+  unchanged and the output files have not been touched since, nothing
+  is regenerated unless force=True.
+
+  placement selects how the ReadoutApplications are spread over the
+  VirtualHosts, see placement.place_groups: "balanced" puts each on the
+  host its NIC is attached to or else the least loaded host by streams
+  per CPU core, "round-robin" deals them out in turn. Groups of
+  interface types no ReadoutApplication is generated for are left out.
+  The load of each host is reported.
+
+  With a sizing file (see sizing.DEFAULT_MODEL) the latency buffers and
+  input queues are sized from the data and TP rates, frame sizes and
+  retention times it gives, and the memory the applications placed on
+  each host need is reported. Predefined latency buffers and queues are
+  not resized, the memory is then computed from their sizes. If it
+  exceeds the budget the file gives for a host nothing is written.
+
+  When the included files define no vlocalhost VirtualHost one is
+  generated running on a PhysicalHost localhost. It uses CPUs 0-3, or
+  with local_topology=True the readout CPUs of this machine (see
+  generate_hosts.host_dals).
+
   """
 
     if not readoutmap.endswith(".data.xml"):
@@ -57,65 +117,601 @@ def generate_readout(
         readoutmap,
     ]
 
-    searchdirs = [path for path in os.environ["DUNEDAQ_SHARE_PATH"].split(":")]
-    searchdirs.append(os.path.dirname(oksfile))
-    for inc in include:
-        # print (f"Searching for {inc}")
-        match = False
-        inc = inc.removesuffix(".xml")
-        if inc.endswith(".data"):
-            sub_dirs = ["config", "data"]
-        elif inc.endswith(".schema"):
-            sub_dirs = ["schema"]
-        else:
-            sub_dirs = ["*"]
-            inc = inc + "*"
-        for path in searchdirs:
-            # print (f"   {path}/{inc}.xml")
-            matches = glob.glob(f"{inc}.xml", root_dir=path)
+    with phase("include resolution"):
+        searchdirs = search_dirs(oksfile)
+        for inc in include:
+            # print (f"Searching for {inc}")
+            matches = find_include(inc, searchdirs)
             if len(matches) == 0:
-                for search_dir in sub_dirs:
-                    # print (f"   {path}/{search_dir}/{inc}.xml")
-                    matches = glob.glob(f"{search_dir}/{inc}.xml", root_dir=path)
-                    for filename in matches:
-                        if filename not in includefiles:
-                            print(f"Adding {filename} to include list")
-                            includefiles.append(filename)
-                        else:
-                            print(f"{filename} already in include list")
-                        match = True
-                        break
-                    if match:
-                        break
-                if match:
-                    break
+                print(f"Error could not find include file for {inc}")
+                return
+            filename = matches[0]
+            if filename not in includefiles:
+                print(f"Adding {filename} to include list")
+                includefiles.append(filename)
             else:
-                for filename in matches:
-                    if filename not in includefiles:
-                        print(f"Adding {filename} to include list")
-                        includefiles.append(filename)
-                    else:
-                        print(f"{filename} already in include list")
-                    match = True
-                    break
-
-        if not match:
-            print(f"Error could not find include file for {inc}")
-            return
+                print(f"{filename} already in include list")
+        get_index().save()
 
-    dal = oksdbinterfaces.dal.module("generated", includefiles[3])
-    db = oksdbinterfaces.Configuration("oksconfig")
     if not oksfile.endswith(".data.xml"):
         oksfile = oksfile + ".data.xml"
-    print(f"Creating OKS database file {oksfile}")
+
+    model = None
+    if sizing:
+        from oksconfgen.sizing import load_sizing
+
+        try:
+            model = load_sizing(sizing)
+        except (OSError, ValueError) as e:
+            print(f"Error reading sizing file {sizing}: {e}")
+            return
+    local_host = None
+    if local_topology:
+        from oksconfgen.topology import read_local_topology
+
+        local_host = read_local_topology()
+
+    inputs_file = oksfile + ".inputs.json"
+    previous_inputs = load_inputs(inputs_file)
+    with phase("fingerprint"):
+        inputs = fingerprint_inputs(
+            oksfile, includefiles, emulated_file_name,
+            [segment, session, emulated_file_name, tpg_enabled, shards, writer, placement, model,
+             local_host],
+            previous_inputs,
+        )
+    if not force and outputs_up_to_date(inputs, previous_inputs):
+        print(f"Inputs of {oksfile} unchanged since it was generated, not regenerating it (use --force to regenerate)")
+        return
+
+    dal = get_dal_module(includefiles[3])
+    asset_lookups = asset_cache_counts()
+
+    if writer and incremental:
+        print("Incremental regeneration is not supported with the XML writer, regenerating all")
+        incremental = False
+
+    if shards > 1:
+        if incremental:
+            print("Incremental regeneration is not supported with sharding, regenerating all")
+        outputs, errors = generate_sharded(
+            dal, readoutmap, oksfile, includefiles, segment, session,
+            emulated_file_name, tpg_enabled, asset_cache, shards, writer, validate,
+            placement, model, local_host,
+        )
+        report_asset_cache(asset_lookups)
+        if len(errors) > 0:
+            return errors
+        if outputs is not None:
+            save_inputs(inputs_file, inputs, outputs)
+        return
+
+    state_file = oksfile + ".genstate.json"
+    settings = value_fingerprint(
+        [includefiles, segment, session, emulated_file_name, tpg_enabled, placement, model, local_host]
+    )
+    previous = None
+    if incremental:
+        previous = load_state(state_file, oksfile, settings)
+    with phase("create_db"):
+        if previous is not None:
+            print(f"Updating OKS database file {oksfile}")
+            import oksdbinterfaces
+            db = oksdbinterfaces.Configuration("oksconfig:" + oksfile)
+            batch = ObjectBatch(db)
+        else:
+            print(f"Creating OKS database file {oksfile}")
+            db, batch = create_output(oksfile, includefiles, writer)
+    with phase("build"):
+        rogs = db.get_dals(class_name="ReadoutGroup")
+        groups = readout_groups(rogs)
+        hermes_controllers = db.get_dals(class_name="HermesController")
+
+        if previous is not None:
+            # Same includes and options as last time so reuse the shared
+            # objects generated or looked up then
+            shared = {
+                name: lookup_shared(db, uids) for name, uids in previous["shared"].items()
+            }
+        else:
+            shared = generate_shared(
+                dal, db, batch, rogs, tpg_enabled, buffer_sizes_for(model, groups), local_host,
+            )
+        hermes_fingerprint = dal_fingerprint(*hermes_controllers)
+        rog_hosts, loads = place_groups(groups, shared["hosts"], placement)
+        if not check_memory(model, shared, groups, rog_hosts):
+            batch.discard()
+            return
+
+        appnum = 0
+        ruapps = []
+        group_fingerprints = {}
+        for rog, host in zip(groups, rog_hosts):
+
+            interface_type = type(rog.contains[0]).__name__
+            fingerprint = value_fingerprint(
+                [dal_fingerprint(rog), appnum, host.id, interface_type,
+                 hermes_fingerprint if interface_type == "NICInterface" else None]
+            )
+            if previous is not None and previous["groups"].get(rog.id) == fingerprint:
+                ruapps.append(db.get_dal(class_name="ReadoutApplication", uid=f"ru-{rog.id}"))
+                group_fingerprints[rog.id] = fingerprint
+                appnum = appnum + 1
+                continue
+            if previous is not None and interface_type != "NICInterface":
+                # Only NIC readout has a Hermes application
+                destroy_app(db, "DaqApplication", f"hermes-{rog.id}")
+
+            ru = generate_app(
+                dal, batch, rog, appnum, host, shared, hermes_controllers,
+                tpg_enabled, emulated_file_name, asset_cache,
+            )
+            if ru is None:
+                continue
+            appnum = appnum + 1
+            ruapps.append(ru)
+            group_fingerprints[rog.id] = fingerprint
+        if appnum == 0:
+            print(f"No ReadoutApplications generated\n")
+            batch.discard()
+            return
+        report_placement(loads)
+
+        if previous is not None:
+            for group in previous["groups"]:
+                if group not in group_fingerprints:
+                    print(f"Removing applications of deleted ReadoutGroup {group}")
+                    destroy_app(db, "ReadoutApplication", f"ru-{group}")
+                    destroy_app(db, "DaqApplication", f"hermes-{group}")
+
+        if segment or session:
+            generate_segment(dal, db, batch, readoutmap, ruapps, host, session)
+
+    batch.commit()
+    get_profiler().add_output(oksfile)
+    report_asset_cache(asset_lookups)
+    error = validate_output(batch, writer, validate)
+    if error is not None:
+        return [error]
+    save_state(state_file, settings, shared, group_fingerprints)
+    save_inputs(inputs_file, inputs, [oksfile])
+    return
+
+
+def create_output(oksfile, includefiles, writer=False):
+    """Create the database oksfile including includefiles. Returns the
+    Configuration to look up objects in and the ObjectBatch to write the
+    generated objects with. With writer the batch streams them to oksfile
+    through an OksWriter and the Configuration is only used for reading."""
+    import oksdbinterfaces
+
+    db = oksdbinterfaces.Configuration("oksconfig")
     db.create_db(oksfile, includefiles)
+    if writer:
+        from oksconfgen.oks_writer import OksWriter
+        return db, ObjectBatch(OksWriter(oksfile, includefiles))
+    return db, ObjectBatch(db)
+
+
+def destroy_app(db, class_name, uid):
+    """Remove the application uid of class class_name from db, if there"""
+    try:
+        app = db.get_dal(class_name=class_name, uid=uid)
+    except RuntimeError:
+        return
+    db.destroy_dal(app)
+
+
+def generate_app(
+    dal, batch, rog, appnum, host, shared, hermes_controllers,
+    tpg_enabled, emulated_file_name, asset_cache,
+):
+    """Generate the ReadoutApplication (and for NIC readout the Hermes
+    DaqApplication) for the ReadoutGroup rog. The data reader
+    configuration is generated the first time it is needed and kept in
+    shared. Returns None for unsupported interface types."""
+
+    datareader = generate_data_reader(
+        dal, batch, type(rog.contains[0]).__name__, shared,
+        emulated_file_name, asset_cache,
+    )
+    if datareader is None:
+        print(f"ReadoutGroup contains unknown interface type {type(rog.contains[0]).__name__}")
+        return None
+    if type(rog.contains[0]).__name__ == "NICInterface":
+        hermes_app = dal.DaqApplication(
+            f"hermes-{rog.id}", runs_on=host, modules=hermes_controllers
+        )
+        batch.add(hermes_app)
+
+    ru = dal.ReadoutApplication(
+        f"ru-{rog.id}",
+        runs_on=host,
+        contains=[rog],
+        network_rules=shared["netrules"],
+        queue_rules=shared["qrules"],
+        link_handler=shared["linkhandler"],
+        data_reader=datareader,
+        uses=shared["rohw"],
+    )
+    if tpg_enabled:
+        ru.tp_handler = shared["tphandler"]
+        ru.tp_source_id=appnum + 100
+        ru.ta_source_id=appnum + 1000
+    print(f"{ru=}")
+    batch.add(ru)
+    return ru
+
+
+def readout_groups(rogs):
+    """Return the ReadoutGroups of rogs with an interface type
+    generate_data_reader supports, reporting the others"""
+    groups = []
+    for rog in rogs:
+        interface_type = type(rog.contains[0]).__name__
+        if interface_type in READOUT_INTERFACES:
+            groups.append(rog)
+        else:
+            print(f"ReadoutGroup contains unknown interface type {interface_type}")
+    return groups
+
+
+def generate_data_reader(dal, batch, interface_type, shared, emulated_file_name, asset_cache):
+    """Return the data reader configuration for interface_type, generating
+    it if shared does not hold one yet. Returns None for unsupported
+    interface types."""
+
+    # Emulated stream
+    if interface_type == "ReadoutInterface":
+        if shared["nicrec"] == None:
+            with phase("asset lookup"):
+                data_file_name = resolve_asset_file(
+                    emulated_file_name,
+                    use_cache=asset_cache != "off",
+                    refresh_cache=asset_cache == "refresh",
+                )
+            stream_emu = dal.StreamEmulationParameters(
+                "stream-emu",
+                data_file_name=data_file_name,
+                input_file_size_limit=1000000,
+                set_t0=True,
+                random_population_size=100000,
+                frame_error_rate_hz=0,
+                generate_periodic_adc_pattern=True,
+                TP_rate_per_channel=1,
+            )
+            batch.add(stream_emu)
+            print("Generating NICReceiverConf")
+            shared["nicrec"] = dal.NICReceiverConf(
+                f"nicrcvr-1",
+                template_for="FDFakeCardReader",
+                emulation_mode=1,
+                emulation_conf=stream_emu,
+            )
+            batch.add(shared["nicrec"])
+        return shared["nicrec"]
+    elif interface_type == "NICInterface":
+        if shared["nicrec"] == None:
+            print("Generating NICReceiverConf")
+            shared["nicrec"] = dal.NICReceiverConf(f"nicrcvr-1", template_for="NICReceiver")
+            batch.add(shared["nicrec"])
+        return shared["nicrec"]
+    elif interface_type == "FelixInterface":
+        if shared["flxcard"] == None:
+            print("Generating Felix DataReaderConf")
+            shared["flxcard"] = dal.DataReaderConf(
+                f"flxConf-1", template_for="FelixCardReader"
+            )
+            batch.add(shared["flxcard"])
+        return shared["flxcard"]
+    return None
+
+
+def generate_segment(dal, db, batch, readoutmap, ruapps, host, session):
+    """Generate a Segment containing ruapps and optionally a Session for it"""
+    fsm = db.get_dal(class_name="FSMconfiguration", uid="fsmConf-1")
+    controller = dal.RCApplication("ru-controller", runs_on=host, fsm=fsm)
+    batch.add(controller)
+    seg = dal.Segment(f"ru-segment", controller=controller, applications=ruapps)
+    batch.add(seg)
+
+    if session:
+        ro_maps = db.get_dals(class_name="ReadoutMap")
+        detconf = dal.DetectorConfig("dummy-detector")
+        batch.add(detconf)
+        sessname = os.path.basename(readoutmap).removesuffix(".data.xml")
+        sessiondal = dal.Session(
+            f"{sessname}-session",
+            segment=seg,
+            detector_configuration=detconf,
+            readout_map=ro_maps[0],
+        )
+        batch.add(sessiondal)
 
-    rogs = db.get_dals(class_name="ReadoutGroup")
-    hermes_controllers = db.get_dals(class_name="HermesController")
 
+def generate_sharded(
+    dal, readoutmap, oksfile, includefiles, segment, session,
+    emulated_file_name, tpg_enabled, asset_cache, shards, writer=False, validate=False,
+    placement="balanced",
+    model=None,
+    local_host=None,
+):
+    """Generate the ReadoutApplications in shards worker processes.
+
+    The shared handlers, rules, hosts and data reader configurations are
+    written to <oksfile>-shared.data.xml, each worker writes the
+    applications for a contiguous slice of the ReadoutGroups to
+    <oksfile>-shard<n>.data.xml and oksfile includes all of them (plus
+    the Segment/Session if requested). Application numbers, and so
+    tp/ta source ids, are assigned here exactly as in the serial path.
+  Returns the files written, or None if nothing was generated, and the
+  files that failed validation."""
+
+    base = oksfile.removesuffix(".data.xml")
+    shared_file = f"{base}-shared.data.xml"
+    print(f"Creating shared OKS database file {shared_file}")
+    with phase("create_db"):
+        db, batch = create_output(shared_file, includefiles, writer)
+
+    with phase("build"):
+        rogs = db.get_dals(class_name="ReadoutGroup")
+        groups = readout_groups(rogs)
+        shared = generate_shared(
+            dal, db, batch, rogs, tpg_enabled, buffer_sizes_for(model, groups), local_host,
+        )
+        rog_hosts, loads = place_groups(groups, shared["hosts"], placement)
+        if not check_memory(model, shared, groups, rog_hosts):
+            batch.discard()
+            return None, []
+
+        apps = []
+        for rog, host in zip(groups, rog_hosts):
+            generate_data_reader(
+                dal, batch, type(rog.contains[0]).__name__, shared, emulated_file_name, asset_cache
+            )
+            appnum = len(apps)
+            apps.append((rog.id, appnum, host.id))
+    if len(apps) == 0:
+        print(f"No ReadoutApplications generated\n")
+        batch.discard()
+        return None, []
+    report_placement(loads)
+    batch.commit()
+    error = validate_output(batch, writer, validate)
+    if error is not None:
+        return None, [error]
+    shared_uids = {name: dal_uids(value) for name, value in shared.items()}
+
+    shard_files = []
+    jobs = []
+    shards = min(shards, len(apps))
+    for shard in range(shards):
+        shard_file = f"{base}-shard{shard}.data.xml"
+        shard_files.append(shard_file)
+        jobs.append((
+            shard_file,
+            includefiles + [os.path.basename(shared_file)],
+            apps[shard * len(apps) // shards:(shard + 1) * len(apps) // shards],
+            shared_uids,
+            tpg_enabled,
+            writer,
+            validate,
+        ))
+    print(f"Generating {len(apps)} ReadoutApplications in {shards} shards")
+    from concurrent.futures import ProcessPoolExecutor
+
+    # The phases of the workers are not profiled individually
+    with phase("shards"), ProcessPoolExecutor(max_workers=shards) as executor:
+        errors = [error for error in executor.map(generate_shard, jobs) if error is not None]
+    if len(errors) > 0:
+        return None, errors
+
+    print(f"Creating OKS database file {oksfile}")
+    with phase("create_db"):
+        db, batch = create_output(
+            oksfile,
+            includefiles + [os.path.basename(f) for f in [shared_file] + shard_files],
+            writer,
+        )
+    if segment or session:
+        with phase("build"):
+            ruapps = [
+                db.get_dal(class_name="ReadoutApplication", uid=f"ru-{rog_id}")
+                for rog_id, appnum, host_id in apps
+            ]
+            host = db.get_dal(class_name="VirtualHost", uid=apps[-1][2])
+            generate_segment(dal, db, batch, readoutmap, ruapps, host, session)
+    batch.commit()
+    for filename in [shared_file] + shard_files + [oksfile]:
+        get_profiler().add_output(filename)
+    error = validate_output(batch, writer, validate)
+    if error is not None:
+        return None, [error]
+    return [shared_file] + shard_files + [oksfile], []
+
+
+def generate_shard(job):
+    """Worker process entry point for generate_sharded. Returns the
+    validate_output error of the shard file, if any"""
+    shard_file, includefiles, apps, shared_uids, tpg_enabled, writer, validate = job
+    dal = get_dal_module(includefiles[3])
+    db, batch = create_output(shard_file, includefiles, writer)
+    shared = {name: lookup_shared(db, uids) for name, uids in shared_uids.items()}
+    hermes_controllers = db.get_dals(class_name="HermesController")
+    for rog_id, appnum, host_id in apps:
+        rog = db.get_dal(class_name="ReadoutGroup", uid=rog_id)
+        host = db.get_dal(class_name="VirtualHost", uid=host_id)
+        # The data readers are already in shared, so no asset lookup here
+        generate_app(
+            dal, batch, rog, appnum, host, shared, hermes_controllers,
+            tpg_enabled, None, "off",
+        )
+    batch.commit()
+    return validate_output(batch, writer, validate)
+
+
+def validate_output(batch, writer, validate):
+    """With writer and validate read back the file the OksWriter of batch
+    wrote (see OksWriter.validate). Returns an error message if it does
+    not match what was written, else None."""
+    if not (writer and validate):
+        return None
+    with phase("validate"):
+        if batch.db.validate():
+            return None
+    return f"Validation of {batch.db.oksfile} failed"
+
+
+def buffer_sizes_for(model, rogs):
+    """Return the sizing.buffer_sizes of model for the largest of rogs,
+    or None without a model"""
+    if model is None or len(rogs) == 0:
+        return None
+    from oksconfgen.sizing import buffer_sizes
+
+    return buffer_sizes(model, max(group_streams(rog) for rog in rogs))
+
+
+def check_memory(model, shared, rogs, rog_hosts):
+    """Report the memory the applications of rogs, the groups a
+    ReadoutApplication is generated for, need on rog_hosts with the
+    latency buffers and queues of shared (see sizing.used_sizes) and
+    return False if it exceeds a budget of model"""
+    if model is None or len(rogs) == 0:
+        return True
+    from oksconfgen.sizing import check_budgets, host_footprints, report_footprints, used_sizes
+
+    sizes = used_sizes(model, buffer_sizes_for(model, rogs), shared["linkhandler"], shared["tphandler"], shared["qrules"])
+    footprints = host_footprints(model, sizes, rogs, rog_hosts)
+    report_footprints(footprints)
+    errors = check_budgets(model, footprints)
+    for error in errors:
+        print(f"Error {error}")
+    if len(errors) > 0:
+        print("Memory budget exceeded, nothing generated")
+        return False
+    return True
+
+
+def load_state(state_file, oksfile, settings):
+    """Return the state saved by the previous generation of oksfile, or
+    None if there is none or it was made with different settings"""
+    if not os.path.exists(oksfile):
+        return None
+    try:
+        with open(state_file) as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        print(f"No usable generation state in {state_file}, regenerating {oksfile}")
+        return None
+    if state.get("settings") != settings:
+        print(f"Includes or options changed since {oksfile} was generated, regenerating it")
+        return None
+    return state
+
+
+def load_inputs(inputs_file):
+    try:
+        with open(inputs_file) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def fingerprint_inputs(oksfile, includefiles, emulated_file_name, options, previous):
+    """Return the fingerprint of everything the output of generate_readout
+    depends on and the records of the files read for it, or None if an
+    input cannot be found. Files whose size and mtime match their record
+    in previous (as returned by load_inputs) are not read again."""
+    known = previous.get("files") if previous else None
+    digest, records = files_fingerprint(includefiles, oksfile, known)
+    if digest is None:
+        return None
+    emulated_digest = None
+    if not emulated_file_name.startswith("asset://"):
+        # asset:// URIs name the data by checksum, other files are hashed
+        try:
+            filename = os.path.abspath(resolve_asset_file(emulated_file_name, use_cache=False))
+        except RuntimeError as e:
+            print(f"Cannot fingerprint the emulated data file: {e}")
+            return None
+        records[filename] = file_record(filename, known)
+        emulated_digest = records[filename][2]
+    return {
+        "fingerprint": value_fingerprint([digest, emulated_digest, options, code_fingerprint()]),
+        "files": records,
+    }
+
+
+def _output_stats(outputs):
+    stats = {}
+    for filename in outputs:
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            return None
+        stats[filename] = [stat.st_size, stat.st_mtime_ns]
+    return stats
+
+
+def outputs_up_to_date(inputs, previous):
+    """Whether the outputs recorded in previous were generated from the
+    same inputs and are unchanged since"""
+    if inputs is None or previous is None or previous.get("fingerprint") != inputs["fingerprint"]:
+        return False
+    outputs = previous.get("outputs") or {}
+    return len(outputs) > 0 and _output_stats(outputs) == outputs
+
+
+def save_inputs(inputs_file, inputs, outputs):
+    """Record the inputs the files outputs were generated from"""
+    if inputs is None:
+        return
+    with open(inputs_file, "w") as f:
+        json.dump({**inputs, "outputs": _output_stats(outputs)}, f, indent=2)
+
+
+def dal_uids(value):
+    """Encode a DAL object, list of DAL objects or None as "uid@class"
+    strings for lookup_shared"""
+    if value is None:
+        return None
+    if isinstance(value, list):
+        return [dal_uids(v) for v in value]
+    return f"{value.id}@{value.className()}"
+
+
+def save_state(state_file, settings, shared, groups):
+    state = {
+        "settings": settings,
+        "shared": {name: dal_uids(value) for name, value in shared.items()},
+        "groups": groups,
+    }
+    with open(state_file, "w") as f:
+        json.dump(state, f, indent=2)
+
+
+def lookup_shared(db, uids):
+    if uids is None:
+        return None
+    if isinstance(uids, list):
+        return [lookup_shared(db, uid) for uid in uids]
+    uid, class_name = uids.rsplit("@", 1)
+    return db.get_dal(class_name=class_name, uid=uid)
+
+
+def generate_shared(dal, db, batch, rogs, tpg_enabled, sizes=None, local_host=None):
+    """Find or generate the handlers, rules, hosts and hardware
+    configuration shared by all ReadoutApplications. With sizes (see
+    sizing.buffer_sizes) the generated latency buffers and queues are
+    sized from it, the TPs getting a latency buffer of their own. A
+    missing vlocalhost is generated from the topology.describe
+    description local_host if given."""
     # Check tpg_enabled here, if it is False, then we want to make our own RawDataProcessor
     if len(db.get_dals(class_name="LatencyBuffer")) > 0 and tpg_enabled:
         print(f"Using predefined Latency buffers etc.")
+        if sizes is not None:
+            print("Predefined Latency buffers are not resized, the memory budgets are checked against their sizes")
         reqhandler = db.get_dal(
             class_name="RequestHandler", uid="def-data-request-handler"
         )
@@ -126,7 +722,7 @@ def generate_readout(
     else:
         print(f"Creating locally defined Latency buffers etc.")
         reqhandler = dal.RequestHandler("rh-1")
-        db.update_dal(reqhandler)
+        batch.add(reqhandler)
         latencybuffer = dal.LatencyBuffer(
             "lb-1",
             numa_aware=True,
@@ -135,7 +731,20 @@ def generate_readout(
             alignment_size=4096,
             intrinsic_allocator=True,
         )
-        db.update_dal(latencybuffer)
+        tplatencybuffer = latencybuffer
+        if sizes is not None:
+            for name in ["size", "alignment_size", "numa_node"]:
+                setattr(latencybuffer, name, sizes["data"][name])
+            tplatencybuffer = dal.LatencyBuffer(
+                "lb-tp-1",
+                numa_aware=True,
+                numa_node=sizes["tp"]["numa_node"],
+                size=sizes["tp"]["size"],
+                alignment_size=sizes["tp"]["alignment_size"],
+                intrinsic_allocator=True,
+            )
+            batch.add(tplatencybuffer)
+        batch.add(latencybuffer)
         dataproc = dal.RawDataProcessor(
             "dataproc-1",
             max_ticks_tot=10000,
@@ -146,7 +755,7 @@ def generate_readout(
             tpg_enabled=tpg_enabled,
         )
                     
-        db.update_dal(dataproc)
+        batch.add(dataproc)
         linkhandler = dal.ReadoutModuleConf(
             "linkhandler-1",
             template_for="FDDataLinkHandler",
@@ -155,21 +764,21 @@ def generate_readout(
             latency_buffer=latencybuffer,
             data_processor=dataproc,
         )
-        db.update_dal(linkhandler)
+        batch.add(linkhandler)
         tphandler = dal.ReadoutModuleConf(
             "tphandler-1",
             template_for="TriggerDataHandler",
             input_data_type="TriggerPrimitive",
             request_handler=reqhandler,
-            latency_buffer=latencybuffer,
+            latency_buffer=tplatencybuffer,
             data_processor=dataproc,
         )
-        db.update_dal(tphandler)
+        batch.add(tphandler)
     try:
         rule = db.get_dal(class_name="NetworkConnectionRule", uid="data-req-net-rule")
     except:
         # Failed to get rule, now we have to invent some
-        netrules = generate_net_rules(dal, db)
+        netrules = generate_net_rules(dal, batch)
     else:
         netrules = [rule]
         # Assume we have all the other rules we need
@@ -181,136 +790,51 @@ def generate_readout(
             class_name="QueueConnectionRule", uid="data-requests-queue-rule"
         )
     except:
-        qrules = generate_queue_rules(dal, db)
+        qrules = generate_queue_rules(dal, batch, sizes)
     else:
         qrules = [rule]
         for rule in ["fa-queue-rule", "wib-eth-raw-data-rule", "tp-queue-rule"]:
             qrules.append(db.get_dal(class_name="QueueConnectionRule", uid=rule))
 
-    hosts = []
-    for host in db.get_dals(class_name="VirtualHost"):
-        hosts.append(host.id)
-    if "vlocalhost" not in hosts:
+    hosts = db.get_dals(class_name="VirtualHost")
+    if "vlocalhost" not in [host.id for host in hosts] and local_host is not None:
+        from oksconfgen.generate_hosts import host_dals
+
+        dals, virtuals = host_dals(dal, "localhost", local_host, virtual_host="vlocalhost")
+        batch.add(*dals)
+        hosts += virtuals
+    elif "vlocalhost" not in [host.id for host in hosts]:
         cpus = dal.ProcessingResource("cpus", cpu_cores=[0, 1, 2, 3])
-        db.update_dal(cpus)
+        batch.add(cpus)
         phdal = dal.PhysicalHost("localhost", contains=[cpus])
-        db.update_dal(phdal)
+        batch.add(phdal)
         host = dal.VirtualHost("vlocalhost", runs_on=phdal, uses=[cpus])
-        db.update_dal(host)
-        hosts.append("vlocalhost")
+        batch.add(host)
+        hosts.append(host)
 
     rohw = dal.RoHwConfig(f"rohw-{rogs[0].id}")
-    db.update_dal(rohw)
-
-    appnum = 0
-    nicrec = None
-    flxcard = None
-    ruapps = []
-    for rog in rogs:
-        hostnum = appnum % len(hosts)
-        # print(f"Looking up host[{hostnum}] ({hosts[hostnum]})")
-        host = db.get_dal(class_name="VirtualHost", uid=hosts[hostnum])
-
-        # Emulated stream
-        if type(rog.contains[0]).__name__ == "ReadoutInterface":
-            if nicrec == None:
-                stream_emu = dal.StreamEmulationParameters(
-                    "stream-emu",
-                    data_file_name=resolve_asset_file(emulated_file_name),
-                    input_file_size_limit=1000000,
-                    set_t0=True,
-                    random_population_size=100000,
-                    frame_error_rate_hz=0,
-                    generate_periodic_adc_pattern=True,
-                    TP_rate_per_channel=1,
-                )
-                db.update_dal(stream_emu)
-                print("Generating NICReceiverConf")
-                nicrec = dal.NICReceiverConf(
-                    f"nicrcvr-1",
-                    template_for="FDFakeCardReader",
-                    emulation_mode=1,
-                    emulation_conf=stream_emu,
-                )
-                db.update_dal(nicrec)
-            datareader = nicrec
-        if type(rog.contains[0]).__name__ == "NICInterface":
-            if nicrec == None:
-                print("Generating NICReceiverConf")
-                nicrec = dal.NICReceiverConf(f"nicrcvr-1", template_for="NICReceiver")
-                db.update_dal(nicrec)
-            datareader = nicrec
-            hermes_app = dal.DaqApplication(
-                f"hermes-{rog.id}", runs_on=host, modules=hermes_controllers
-            )
-            db.update_dal(hermes_app)
-        elif type(rog.contains[0]).__name__ == "FelixInterface":
-            if flxcard == None:
-                print("Generating Felix DataReaderConf")
-                flxcard = dal.DataReaderConf(
-                    f"flxConf-1", template_for="FelixCardReader"
-                )
-                db.update_dal(flxcard)
-            datareader = flxcard
-        else :
-            print(f"ReadoutGroup contains unknown interface type {type(rog.contains[0]).__name__}")
-            continue
-
-        ru = dal.ReadoutApplication(
-            f"ru-{rog.id}",
-            runs_on=host,
-            contains=[rog],
-            network_rules=netrules,
-            queue_rules=qrules,
-            link_handler=linkhandler,
-            data_reader=datareader,
-            uses=rohw,
-        )
-        if tpg_enabled:
-            ru.tp_handler = tphandler
-            ru.tp_source_id=appnum + 100
-            ru.ta_source_id=appnum + 1000
-        appnum = appnum + 1
-        print(f"{ru=}")
-        db.update_dal(ru)
-        ruapps.append(ru)
-    if appnum == 0:
-        print(f"No ReadoutApplications generated\n")
-        return
-
-    if segment or session:
-        fsm = db.get_dal(class_name="FSMconfiguration", uid="fsmConf-1")
-        controller = dal.RCApplication("ru-controller", runs_on=host, fsm=fsm)
-        db.update_dal(controller)
-        seg = dal.Segment(f"ru-segment", controller=controller, applications=ruapps)
-        db.update_dal(seg)
-
-        if session:
-            ro_maps = db.get_dals(class_name="ReadoutMap")
-            detconf = dal.DetectorConfig("dummy-detector")
-            db.update_dal(detconf)
-            sessname = os.path.basename(readoutmap).removesuffix(".data.xml")
-            sessiondal = dal.Session(
-                f"{sessname}-session",
-                segment=seg,
-                detector_configuration=detconf,
-                readout_map=ro_maps[0],
-            )
-            db.update_dal(sessiondal)
-
-    db.commit()
-    return
-
-
-def generate_net_rules(dal, db):
+    batch.add(rohw)
+    return {
+        "linkhandler": linkhandler,
+        "tphandler": tphandler,
+        "netrules": netrules,
+        "qrules": qrules,
+        "hosts": hosts,
+        "rohw": rohw,
+        "nicrec": None,
+        "flxcard": None,
+    }
+
+
+def generate_net_rules(dal, batch):
     print(f"Generating network rules")
     netrules = []
     dataservice = dal.Service("dataFragments")
-    db.update_dal(dataservice)
+    batch.add(dataservice)
     tpservice = dal.Service("triggerPrimitives")
-    db.update_dal(tpservice)
+    batch.add(tpservice)
     timeservice = dal.Service("timeSync")
-    db.update_dal(timeservice)
+    batch.add(timeservice)
 
     newdescr = dal.NetworkConnectionDescriptor(
         "fa-net-descr",
@@ -319,11 +843,11 @@ def generate_net_rules(dal, db):
         data_type="DataRequest",
         associated_service=dataservice,
     )
-    db.update_dal(newdescr)
+    batch.add(newdescr)
     newrule = dal.NetworkConnectionRule(
         "fa-net-rule", endpoint_class="FragmentAggregator", descriptor=newdescr
     )
-    db.update_dal(newrule)
+    batch.add(newrule)
     netrules.append(newrule)
 
     newdescr = dal.NetworkConnectionDescriptor(
@@ -333,11 +857,11 @@ def generate_net_rules(dal, db):
         data_type="TriggerActivity",
         associated_service=dataservice,
     )
-    db.update_dal(newdescr)
+    batch.add(newdescr)
     newrule = dal.NetworkConnectionRule(
         "ta-net-rule", endpoint_class="DataSubscriber", descriptor=newdescr
     )
-    db.update_dal(newrule)
+    batch.add(newrule)
     netrules.append(newrule)
 
     newdescr = dal.NetworkConnectionDescriptor(
@@ -347,11 +871,11 @@ def generate_net_rules(dal, db):
         data_type="TPSet",
         associated_service=tpservice,
     )
-    db.update_dal(newdescr)
+    batch.add(newdescr)
     newrule = dal.NetworkConnectionRule(
         "tp-net-rule", endpoint_class="FDDataLinkHandler", descriptor=newdescr
     )
-    db.update_dal(newrule)
+    batch.add(newrule)
     netrules.append(newrule)
 
     newdescr = dal.NetworkConnectionDescriptor(
@@ -361,62 +885,64 @@ def generate_net_rules(dal, db):
         data_type="TimeSync",
         associated_service=timeservice,
     )
-    db.update_dal(newdescr)
+    batch.add(newdescr)
     newrule = dal.NetworkConnectionRule(
         "ts-net-rule", endpoint_class="FDDataLinkHandler", descriptor=newdescr
     )
-    db.update_dal(newrule)
+    batch.add(newrule)
     netrules.append(newrule)
     return netrules
 
 
-def generate_queue_rules(dal, db):
+def generate_queue_rules(dal, batch, sizes=None):
     qrules = []
     newdescr = dal.QueueDescriptor(
         "dataRequest", queue_type="kFollySPSCQueue", data_type="DataRequest"
     )
-    db.update_dal(newdescr)
+    batch.add(newdescr)
     newrule = dal.QueueConnectionRule(
         "data-requests-queue-rule",
         destination_class="FDDataLinkHandler",
         descriptor=newdescr,
     )
-    db.update_dal(newrule)
+    batch.add(newrule)
     qrules.append(newrule)
 
     newdescr = dal.QueueDescriptor(
         "aggregatorInput", queue_type="kFollyMPMCQueue", data_type="Fragment"
     )
-    db.update_dal(newdescr)
+    batch.add(newdescr)
     newrule = dal.QueueConnectionRule(
         "fa-queue-rule",
         destination_class="FragmentAggregator",
         descriptor=newdescr,
     )
-    db.update_dal(newrule)
+    batch.add(newrule)
     qrules.append(newrule)
 
     newdescr = dal.QueueDescriptor(
         "rawWIBInput", queue_type="kFollySPSCQueue", data_type="WIBEthFrame"
     )
-    db.update_dal(newdescr)
+    if sizes is not None:
+        newdescr.capacity = sizes["queues"]["rawWIBInput"]
+    batch.add(newdescr)
     newrule = dal.QueueConnectionRule(
         "rawInputRule", destination_class="FDDataLinkHandler", descriptor=newdescr
     )
-    db.update_dal(newrule)
+    batch.add(newrule)
     qrules.append(newrule)
 
     newdescr = dal.QueueDescriptor(
         "tpInput",
         queue_type="kFollyMPMCQueue",
-        capacity=100000,
+        capacity=100000 if sizes is None else sizes["queues"]["tpInput"],
         data_type="TriggerPrimitive",
     )
-    db.update_dal(newdescr)
+    batch.add(newdescr)
     newrule = dal.QueueConnectionRule(
         "tpRule", destination_class="FDDataLinkHandler", descriptor=newdescr
     )
-    db.update_dal(newrule)
+    batch.add(newrule)
     qrules.append(newrule)
 
     return qrules
@@ -1,25 +1,138 @@
-import oksdbinterfaces
-import coredal
-
 import os
-import glob
 
+from oksconfgen.cache import get_database
+from oksconfgen.instrument import phase
+from oksconfgen.resource_tree import CONTENTS, dal_key
 
-def get_segment_apps(segment):
-    apps = []
+# Fields of the records returned by get_app_inventory
+INVENTORY_FIELDS = ["session", "segment", "uid", "class", "host", "enabled", "disabled_by"]
+
+# database file -> (Configuration, AppInventory)
+_inventories = {}
+
+
+class AppInventory:
+    """Applications of the Sessions of a database.
+
+    The applications found under each Segment are only collected once,
+    however many Sessions or parent Segments refer to it, and so are the
+    contents of each application needed to work out its enabled state.
+    The enabled state follows the same rules as resource_tree: an
+    application is disabled if it or a Segment containing it is in the
+    disabled relationship of the Session, or if everything it contains is
+    disabled."""
 
-    for ss in segment.segments:
-        apps += get_segment_apps(ss)
+    def __init__(self, db):
+        self.db = db
+        # segment key -> [(segment chain, app)] of the segment and its subsegments
+        self._segment_apps = {}
+        # key -> keys of the objects it contains
+        self._contents = {}
 
-    for aa in segment.applications:
-        apps.append(aa.id)
+    def segment_apps(self, segment):
+        """Return (segment chain, app) for every application of segment
+        and its subsegments, where the chain lists the keys of the
+        Segments from segment down to the one holding app"""
+        key = dal_key(segment)
+        if key in self._segment_apps:
+            return self._segment_apps[key]
+        # Iterative post-order walk so that deep Segment trees do not recurse
+        stack = [(segment, False)]
+        in_progress = set()
+        while stack:
+            seg, expanded = stack.pop()
+            seg_key = dal_key(seg)
+            if seg_key in self._segment_apps:
+                continue
+            subsegments = [s for s in seg.segments if dal_key(s) not in in_progress]
+            if not expanded:
+                in_progress.add(seg_key)
+                stack.append((seg, True))
+                stack.extend((s, False) for s in subsegments)
+                continue
+            apps = []
+            for sub in subsegments:
+                apps.extend(([seg_key] + chain, app) for chain, app in self._segment_apps[dal_key(sub)])
+            apps.extend(([seg_key], app) for app in seg.applications)
+            self._segment_apps[seg_key] = apps
+            in_progress.discard(seg_key)
+        return self._segment_apps[key]
 
-    return apps
+    def _children(self, dal):
+        key = dal_key(dal)
+        if key not in self._contents:
+            contains = getattr(dal, "contains", None) or []
+            self._contents[key] = [(dal_key(c), c) for c in contains if c is not None]
+        return self._contents[key]
+
+    def _contents_disabled(self, dal, disabled, memo):
+        """Whether dal is in disabled or is a container everything in
+        which is disabled"""
+        key = dal_key(dal)
+        if key in disabled:
+            return True
+        if key not in memo:
+            memo[key] = False
+            children = self._children(dal)
+            memo[key] = len(children) > 0 and all(
+                self._contents_disabled(c, disabled, memo) for _, c in children
+            )
+        return memo[key]
+
+    def session_records(self, session):
+        """Return an INVENTORY_FIELDS record for each application of session"""
+        disabled = {dal_key(d) for d in session.disabled}
+        memo = {}
+        records = []
+        for chain, app in self.segment_apps(session.segment):
+            key = dal_key(app)
+            disabled_by = None
+            if key in disabled:
+                disabled_by = app.id
+            else:
+                for seg_key in chain:
+                    if seg_key in disabled:
+                        disabled_by = seg_key[0]
+                        break
+                else:
+                    if self._contents_disabled(app, disabled, memo):
+                        disabled_by = CONTENTS
+            host = getattr(app, "runs_on", None)
+            records.append({
+                "session": session.id,
+                "segment": chain[-1][0],
+                "uid": app.id,
+                "class": app.className(),
+                "host": host.id if host is not None else None,
+                "enabled": disabled_by is None,
+                "disabled_by": disabled_by,
+            })
+        return records
+
+
+def get_inventory(oksfile):
+    """Return the database of oksfile and its AppInventory, which is
+    kept for as long as the database is unchanged (see
+    cache.get_database)"""
+    with phase("load"):
+        session_db = get_database(oksfile)
+    key = os.path.abspath(oksfile)
+    cached = _inventories.get(key)
+    if cached is None or cached[0] is not session_db:
+        cached = (session_db, AppInventory(session_db))
+        _inventories[key] = cached
+    return cached
+
+
+def get_segment_apps(segment):
+    return [app.id for chain, app in AppInventory(None).segment_apps(segment)]
 
 
 def get_session_apps(oksfile, session_name=""):
     """Get the apps defined in the given session"""
-    session_db = oksdbinterfaces.Configuration("oksconfig:" + oksfile)
+    import coredal
+
+    session_db = get_database(oksfile)
     if session_name == "":
         session_dals = session_db.get_dals(class_name="Session")
         if len(session_dals) == 0:
@@ -38,17 +151,44 @@ def get_session_apps(oksfile, session_name=""):
     return get_segment_apps(segment)
 
 
+def get_app_inventory(oksfile, session_names=()):
+    """Return an INVENTORY_FIELDS record for every application of the
+    Sessions session_names (all Sessions if empty) of oksfile, which is
+    loaded once"""
+    import coredal
+
+    session_db, inventory = get_inventory(oksfile)
+    session_dals = session_db.get_dals(class_name="Session")
+    if len(session_names) > 0:
+        found = {s.id: s for s in session_dals}
+        missing = [name for name in session_names if name not in found]
+        if len(missing) > 0:
+            print(f"Error could not find Sessions {missing} in file {oksfile}")
+            return None
+        session_dals = [found[name] for name in session_names]
+    if len(session_dals) == 0:
+        print(f"Error could not find any Session in file {oksfile}")
+        return []
+
+    records = []
+    with phase("build"):
+        for session in session_dals:
+            records += inventory.session_records(session)
+    return records
+
+
 def get_database_apps(oksfile):
+    """Return the ids of the apps of every Session of oksfile, by Session"""
+    import coredal
 
     output = {}
-    session_db = oksdbinterfaces.Configuration("oksconfig:" + oksfile)
+    session_db, inventory = get_inventory(oksfile)
     session_dals = session_db.get_dals(class_name="Session")
     if len(session_dals) == 0:
         print(f"Error could not find any Session in file {oksfile}")
         return {}
 
     for session in session_dals:
-        segment = session.segment
-        output[session.id] = get_segment_apps(segment)
+        output[session.id] = [app.id for chain, app in inventory.segment_apps(session.segment)]
 
-    return output
\ No newline at end of file
+    return output
@@ -0,0 +1,93 @@
+import json
+
+_graph = None
+
+
+class IncludeGraph:
+    """Graph of the include relationships between OKS files.
+
+    The direct includes of each file are only read from a database once
+    per process and shared between all databases walked, files included
+    from several places are only visited once and include cycles are
+    recorded rather than followed."""
+
+    def __init__(self):
+        self.edges = {}
+        self.cycles = []
+
+    def _includes(self, db, file, name):
+        if name not in self.edges:
+            self.edges[name] = list(db.get_includes(file))
+        return self.edges[name]
+
+    def walk(self, db, file=None, name=None):
+        """Return all files included directly or indirectly by file (the
+        top level file of db if None), ordered so that every file comes
+        after the files it includes. Only data files are followed, as in
+        the original recursive walk. name is the node name used for the
+        top level file in the graph, default "<db id>"."""
+        if name is None:
+            name = file if file is not None else f"<db {id(db)}>"
+        order = []
+        done = set()
+        in_progress = {name}
+        stack = [(name, iter(self._includes(db, file, name)))]
+        while stack:
+            current, includes = stack[-1]
+            for include in includes:
+                if include in in_progress:
+                    if (current, include) not in self.cycles:
+                        print(f"Include cycle: {current} includes {include}")
+                        self.cycles.append((current, include))
+                    continue
+                if include in done:
+                    continue
+                if "data.xml" in include:
+                    in_progress.add(include)
+                    stack.append((include, iter(self._includes(db, include, include))))
+                    break
+                done.add(include)
+                order.append(include)
+            else:
+                stack.pop()
+                in_progress.discard(current)
+                if current != name:
+                    done.add(current)
+                    order.append(current)
+        return order
+
+    def to_json(self):
+        return json.dumps({"edges": self.edges, "cycles": self.cycles}, indent=2)
+
+    def to_dot(self):
+        lines = ["digraph includes {"]
+        for file, includes in self.edges.items():
+            for include in includes:
+                style = " [color=red]" if (file, include) in self.cycles else ""
+                lines.append(f'  "{file}" -> "{include}"{style};')
+        lines.append("}")
+        return "\n".join(lines) + "\n"
+
+    def dump(self, filename):
+        """Write the graph to filename, as DOT if it ends in .dot and as
+        JSON otherwise"""
+        with open(filename, "w") as f:
+            if filename.endswith(".dot"):
+                f.write(self.to_dot())
+            else:
+                f.write(self.to_json())
+
+
+def get_include_graph():
+    """Return the process wide IncludeGraph"""
+    global _graph
+    if _graph is None:
+        _graph = IncludeGraph()
+    return _graph
+
+
+def reset_include_graph():
+    """Start a new process wide IncludeGraph, e.g. once files may have
+    changed"""
+    global _graph
+    _graph = None
@@ -0,0 +1,208 @@
+import os
+import json
+import fnmatch
+
+# Directory listings are read at most once per process. If the environment
+# variable OKSCONFGEN_INCLUDE_CACHE names a file, listings are also kept
+# there between invocations and reused for as long as the mtime of the
+# directory they came from is unchanged.
+CACHE_ENV = "OKSCONFGEN_INCLUDE_CACHE"
+
+_index = None
+
+
+class IncludeIndex:
+    """Index of the OKS schema and data files found under a set of
+    search directories.
+
+    Each directory is scanned lazily the first time a lookup needs it
+    and the result of every lookup is remembered, so repeated includes
+    cost a dictionary access rather than a filesystem glob."""
+
+    suffixes = (".schema.xml", ".data.xml")
+
+    def __init__(self, cache_file=None):
+        self.cache_file = cache_file
+        self._dirs = {}
+        self._saved = {}
+        self._lookups = {}
+        self._dirty = False
+        if cache_file is not None:
+            self._load()
+
+    def _load(self):
+        try:
+            with open(self.cache_file) as f:
+                self._saved = json.load(f)
+        except (OSError, ValueError):
+            self._saved = {}
+
+    def save(self):
+        """Write the directory listings to the on-disk cache if any of
+        them changed"""
+        if self.cache_file is None or not self._dirty:
+            return
+        listings = dict(self._saved)
+        for path, (mtime, files, subdirs) in self._dirs.items():
+            listings[path] = [mtime, sorted(files), sorted(subdirs)]
+        os.makedirs(os.path.dirname(os.path.abspath(self.cache_file)), exist_ok=True)
+        tmpfile = f"{self.cache_file}.{os.getpid()}"
+        with open(tmpfile, "w") as f:
+            json.dump(listings, f)
+        os.replace(tmpfile, self.cache_file)
+        self._dirty = False
+
+    def refresh(self):
+        """Forget the listings of directories modified since they were
+        read, and every lookup result if there were any"""
+        changed = False
+        for path, (mtime, files, subdirs) in list(self._dirs.items()):
+            try:
+                current = os.stat(path).st_mtime_ns
+            except OSError:
+                current = None
+            if current != mtime:
+                del self._dirs[path]
+                self._saved.pop(path, None)
+                changed = True
+        if changed:
+            self._lookups = {}
+
+    def listdir(self, path):
+        """Return (files, subdirs) for the directory path, where files only
+        contains OKS schema and data files"""
+        path = os.path.abspath(path)
+        if path in self._dirs:
+            return self._dirs[path][1:]
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            self._dirs[path] = (None, frozenset(), frozenset())
+            return self._dirs[path][1:]
+
+        saved = self._saved.get(path)
+        if saved is not None and saved[0] == mtime:
+            self._dirs[path] = (mtime, frozenset(saved[1]), frozenset(saved[2]))
+            return self._dirs[path][1:]
+
+        files = set()
+        subdirs = set()
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if entry.name.startswith("."):
+                        continue
+                    if entry.is_dir():
+                        subdirs.add(entry.name)
+                    elif entry.name.endswith(self.suffixes):
+                        files.add(entry.name)
+        except OSError:
+            pass
+        self._dirs[path] = (mtime, frozenset(files), frozenset(subdirs))
+        self._dirty = True
+        return self._dirs[path][1:]
+
+    def glob(self, pattern, root_dir):
+        """Equivalent of glob.glob(pattern, root_dir=root_dir) restricted to
+        OKS schema and data files. Matches are returned sorted."""
+        key = (os.path.abspath(root_dir), pattern)
+        if key in self._lookups:
+            return self._lookups[key]
+
+        if os.path.isabs(pattern):
+            root = os.sep
+            prefix = os.sep
+        else:
+            root = key[0]
+            prefix = ""
+        parts = [p for p in pattern.split("/") if p != ""]
+        candidates = [""]
+        for part in parts[:-1]:
+            next_candidates = []
+            for rel in candidates:
+                if _is_magic(part):
+                    subdirs = self.listdir(os.path.join(root, rel))[1]
+                    next_candidates += [
+                        os.path.join(rel, d) for d in sorted(fnmatch.filter(subdirs, part))
+                    ]
+                else:
+                    next_candidates.append(os.path.join(rel, part))
+            candidates = next_candidates
+
+        matches = []
+        last = parts[-1] if parts else ""
+        for rel in candidates:
+            files = self.listdir(os.path.join(root, rel))[0]
+            if _is_magic(last):
+                names = sorted(fnmatch.filter(files, last))
+            elif last in files:
+                names = [last]
+            else:
+                names = []
+            matches += [prefix + os.path.join(rel, name) for name in names]
+
+        self._lookups[key] = matches
+        return matches
+
+
+def _is_magic(part):
+    return any(c in part for c in "*?[")
+
+
+def get_index():
+    """Return the process wide IncludeIndex"""
+    global _index
+    if _index is None:
+        _index = IncludeIndex(os.environ.get(CACHE_ENV))
+    return _index
+
+
+def find_file(path, relative_to=None):
+    """Return the file an OKS include path refers to, looking next to the
+    including file relative_to, in the current directory and in
+    DUNEDAQ_SHARE_PATH. None if not found."""
+    dirs = [os.path.dirname(relative_to)] if relative_to else []
+    dirs += [""] + os.environ.get("DUNEDAQ_SHARE_PATH", "").split(":")
+    for path_dir in dirs:
+        candidate = os.path.join(path_dir, path)
+        if os.path.isfile(candidate):
+            return candidate
+    return None
+
+
+def search_dirs(oksfile):
+    """Directories searched for include files: every entry of
+    DUNEDAQ_SHARE_PATH followed by the directory of the output file"""
+    dirs = [path for path in os.environ["DUNEDAQ_SHARE_PATH"].split(":")]
+    dirs.append(os.path.dirname(oksfile))
+    return dirs
+
+
+def find_include(inc, searchdirs, data_dirs=("config", "data")):
+    """Find the file(s) matching the include specification inc.
+
+    A name ending in .data(.xml) is looked for directly in each search
+    directory and then in its data_dirs sub-directories, one ending in
+    .schema(.xml) in its schema sub-directory and anything else is treated
+    as a prefix matched in any sub-directory. The first search directory
+    that yields a match wins. Returns the list of matches (relative to the
+    search directory), empty if nothing was found."""
+
+    index = get_index()
+    inc = inc.removesuffix(".xml")
+    if inc.endswith(".data"):
+        sub_dirs = data_dirs
+    elif inc.endswith(".schema"):
+        sub_dirs = ["schema"]
+    else:
+        sub_dirs = ["*"]
+        inc = inc + "*"
+    for path in searchdirs:
+        matches = index.glob(f"{inc}.xml", path)
+        if len(matches) > 0:
+            return matches
+        for search_dir in sub_dirs:
+            matches = index.glob(f"{search_dir}/{inc}.xml", path)
+            if len(matches) > 0:
+                return matches
+    return []
@@ -0,0 +1,114 @@
+import json
+import os
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+_profiler = None
+
+
+class Profiler:
+    """Collects per-phase wall/CPU time, the number of objects written per
+    class and the bytes written by a generator run.
+
+    Phases nest; the time reported for a phase excludes the time spent in
+    phases nested inside it, so the phase times add up to the total.
+    When disabled (the default) phase() and the counters do nothing."""
+
+    def __init__(self):
+        self.enabled = False
+        self.phases = {}
+        self.objects = Counter()
+        self.outputs = {}
+        self._stack = []
+
+    @contextmanager
+    def phase(self, name):
+        if not self.enabled:
+            yield
+            return
+        # [wall start, cpu start, wall in nested phases, cpu in nested phases]
+        frame = [time.perf_counter(), time.process_time(), 0.0, 0.0]
+        self._stack.append(frame)
+        try:
+            yield
+        finally:
+            self._stack.pop()
+            wall = time.perf_counter() - frame[0]
+            cpu = time.process_time() - frame[1]
+            totals = self.phases.setdefault(name, {"wall_s": 0.0, "cpu_s": 0.0, "calls": 0})
+            totals["wall_s"] += wall - frame[2]
+            totals["cpu_s"] += cpu - frame[3]
+            totals["calls"] += 1
+            if self._stack:
+                self._stack[-1][2] += wall
+                self._stack[-1][3] += cpu
+
+    def count_objects(self, dals):
+        if self.enabled:
+            self.objects.update(dal.className() for dal in dals)
+
+    def add_output(self, filename):
+        if self.enabled and os.path.exists(filename):
+            self.outputs[filename] = os.path.getsize(filename)
+
+    def report(self):
+        return {
+            "phases": self.phases,
+            "objects": dict(self.objects),
+            "total_objects": sum(self.objects.values()),
+            "bytes_written": sum(self.outputs.values()),
+            "outputs": self.outputs,
+        }
+
+    def summary(self):
+        lines = [f"{'Phase':<24}{'Calls':>8}{'Wall [s]':>12}{'CPU [s]':>12}"]
+        for name, totals in self.phases.items():
+            lines.append(
+                f"{name:<24}{totals['calls']:>8}{totals['wall_s']:>12.3f}{totals['cpu_s']:>12.3f}"
+            )
+        lines.append("")
+        lines.append(f"{'Class':<36}{'Objects':>10}")
+        for class_name, count in self.objects.most_common():
+            lines.append(f"{class_name:<36}{count:>10}")
+        lines.append(f"{'Total':<36}{sum(self.objects.values()):>10}")
+        lines.append("")
+        for filename, size in self.outputs.items():
+            lines.append(f"Wrote {size} bytes to {filename}")
+        return "\n".join(lines)
+
+
+def get_profiler():
+    """Return the process wide Profiler"""
+    global _profiler
+    if _profiler is None:
+        _profiler = Profiler()
+    return _profiler
+
+
+def phase(name):
+    """Context manager timing the enclosed code as phase name of the
+    process wide Profiler"""
+    return get_profiler().phase(name)
+
+
+def enable_profiling():
+    get_profiler().enabled = True
+
+
+def reset_profiling():
+    """Discard the process wide Profiler, disabling profiling"""
+    global _profiler
+    _profiler = None
+
+
+def report_profile(json_file=None):
+    """Print the profile summary, and write it as JSON to json_file if
+    given. Does nothing unless profiling was enabled."""
+    profiler = get_profiler()
+    if not profiler.enabled:
+        return
+    print(profiler.summary())
+    if json_file:
+        with open(json_file, "w") as f:
+            json.dump(profiler.report(), f, indent=2)
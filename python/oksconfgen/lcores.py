@@ -0,0 +1,97 @@
+import json
+
+from oksconfgen.topology import host_topology, node_cpus
+
+# lcores the rx queues are dealt out to when none are given
+DEFAULT_LCORES = [1, 2, 3, 4]
+
+
+class LcoreAllocator:
+    """Assigns the DPDK lcore of each rx queue of the NICs of a readout map.
+
+    The lcores of a NIC are the lcores given, or with a topology (see
+    topology.load_topology) the non-housekeeping CPUs of the NUMA node
+    of the NIC's PCI device (restricted to the lcores given if any of
+    them are on that node). Queues are placed, most streams first, on the
+    candidate lcore with the fewest streams so far on that host, so NICs
+    sharing a host share the load of its lcores. With max_streams > 0 no
+    lcore gets more than that many streams if it can be avoided, and
+    lcores that still do are flagged as over_cap in the report."""
+
+    def __init__(self, lcores=None, topology=None, max_streams=0):
+        self.lcores = list(lcores or [])
+        self.topology = topology
+        self.max_streams = max_streams
+        # (rx_host, lcore) -> {"streams", "queues", "nics", "numa_node"}
+        self.load = {}
+
+    def candidates(self, rx_host, pcie_dev):
+        """Return the NUMA node of the NIC (None if unknown) and its lcores"""
+        description = host_topology(self.topology, rx_host) if self.topology else None
+        if description is None:
+            return None, self.lcores or DEFAULT_LCORES
+        node = description.get("nics", {}).get(pcie_dev)
+        cpus = node_cpus(description, node)
+        if len(self.lcores) > 0:
+            wanted = [c for c in cpus if c in self.lcores]
+            if len(wanted) == 0:
+                print(f"None of lcores {self.lcores} are on NUMA node {node} of {rx_host}, using {cpus}")
+            else:
+                cpus = wanted
+        if len(cpus) == 0:
+            raise ValueError(f"No CPUs left for readout on NUMA node {node} of {rx_host}")
+        return node, cpus
+
+    def assign(self, rx_host, rx_mac, pcie_dev, queue_streams):
+        """Return the lcore of each rx queue of a NIC, given the number of
+        streams of each queue"""
+        node, cpus = self.candidates(rx_host, pcie_dev)
+        for lcore in cpus:
+            self.load.setdefault((rx_host, lcore), {"streams": 0, "queues": 0, "nics": [], "numa_node": node})
+        assigned = [None] * len(queue_streams)
+        for queue in sorted(range(len(queue_streams)), key=lambda q: (-queue_streams[q], q)):
+            streams = queue_streams[queue]
+            # Least loaded lcore that stays within the cap, else least loaded
+            lcore = min(
+                cpus,
+                key=lambda c: (
+                    self.max_streams > 0 and self.load[(rx_host, c)]["streams"] + streams > self.max_streams,
+                    self.load[(rx_host, c)]["streams"],
+                    self.load[(rx_host, c)]["queues"],
+                    cpus.index(c),
+                ),
+            )
+            load = self.load[(rx_host, lcore)]
+            load["streams"] += streams
+            load["queues"] += 1
+            if rx_mac not in load["nics"]:
+                load["nics"].append(rx_mac)
+            assigned[queue] = lcore
+        return assigned
+
+    def report(self):
+        """Return a record of rx_host, lcore, numa_node, streams, queues,
+        nics and over_cap for each lcore used"""
+        return [
+            {"rx_host": host, "lcore": lcore, **load,
+             "over_cap": self.max_streams > 0 and load["streams"] > self.max_streams}
+            for (host, lcore), load in sorted(self.load.items())
+            if load["queues"] > 0
+        ]
+
+
+def report_lcores(allocator, report_json=None):
+    """Print the lcore assignment of allocator and if report_json is
+    given also write it to that file as JSON"""
+    records = allocator.report()
+    print(f"{'Host':<30} {'NUMA':>4} {'lcore':>5} {'Queues':>6} {'Streams':>7} NICs")
+    for r in records:
+        node = "-" if r["numa_node"] is None else r["numa_node"]
+        print(f"{r['rx_host']:<30} {node:>4} {r['lcore']:>5} {r['queues']:>6} {r['streams']:>7} {' '.join(r['nics'])}")
+    over_cap = [r for r in records if r["over_cap"]]
+    if len(over_cap) > 0:
+        names = ", ".join(f"{r['rx_host']}:{r['lcore']}" for r in over_cap)
+        print(f"Warning {len(over_cap)} lcores have more than {allocator.max_streams} streams: {names}")
+    if report_json:
+        with open(report_json, "w") as f:
+            json.dump({"max_streams": allocator.max_streams, "lcores": records}, f, indent=2)
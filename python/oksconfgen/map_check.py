@@ -0,0 +1,194 @@
+import json
+
+from oksconfgen.dromap2oks import iter_json_array
+
+ENTRY_FIELDS = ["src_id", "geo_id", "kind", "parameters"]
+GEO_FIELDS = ["det_id", "crate_id", "slot_id", "stream_id"]
+
+# kind -> parameters every stream of that kind needs
+REQUIRED_PARAMETERS = {
+    "eth": ["protocol", "mode", "rx_host", "rx_mac", "rx_ip", "rx_iface", "rx_pcie_dev",
+            "tx_host", "tx_mac", "tx_ip"],
+    "flx": ["protocol", "mode", "card", "slr", "link"],
+}
+
+_ENTRY_KEYS = set(ENTRY_FIELDS)
+_GEO_KEYS = set(GEO_FIELDS)
+_REQUIRED_KEYS = {kind: set(names) for kind, names in REQUIRED_PARAMETERS.items()}
+
+# NIC parameters that must be the same for every stream of a NIC (rx_mac)
+NIC_PARAMETERS = ["rx_host", "rx_ip", "rx_iface", "rx_pcie_dev"]
+
+
+class MapChecker:
+    """Checks the entries of a JSON readout map in one pass, before
+    dromap2oks converts it, for everything that would make the
+    conversion fail or silently produce a broken map:
+
+    - malformed entries, unknown kinds and missing parameters
+    - duplicate src_id (the later stream would replace the earlier one)
+    - duplicate geo_id
+    - NICs (rx_mac) whose streams disagree on the NIC parameters, or
+      that share an rx_host and so would get the same nic-<rx_host> id
+    - streams of a NIC or Felix card/slr that are not contiguous (each
+      run of streams becomes its own interface)
+    - Felix links used twice on one card/slr
+
+    The last two NIC checks are skipped with contiguous=False, for the
+    partitioned conversion which groups streams regardless of order and
+    gives NICs sharing an rx_host distinct ids.
+
+    Each problem is recorded as a dict with the index of the entry, its
+    src_id, an error code and a message. The number of streams of each
+    interface, ("eth", rx_host, rx_mac) or ("flx", card, slr), is kept
+    in interface_streams and the NICs of each rx_host in host_nics."""
+
+    def __init__(self, contiguous=True):
+        self.contiguous = contiguous
+        self.errors = []
+        self.entries = 0
+        self.interface_streams = {}
+        self.host_nics = {}
+        self._src_ids = {}
+        self._geo_ids = {}
+        self._nics = {}
+        self._nic_hosts = {}
+        self._felix_links = {}
+        self._closed_runs = {"eth": set(), "flx": set()}
+        self._last_run = {"eth": None, "flx": None}
+
+    def error(self, index, src_id, code, message):
+        self.errors.append({"index": index, "src_id": src_id, "error": code, "message": message})
+
+    def _check_run(self, index, src_id, kind, run):
+        """Check that the streams of run (a NIC rx_mac or Felix (card,
+        slr)) are contiguous"""
+        last = self._last_run[kind]
+        if run == last:
+            return
+        if last is not None:
+            self._closed_runs[kind].add(last)
+        if run in self._closed_runs[kind]:
+            what = f"NIC {run}" if kind == "eth" else f"Felix card {run[0]} slr {run[1]}"
+            self.error(index, src_id, f"non_contiguous_{'nic' if kind == 'eth' else 'felix'}",
+                       f"Streams of {what} are not contiguous in the map, it would be split into several interfaces")
+        self._last_run[kind] = run
+
+    def check_eth(self, index, src_id, pars):
+        rx_mac = pars["rx_mac"]
+        interface = ("eth", pars["rx_host"], rx_mac)
+        self.interface_streams[interface] = self.interface_streams.get(interface, 0) + 1
+        if self.contiguous:
+            self._check_run(index, src_id, "eth", rx_mac)
+        nic = tuple(pars[name] for name in NIC_PARAMETERS)
+        if rx_mac not in self._nics:
+            self._nics[rx_mac] = (index, nic)
+            self.host_nics.setdefault(pars["rx_host"], []).append(rx_mac)
+            host_nic = self._nic_hosts.setdefault(pars["rx_host"], rx_mac)
+            if host_nic != rx_mac and self.contiguous:
+                self.error(index, src_id, "duplicate_nic_id",
+                           f"NICs {host_nic} and {rx_mac} are both on rx_host {pars['rx_host']} "
+                           f"and would both get the id nic-{pars['rx_host']}")
+        elif self._nics[rx_mac][1] != nic:
+            first, first_nic = self._nics[rx_mac]
+            differ = [i for i in range(len(nic)) if first_nic[i] != nic[i]]
+            self.error(index, src_id, "inconsistent_nic",
+                       f"NIC {rx_mac} has {', '.join(f'{NIC_PARAMETERS[i]}={nic[i]}' for i in differ)} here but "
+                       f"{', '.join(f'{NIC_PARAMETERS[i]}={first_nic[i]}' for i in differ)} in entry {first}")
+
+    def check_flx(self, index, src_id, pars):
+        card = (pars["card"], pars["slr"])
+        interface = ("flx",) + card
+        self.interface_streams[interface] = self.interface_streams.get(interface, 0) + 1
+        if self.contiguous:
+            self._check_run(index, src_id, "flx", card)
+        link = card + (pars["link"],)
+        if link in self._felix_links:
+            self.error(index, src_id, "duplicate_felix_link",
+                       f"Link {pars['link']} of Felix card {card[0]} slr {card[1]} is already used by entry {self._felix_links[link]}")
+        else:
+            self._felix_links[link] = index
+
+    def check(self, index, entry):
+        """Check the entry at index of the map"""
+        self.entries += 1
+        if not isinstance(entry, dict):
+            self.error(index, None, "invalid_entry", "Entry is not a JSON object")
+            return
+        src_id = entry.get("src_id")
+        if not entry.keys() >= _ENTRY_KEYS:
+            missing = [name for name in ENTRY_FIELDS if name not in entry]
+            self.error(index, src_id, "missing_field", f"Entry has no {', '.join(missing)}")
+            return
+        if type(src_id) is not int:
+            self.error(index, src_id, "invalid_src_id", f"src_id {src_id!r} is not an integer")
+        elif src_id in self._src_ids:
+            self.error(index, src_id, "duplicate_src_id",
+                       f"src_id {src_id} is already used by entry {self._src_ids[src_id]}")
+        else:
+            self._src_ids[src_id] = index
+
+        geo = entry["geo_id"]
+        if not isinstance(geo, dict) or not geo.keys() >= _GEO_KEYS:
+            self.error(index, src_id, "invalid_geo_id", f"geo_id must have {', '.join(GEO_FIELDS)}")
+            return
+        geo_key = tuple(geo[name] for name in GEO_FIELDS)
+        if geo_key in self._geo_ids:
+            self.error(index, src_id, "duplicate_geo_id",
+                       f"geo_id {dict(zip(GEO_FIELDS, geo_key))} is already used by entry {self._geo_ids[geo_key]}")
+        else:
+            self._geo_ids[geo_key] = index
+
+        kind = entry["kind"]
+        if kind not in REQUIRED_PARAMETERS:
+            self.error(index, src_id, "unknown_kind", f"Unknown kind of readout {kind}")
+            return
+        pars = entry["parameters"]
+        if not isinstance(pars, dict) or not pars.keys() >= _REQUIRED_KEYS[kind]:
+            missing = [name for name in REQUIRED_PARAMETERS[kind] if not isinstance(pars, dict) or name not in pars]
+            self.error(index, src_id, "missing_parameter",
+                       f"{kind} stream has no {', '.join(missing)} parameter")
+            return
+        if kind == "eth":
+            self.check_eth(index, src_id, pars)
+        else:
+            self.check_flx(index, src_id, pars)
+
+
+def scan_readout_map(jsonfile, contiguous=True):
+    """Check the JSON readout map jsonfile and return the MapChecker"""
+    checker = MapChecker(contiguous)
+    try:
+        with open(jsonfile) as f:
+            for index, entry in enumerate(iter_json_array(f)):
+                checker.check(index, entry)
+    except ValueError as e:
+        checker.error(checker.entries, None, "invalid_json", str(e))
+    return checker
+
+
+def check_readout_map(jsonfile):
+    """Check the JSON readout map jsonfile (see MapChecker) and return the
+    list of problems found, empty if there are none"""
+    return scan_readout_map(jsonfile).errors
+
+
+def check_map(jsonfile, errors_json=None):
+    """Check jsonfile, report the problems found and return them"""
+    errors = check_readout_map(jsonfile)
+    if len(errors) > 0:
+        report_errors(jsonfile, errors, errors_json)
+    else:
+        print(f"No errors in readout map {jsonfile}")
+    return errors
+
+
+def report_errors(jsonfile, errors, errors_json=None):
+    """Print errors found in jsonfile and if errors_json is given also
+    write them to that file as JSON"""
+    for e in errors:
+        print(f"Error in {jsonfile} entry {e['index']} (src_id {e['src_id']}): {e['message']} [{e['error']}]")
+    print(f"{len(errors)} errors in readout map {jsonfile}")
+    if errors_json:
+        with open(errors_json, "w") as f:
+            json.dump({"file": jsonfile, "errors": errors}, f, indent=2)
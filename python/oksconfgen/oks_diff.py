@@ -0,0 +1,125 @@
+import json
+from collections import Counter
+
+from oksconfgen.consolidate import ObjectRef, encode_dal
+from oksconfgen.instrument import phase
+
+
+def load_records(oksfile):
+    """Return (class name, uid) -> attribute and relationship values of
+    every object of oksfile and the files it includes, relationships
+    held as ObjectRefs. Run in a worker process by diff_databases."""
+    import oksdbinterfaces
+
+    db = oksdbinterfaces.Configuration("oksconfig:" + oksfile)
+    dals = db.get_all_dals()
+    records = {}
+    for dal in dals:
+        record = encode_dal(dals[dal])
+        records[(record.class_name, record.uid)] = record.values
+    return records
+
+
+def _show(value):
+    if isinstance(value, ObjectRef):
+        return f"{value.uid}@{value.class_name}"
+    if isinstance(value, list):
+        return [_show(v) for v in value]
+    return value
+
+
+def diff_values(old, new):
+    """Return name -> {"old", "new", "order_only"} for each attribute or
+    relationship whose value differs between the values old and new of
+    an object. order_only is set for lists holding the same values in a
+    different order."""
+    changes = {}
+    for name in sorted(old.keys() | new.keys()):
+        a = old.get(name)
+        b = new.get(name)
+        if a == b:
+            continue
+        order_only = isinstance(a, list) and isinstance(b, list) and \
+            Counter(map(repr, a)) == Counter(map(repr, b))
+        changes[name] = {"old": _show(a), "new": _show(b), "order_only": order_only}
+    return changes
+
+
+def diff_objects(objects):
+    """Return [class, uid, changes] for each of objects, (key, old values,
+    new values) tuples, whose values differ"""
+    changed = []
+    for key, old, new in objects:
+        if old != new:
+            changed.append([key[0], key[1], diff_values(old, new)])
+    return changed
+
+
+def diff_databases(old_file, new_file, workers=1):
+    """Compare the objects of the databases old_file and new_file by
+    (class, uid) and return the added, removed and changed objects.
+
+    With workers > 1 the two databases are loaded in parallel worker
+    processes. The objects are compared here: shipping them out to
+    workers again would cost more than comparing them."""
+    if workers > 1:
+        from concurrent.futures import ProcessPoolExecutor
+
+        with phase("load"), ProcessPoolExecutor(max_workers=2) as executor:
+            old, new = executor.map(load_records, [old_file, new_file])
+    else:
+        with phase("load"):
+            old = load_records(old_file)
+            new = load_records(new_file)
+    with phase("compare"):
+        changed = diff_objects((key, old[key], new[key]) for key in sorted(old.keys() & new.keys()))
+    return {
+        "old": old_file,
+        "new": new_file,
+        "objects": [len(old), len(new)],
+        "added": [{"class": c, "uid": u} for c, u in sorted(new.keys() - old.keys())],
+        "removed": [{"class": c, "uid": u} for c, u in sorted(old.keys() - new.keys())],
+        "changed": [{"class": c, "uid": u, "changes": changes} for c, u, changes in changed],
+    }
+
+
+def diff_summary(diff):
+    """Return class name -> {"added", "removed", "changed"} counts"""
+    summary = {}
+    for kind in ["added", "removed", "changed"]:
+        for obj in diff[kind]:
+            counts = summary.setdefault(obj["class"], {"added": 0, "removed": 0, "changed": 0})
+            counts[kind] += 1
+    return dict(sorted(summary.items()))
+
+
+def report_diff(diff, brief=False):
+    """Print diff, only the per class counts if brief"""
+    if not brief:
+        for obj in diff["removed"]:
+            print(f"- {obj['class']} {obj['uid']}")
+        for obj in diff["added"]:
+            print(f"+ {obj['class']} {obj['uid']}")
+        for obj in diff["changed"]:
+            print(f"~ {obj['class']} {obj['uid']}")
+            for name, change in obj["changes"].items():
+                if change["order_only"]:
+                    print(f"    {name}: order changed")
+                else:
+                    print(f"    {name}: {change['old']!r} -> {change['new']!r}")
+    for class_name, counts in diff_summary(diff).items():
+        print(f"{class_name:<30} {counts['added']:>6} added {counts['removed']:>6} removed {counts['changed']:>6} changed")
+    print(f"{diff['old']} ({diff['objects'][0]} objects) -> {diff['new']} ({diff['objects'][1]} objects): "
+          f"{len(diff['added'])} added, {len(diff['removed'])} removed, {len(diff['changed'])} changed")
+
+
+def oks_diff(old_file, new_file, workers=1, json_file=None, brief=False):
+    """Compare old_file and new_file (see diff_databases), report the
+    differences and write them to json_file as JSON if given. Returns
+    the number of objects added, removed or changed."""
+    diff = diff_databases(old_file, new_file, workers)
+    report_diff(diff, brief)
+    if json_file:
+        with open(json_file, "w") as f:
+            json.dump({**diff, "summary": diff_summary(diff)}, f, indent=2)
+    return len(diff["added"]) + len(diff["removed"]) + len(diff["changed"])
@@ -0,0 +1,355 @@
+import getpass
+import hashlib
+import json
+import os
+import socket
+import time
+import xml.etree.ElementTree as ET
+
+from oksconfgen.includes import find_file
+
+OKS_VERSION = "862f2957270"
+
+DATA_HEADER = """<?xml version="1.0" encoding="ASCII"?>
+
+<!-- oks-data version 2.2 -->
+
+
+<!DOCTYPE oks-data [
+  <!ELEMENT oks-data (info, (include)?, (comments)?, (obj)+)>
+  <!ELEMENT info EMPTY>
+  <!ATTLIST info
+      name CDATA #IMPLIED
+      type CDATA #IMPLIED
+      num-of-items CDATA #REQUIRED
+      oks-format CDATA #FIXED "data"
+      oks-version CDATA #REQUIRED
+      created-by CDATA #IMPLIED
+      created-on CDATA #IMPLIED
+      creation-time CDATA #IMPLIED
+      last-modified-by CDATA #IMPLIED
+      last-modified-on CDATA #IMPLIED
+      last-modification-time CDATA #IMPLIED
+  >
+  <!ELEMENT include (file)*>
+  <!ELEMENT file EMPTY>
+  <!ATTLIST file
+      path CDATA #REQUIRED
+  >
+  <!ELEMENT comments (comment)*>
+  <!ELEMENT comment EMPTY>
+  <!ATTLIST comment
+      creation-time CDATA #REQUIRED
+      created-by CDATA #REQUIRED
+      created-on CDATA #REQUIRED
+      author CDATA #REQUIRED
+      text CDATA #REQUIRED
+  >
+  <!ELEMENT obj (attr | rel)*>
+  <!ATTLIST obj
+      class CDATA #REQUIRED
+      id CDATA #REQUIRED
+  >
+  <!ELEMENT attr (data)*>
+  <!ATTLIST attr
+      name CDATA #REQUIRED
+      type (bool|s8|u8|s16|u16|s32|u32|s64|u64|float|double|date|time|string|uid|enum|class|-) "-"
+      val CDATA ""
+  >
+  <!ELEMENT data EMPTY>
+  <!ATTLIST data
+      val CDATA #REQUIRED
+  >
+  <!ELEMENT rel (ref)*>
+  <!ATTLIST rel
+      name CDATA #REQUIRED
+      class CDATA ""
+      id CDATA ""
+  >
+  <!ELEMENT ref EMPTY>
+  <!ATTLIST ref
+      class CDATA #REQUIRED
+      id CDATA #REQUIRED
+  >
+]>
+
+<oks-data>
+
+"""
+
+# Room left in the info line for num-of-items, which is only known at the end
+_ITEMS_WIDTH = 20
+
+_INT_TYPES = ("s8", "u8", "s16", "u16", "s32", "u32", "s64", "u64")
+
+
+def _quote(value):
+    value = str(value)
+    if "&" in value or "<" in value or ">" in value or '"' in value:
+        value = value.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;").replace('"', "&quot;")
+    return '"' + value + '"'
+
+
+def _is_dal(value):
+    return hasattr(value, "className") and hasattr(value, "id")
+
+
+def convert_value(oks_type, value):
+    """Convert value to the Python type oksdbinterfaces uses for an
+    attribute of OKS type oks_type"""
+    if isinstance(value, list):
+        return [convert_value(oks_type, v) for v in value]
+    if oks_type == "bool":
+        return bool(value)
+    if oks_type in _INT_TYPES:
+        return int(value)
+    if oks_type in ("float", "double"):
+        return float(value)
+    return value
+
+
+def format_value(oks_type, value):
+    if oks_type == "bool":
+        return "1" if value else "0"
+    return str(value)
+
+
+def infer_type(value):
+    """OKS type for an attribute not found in the schema"""
+    if isinstance(value, list):
+        return infer_type(value[0]) if len(value) > 0 else "string"
+    if isinstance(value, bool):
+        return "bool"
+    if isinstance(value, int):
+        return "s64"
+    if isinstance(value, float):
+        return "double"
+    return "string"
+
+
+class OksSchema:
+    """Attribute types and relationship multiplicities of the classes
+    defined by a set of OKS schema files and the schema files they
+    include"""
+
+    def __init__(self, schemafiles):
+        self.classes = {}
+        self.missing = []
+        self._resolved = {}
+        seen = set()
+        stack = [(path, None) for path in reversed(schemafiles) if path.endswith(".schema.xml")]
+        while stack:
+            path, relative_to = stack.pop()
+            filename = find_file(path, relative_to)
+            if filename is None:
+                self.missing.append(path)
+                continue
+            filename = os.path.realpath(filename)
+            if filename in seen:
+                continue
+            seen.add(filename)
+            root = ET.parse(filename).getroot()
+            for inc in root.iter("file"):
+                stack.append((inc.get("path"), filename))
+            for cls in root.iter("class"):
+                self.classes[cls.get("name")] = {
+                    "superclasses": [s.get("name") for s in cls.iter("superclass")],
+                    "attributes": {
+                        a.get("name"): a.get("type") for a in cls.iter("attribute")
+                    },
+                    "relationships": {
+                        r.get("name"): r.get("high-cc") == "many" for r in cls.iter("relationship")
+                    },
+                }
+
+    def resolve(self, class_name):
+        """Return (attributes, relationships) of class_name including
+        inherited ones, as name -> OKS type and name -> is multi-valued"""
+        if class_name in self._resolved:
+            return self._resolved[class_name]
+        attributes = {}
+        relationships = {}
+        cls = self.classes.get(class_name)
+        if cls is not None:
+            for superclass in cls["superclasses"]:
+                super_attributes, super_relationships = self.resolve(superclass)
+                attributes.update(super_attributes)
+                relationships.update(super_relationships)
+            attributes.update(cls["attributes"])
+            relationships.update(cls["relationships"])
+        self._resolved[class_name] = (attributes, relationships)
+        return self._resolved[class_name]
+
+
+class OksWriter:
+    """Write-only replacement for an oksdbinterfaces.Configuration that
+    streams the objects given to update_dal straight to an OKS .data.xml
+    file instead of holding them until commit.
+
+    Each object is encoded as soon as it is written, so nothing but the
+    object being written is kept. It follows that every object must be
+    written exactly once and that update_dal never follows relationships:
+    related objects have to be written by the caller (ObjectBatch does
+    this). Attribute types come from the schema files in includes; values
+    of classes or attributes missing from the schema are written with a
+    type guessed from the Python value.
+
+    The objects are written to a temporary file next to oksfile that only
+    replaces it on commit(), so an existing oksfile is left as it was if
+    the writer is discarded (or dropped) without committing.
+
+    A digest of everything written is kept for validate()."""
+
+    def __init__(self, oksfile, includes, buffer_size=1 << 20):
+        self.oksfile = oksfile
+        self.includes = list(includes)
+        self.schema = OksSchema(self.includes)
+        if self.schema.missing:
+            print(f"Warning could not find schema files {self.schema.missing}, guessing attribute types")
+        self.written = 0
+        self._digest = hashlib.sha256()
+        self._tmpfile = f"{oksfile}.{os.getpid()}.tmp"
+        self._file = open(self._tmpfile, "wb", buffering=buffer_size)
+        self._file.write(DATA_HEADER.encode("ascii"))
+        self._info_offset = self._file.tell()
+        self._file.write(self._info_line(0))
+        if len(self.includes) > 0:
+            self._write("<include>\n")
+            for inc in self.includes:
+                self._write(f" <file path={_quote(inc)}/>\n")
+            self._write("</include>\n")
+        self._write("\n\n")
+
+    def _write(self, text):
+        self._file.write(text.encode("ascii", "xmlcharrefreplace"))
+
+    def _info_line(self, items):
+        user = _quote(getpass.getuser())
+        host = _quote(socket.gethostname())
+        now = _quote(time.strftime("%Y%m%dT%H%M%S", time.gmtime()))
+        count = _quote(items).ljust(_ITEMS_WIDTH + 2)
+        line = (
+            f'<info name="" type="" num-of-items={count} oks-format="data" oks-version="{OKS_VERSION}" '
+            f"created-by={user} created-on={host} creation-time={now} "
+            f"last-modified-by={user} last-modified-on={host} last-modification-time={now}/>\n\n"
+        )
+        return line.encode("ascii", "xmlcharrefreplace")
+
+    def update_dal(self, dal_obj, ignore_error=True, at=None, cache=None, recurse=False):
+        class_name = dal_obj.className()
+        attributes, relationships = self.schema.resolve(class_name)
+        attr_lines = []
+        attr_record = []
+        rel_lines = []
+        rel_record = []
+        values = vars(dal_obj)
+        for name in sorted(values):
+            value = values[name]
+            if name == "id" or name.startswith("_") or value is None:
+                continue
+            is_rel = name in relationships or _is_dal(value) or (
+                isinstance(value, list) and len(value) > 0 and _is_dal(value[0])
+            )
+            if is_rel:
+                refs = value if isinstance(value, list) else [value]
+                rel_record.append([name, [f"{v.id}@{v.className()}" for v in refs]])
+                if relationships.get(name, isinstance(value, list)):
+                    rel_lines.append(f" <rel name={_quote(name)}>\n")
+                    for ref in refs:
+                        rel_lines.append(f"  <ref class={_quote(ref.className())} id={_quote(ref.id)}/>\n")
+                    rel_lines.append(" </rel>\n")
+                else:
+                    rel_lines.append(
+                        f" <rel name={_quote(name)} class={_quote(value.className())} id={_quote(value.id)}/>\n"
+                    )
+                continue
+            if name not in attributes and isinstance(value, list) and len(value) == 0:
+                # Cannot tell an empty relationship from an empty attribute
+                continue
+            oks_type = attributes.get(name) or infer_type(value)
+            value = convert_value(oks_type, value)
+            attr_record.append([name, value])
+            if isinstance(value, list):
+                attr_lines.append(f" <attr name={_quote(name)} type={_quote(oks_type)}>\n")
+                for v in value:
+                    attr_lines.append(f"  <data val={_quote(format_value(oks_type, v))}/>\n")
+                attr_lines.append(" </attr>\n")
+            else:
+                attr_lines.append(
+                    f" <attr name={_quote(name)} type={_quote(oks_type)} val={_quote(format_value(oks_type, value))}/>\n"
+                )
+        # Attributes before relationships, as OKS writes them
+        self._write(
+            f"<obj class={_quote(class_name)} id={_quote(dal_obj.id)}>\n"
+            + "".join(attr_lines) + "".join(rel_lines) + "</obj>\n\n"
+        )
+        record = [[class_name, dal_obj.id]] + attr_record + rel_record
+        self._digest.update(json.dumps(record, default=str).encode())
+        self.written += 1
+
+    add_dal = update_dal
+
+    def commit(self):
+        """Finish the file and move it to oksfile"""
+        if self._file is None:
+            return
+        self._write("</oks-data>\n")
+        self._file.seek(self._info_offset)
+        self._file.write(self._info_line(self.written))
+        self._file.close()
+        self._file = None
+        os.replace(self._tmpfile, self.oksfile)
+
+    def discard(self):
+        """Close and remove the file without touching oksfile"""
+        if getattr(self, "_file", None) is None:
+            return
+        self._file.close()
+        self._file = None
+        try:
+            os.unlink(self._tmpfile)
+        except OSError:
+            pass
+
+    def __del__(self):
+        self.discard()
+
+    def digest(self):
+        return self._digest.hexdigest()
+
+    def validate(self):
+        """Reload the written file through oksdbinterfaces and check that
+        every object reads back with the values that were written. Returns
+        True if it does."""
+        import oksdbinterfaces
+
+        print(f"Validating {self.oksfile}")
+        db = oksdbinterfaces.Configuration("oksconfig:" + self.oksfile)
+        digest = hashlib.sha256()
+        count = 0
+        for event, elem in ET.iterparse(self.oksfile):
+            if elem.tag != "obj":
+                continue
+            class_name = elem.get("class")
+            uid = elem.get("id")
+            try:
+                dal_obj = db.get_dal(class_name, uid)
+            except Exception as e:
+                print(f"Error validating {self.oksfile}: cannot read back {uid}@{class_name}: {e}")
+                return False
+            record = [[class_name, uid]]
+            for child in elem:
+                value = getattr(dal_obj, child.get("name"), None)
+                if child.tag == "rel":
+                    refs = value if isinstance(value, list) else [value]
+                    record.append([child.get("name"), [f"{v.id}@{v.className()}" for v in refs if v is not None]])
+                else:
+                    record.append([child.get("name"), convert_value(child.get("type"), value)])
+            digest.update(json.dumps(record, default=str).encode())
+            count += 1
+            elem.clear()
+        if count != self.written or digest.hexdigest() != self.digest():
+            print(f"Error validating {self.oksfile}: the objects read back differ from the {self.written} written")
+            return False
+        print(f"Validated {count} objects in {self.oksfile}")
+        return True
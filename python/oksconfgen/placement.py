@@ -0,0 +1,94 @@
+PLACEMENTS = ["balanced", "round-robin"]
+
+
+def group_streams(rog):
+    """Number of streams of the interfaces of the ReadoutGroup rog"""
+    return sum(len(getattr(interface, "contains", None) or []) for interface in rog.contains)
+
+
+def host_cores(host):
+    """Number of CPU cores of the ProcessingResources a VirtualHost uses"""
+    return sum(len(getattr(res, "cpu_cores", None) or []) for res in getattr(host, "uses", None) or [])
+
+
+def host_names(host):
+    """Names a VirtualHost is known by: its own id and that of the
+    PhysicalHost it runs on"""
+    names = {host.id}
+    runs_on = getattr(host, "runs_on", None)
+    if runs_on is not None:
+        names.add(runs_on.id)
+    return names
+
+
+def interface_hosts(rog):
+    """Hosts the interfaces of rog are attached to (NICInterface.rx_hostname)"""
+    return {
+        interface.rx_hostname for interface in rog.contains
+        if getattr(interface, "rx_hostname", None)
+    }
+
+
+def place_groups(rogs, hosts, placement="balanced"):
+    """Assign a VirtualHost of hosts to each ReadoutGroup of rogs.
+
+    With placement="balanced" groups whose NIC is attached to one of
+    hosts are placed on that host, then the other groups are bin-packed
+    largest first onto the host with the fewest streams per CPU core
+    once the group is added (a host using no cores counts as one). With
+    "round-robin" the groups are dealt out to hosts in turn.
+
+    Returns the list of hosts for rogs and a per-host load record (host,
+    cores, groups, streams, load in streams per core, pinned groups)."""
+    weights = [group_streams(rog) for rog in rogs]
+    cores = [max(host_cores(host), 1) for host in hosts]
+    loads = [
+        {"host": host.id, "cores": host_cores(host), "groups": 0, "streams": 0, "load": 0.0, "pinned": 0}
+        for host in hosts
+    ]
+    assigned = [None] * len(rogs)
+
+    def assign(index, hostnum, pinned=False):
+        assigned[index] = hostnum
+        load = loads[hostnum]
+        load["groups"] += 1
+        load["streams"] += weights[index]
+        load["load"] = load["streams"] / cores[hostnum]
+        if pinned:
+            load["pinned"] += 1
+
+    if placement == "round-robin":
+        for index in range(len(rogs)):
+            assign(index, index % len(hosts))
+    elif placement == "balanced":
+        by_name = {}
+        for hostnum, host in enumerate(hosts):
+            for name in host_names(host):
+                by_name.setdefault(name, []).append(hostnum)
+        candidates = []
+        for rog in rogs:
+            owners = sorted({h for name in interface_hosts(rog) for h in by_name.get(name, [])})
+            candidates.append(owners)
+        # Pinned groups first so the others are balanced around them, then largest first
+        order = sorted(range(len(rogs)), key=lambda i: (len(candidates[i]) == 0, -weights[i], i))
+        for index in order:
+            choices = candidates[index] or range(len(hosts))
+            hostnum = min(
+                choices,
+                key=lambda h: ((loads[h]["streams"] + weights[index]) / cores[h], loads[h]["groups"], h),
+            )
+            assign(index, hostnum, len(candidates[index]) > 0)
+    else:
+        raise ValueError(f"Unknown placement {placement}, expected one of {PLACEMENTS}")
+    return [hosts[h] for h in assigned], loads
+
+
+def report_placement(loads):
+    """Print the per-host load records of place_groups"""
+    print(f"{'Host':<30} {'Cores':>5} {'Groups':>6} {'Streams':>7} {'Streams/core':>12} {'Pinned':>6}")
+    for load in loads:
+        print(f"{load['host']:<30} {load['cores']:>5} {load['groups']:>6} {load['streams']:>7} "
+              f"{load['load']:>12.1f} {load['pinned']:>6}")
+    busy = [load["load"] for load in loads if load["groups"] > 0]
+    if len(busy) > 1 and min(busy) > 0:
+        print(f"Most/least loaded host: {max(busy) / min(busy):.2f}")
@@ -0,0 +1,219 @@
+import os
+
+from oksconfgen.cache import get_database
+from oksconfgen.enable import select_resources
+from oksconfgen.instrument import phase
+
+# Relationships followed from a Session down to the streams:
+# Session -> Segment -> Segments/Applications -> ReadoutGroups -> interfaces -> streams
+TREE_RELATIONSHIPS = ["segment", "segments", "applications", "contains"]
+
+# disabled_by value of a resource disabled because everything it contains is
+CONTENTS = "contents"
+
+# (database file, session name) -> (Configuration, ResourceTree)
+_trees = {}
+
+
+def dal_key(dal):
+    return (dal.id, dal.className())
+
+
+def _related(dal, name):
+    value = getattr(dal, name, None)
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+class ResourceTree:
+    """Parent/child index of everything reachable from a Session through
+    TREE_RELATIONSHIPS, with the effective enabled state of each object.
+
+    An object is disabled if it, or any object containing it, is in the
+    disabled relationship of the Session, and a container all of whose
+    contents are disabled is disabled too. The states of all objects are
+    worked out in one pass over the tree when it is built, so queries
+    are dictionary lookups.
+
+    Objects are keyed by (uid, class name); queries also accept a uid or
+    a DAL object."""
+
+    def __init__(self, session):
+        self.session = session
+        self.root = dal_key(session)
+        self.nodes = {self.root: session}
+        self.children = {}
+        self.parents = {}
+        self.by_uid = {}
+        # Parents before their children
+        self.order = []
+        self._build()
+        self.explicit = {dal_key(d) for d in session.disabled}
+        self._disabled_by = self._propagate()
+
+    def _build(self):
+        post_order = []
+        in_progress = {self.root}
+        stack = [(self.root, self._iter_children(self.session))]
+        self.children[self.root] = []
+        while stack:
+            key, children = stack[-1]
+            for child in children:
+                child_key = dal_key(child)
+                if child_key in in_progress:
+                    print(f"Ignoring cycle: {key[0]}@{key[1]} contains {child_key[0]}@{child_key[1]}")
+                    continue
+                self.children[key].append(child_key)
+                self.parents.setdefault(child_key, []).append(key)
+                if child_key in self.nodes:
+                    continue
+                self.nodes[child_key] = child
+                self.children[child_key] = []
+                self.by_uid.setdefault(child_key[0], []).append(child_key)
+                in_progress.add(child_key)
+                stack.append((child_key, self._iter_children(child)))
+                break
+            else:
+                stack.pop()
+                in_progress.discard(key)
+                post_order.append(key)
+        self.order = post_order[::-1]
+
+    @staticmethod
+    def _iter_children(dal):
+        for name in TREE_RELATIONSHIPS:
+            yield from (v for v in _related(dal, name) if v is not None)
+
+    def _propagate(self):
+        disabled_by = {}
+        # Down from the disabled objects to everything they contain
+        for key in self.order:
+            if key in self.explicit:
+                disabled_by[key] = key[0]
+                continue
+            for parent in self.parents.get(key, []):
+                if parent in disabled_by:
+                    disabled_by[key] = disabled_by[parent]
+                    break
+        # Up to the containers whose contents are all disabled
+        for key in reversed(self.order):
+            children = self.children[key]
+            if key not in disabled_by and key != self.root and len(children) > 0 \
+                    and all(c in disabled_by for c in children):
+                disabled_by[key] = CONTENTS
+        return disabled_by
+
+    def keys(self, resource):
+        """Keys of the objects resource (a uid, key or DAL) refers to"""
+        if isinstance(resource, tuple):
+            return [resource] if resource in self.nodes else []
+        if isinstance(resource, str):
+            return self.by_uid.get(resource, [])
+        key = dal_key(resource)
+        return [key] if key in self.nodes else []
+
+    def disabled_by(self, resource):
+        """Return the uid of the object in Session.disabled that disables
+        resource, CONTENTS if it is disabled because all it contains is,
+        or None if it is enabled. Raises KeyError if resource is not in
+        the tree."""
+        keys = self.keys(resource)
+        if len(keys) == 0:
+            raise KeyError(f"{resource} is not part of Session {self.session.id}")
+        for key in keys:
+            if key in self._disabled_by:
+                return self._disabled_by[key]
+        return None
+
+    def is_enabled(self, resource):
+        return self.disabled_by(resource) is None
+
+    def resources(self, class_names=None):
+        """Keys of the objects of the tree (of class_names if given), in
+        tree order"""
+        return [
+            key for key in self.order
+            if key != self.root and (not class_names or key[1] in class_names)
+        ]
+
+    def descendants(self, resource):
+        """Keys of everything contained directly or indirectly in resource"""
+        found = []
+        seen = set()
+        stack = list(self.keys(resource))
+        while stack:
+            for child in self.children[stack.pop()]:
+                if child not in seen:
+                    seen.add(child)
+                    found.append(child)
+                    stack.append(child)
+        return found
+
+    def query(self, keys):
+        """Return a record of uid, class, enabled and disabled_by for each
+        of keys"""
+        return [
+            {
+                "uid": key[0],
+                "class": key[1],
+                "enabled": key not in self._disabled_by,
+                "disabled_by": self._disabled_by.get(key),
+            }
+            for key in keys
+        ]
+
+
+def _find_session(db, oksfile, session_name):
+    if session_name == "":
+        session_dals = db.get_dals(class_name="Session")
+        if len(session_dals) == 0:
+            print(f"Error could not find any Session in file {oksfile}")
+            return None
+        return session_dals[0]
+    try:
+        return db.get_dal("Session", session_name)
+    except Exception:
+        print(f"Error could not find Session {session_name} in file {oksfile}")
+        return None
+
+
+def get_resource_tree(oksfile, session_name=""):
+    """Return the ResourceTree of the Session session_name (the first
+    Session if "") of oksfile, or None if there is no such Session. The
+    tree is kept for as long as the database is unchanged (see
+    cache.get_database)."""
+    with phase("load"):
+        db = get_database(oksfile)
+    key = (os.path.abspath(oksfile), session_name)
+    cached = _trees.get(key)
+    if cached is not None and cached[0] is db:
+        return cached[1]
+    session = _find_session(db, oksfile, session_name)
+    if session is None:
+        return None
+    with phase("build"):
+        tree = ResourceTree(session)
+    _trees[key] = (db, tree)
+    return tree
+
+
+def get_effective_state(oksfile, resources=(), session_name="", class_names=()):
+    """Return the effective enabled state of resources (uids, glob
+    patterns or re: regular expressions, see enable.select_resources),
+    or of every object of the Session if none are given, as a list of
+    ResourceTree.query records. class_names restricts the result to
+    objects of those classes."""
+    tree = get_resource_tree(oksfile, session_name)
+    if tree is None:
+        return None
+    if len(resources) == 0:
+        return tree.query(tree.resources(class_names))
+    keys = []
+    for res in resources:
+        selected = select_resources(tree.by_uid, res)
+        if len(selected) == 0:
+            print(f"Error could not find {res} in Session {tree.session.id}")
+        for res_keys in selected:
+            keys += [k for k in res_keys if not class_names or k[1] in class_names]
+    return tree.query(list(dict.fromkeys(keys)))
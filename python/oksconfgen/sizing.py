@@ -0,0 +1,159 @@
+import copy
+import json
+import math
+
+from oksconfgen.placement import group_streams
+
+# Sizing model used by generate_readout with a sizing file, whose values
+# override these. Rates are per stream, a stream carrying
+# channels_per_stream channels. The latency buffers hold retention_s of
+# data and the input queues queue_latency_s, the longest the consumer
+# may fall behind. Budgets of the memory each host may use for latency
+# buffers (hugepages) and queues (RAM) go in "hosts", keyed by
+# VirtualHost id or "default"; a host without one is not checked.
+DEFAULT_MODEL = {
+    "alignment": 4096,
+    "links": {
+        "WIBEthFrame": {
+            "frame_size": 7200,
+            "frame_rate_hz": 62.5e6 / 2048,
+            "retention_s": 4.555,
+            "queue_latency_s": 0.1,
+            "numa_node": 1,
+        },
+        "TriggerPrimitive": {
+            "frame_size": 64,
+            "tp_rate_per_channel_hz": 1.0,
+            "channels_per_stream": 64,
+            "retention_s": 4.555,
+            "queue_latency_s": 0.1,
+            "numa_node": 1,
+        },
+    },
+    "hosts": {},
+}
+
+
+def _merge(defaults, values):
+    merged = copy.deepcopy(defaults)
+    for key, value in values.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = _merge(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+def load_sizing(filename):
+    """Return the sizing model of the JSON file filename merged over
+    DEFAULT_MODEL"""
+    with open(filename) as f:
+        return _merge(DEFAULT_MODEL, json.load(f))
+
+
+def _align(nbytes, alignment):
+    return -(-nbytes // alignment) * alignment
+
+
+def buffer_sizes(model, max_streams):
+    """Return the latency buffer sizes (in elements), alignment, NUMA
+    node and aligned bytes of the data links ("data") and of the TPs of
+    an application of max_streams streams ("tp"), and the capacities of
+    the rawWIBInput and tpInput queues ("queues")"""
+    alignment = model["alignment"]
+    data = model["links"]["WIBEthFrame"]
+    tp = model["links"]["TriggerPrimitive"]
+    tp_rate = tp["tp_rate_per_channel_hz"] * tp["channels_per_stream"] * max_streams
+    data_size = math.ceil(data["frame_rate_hz"] * data["retention_s"])
+    tp_size = max(math.ceil(tp_rate * tp["retention_s"]), 1)
+    return {
+        "data": {
+            "size": data_size,
+            "alignment_size": alignment,
+            "numa_node": data["numa_node"],
+            "bytes": _align(data_size * data["frame_size"], alignment),
+        },
+        "tp": {
+            "size": tp_size,
+            "alignment_size": alignment,
+            "numa_node": tp["numa_node"],
+            "bytes": _align(tp_size * tp["frame_size"], alignment),
+        },
+        "queues": {
+            "rawWIBInput": max(math.ceil(data["frame_rate_hz"] * data["queue_latency_s"]), 1),
+            "tpInput": max(math.ceil(tp_rate * tp["queue_latency_s"]), 1),
+        },
+    }
+
+
+def used_sizes(model, sizes, linkhandler, tphandler, qrules):
+    """Return sizes (see buffer_sizes) with the latency buffers and queue
+    capacities replaced by those actually used, which may be predefined
+    rather than sized from model: the latency buffers of the data and TP
+    ReadoutModuleConfs linkhandler and tphandler and the capacities set
+    in the descriptors of the WIBEthFrame and TriggerPrimitive queue
+    rules of qrules"""
+    used = copy.deepcopy(sizes)
+    alignment = model["alignment"]
+    for kind, handler, link in [("data", linkhandler, "WIBEthFrame"), ("tp", tphandler, "TriggerPrimitive")]:
+        lb = getattr(handler, "latency_buffer", None)
+        if lb is None or getattr(lb, "size", None) is None:
+            continue
+        lb_alignment = getattr(lb, "alignment_size", None) or alignment
+        used[kind] = {
+            "size": lb.size,
+            "alignment_size": lb_alignment,
+            "numa_node": getattr(lb, "numa_node", used[kind]["numa_node"]),
+            "bytes": _align(lb.size * model["links"][link]["frame_size"], lb_alignment),
+        }
+    queues = {"WIBEthFrame": "rawWIBInput", "TriggerPrimitive": "tpInput"}
+    for rule in qrules or []:
+        descriptor = getattr(rule, "descriptor", None)
+        name = queues.get(getattr(descriptor, "data_type", None))
+        if name is not None and getattr(descriptor, "capacity", None) is not None:
+            used["queues"][name] = descriptor.capacity
+    return used
+
+
+def host_footprints(model, sizes, rogs, rog_hosts):
+    """Return per VirtualHost the apps, streams, hugepage bytes (a data
+    latency buffer per stream and a TP one per application) and RAM
+    bytes (full input queues) of the ReadoutApplications of rogs placed
+    on rog_hosts"""
+    data_frame = model["links"]["WIBEthFrame"]["frame_size"]
+    tp_frame = model["links"]["TriggerPrimitive"]["frame_size"]
+    queues = sizes["queues"]
+    footprints = {}
+    for rog, host in zip(rogs, rog_hosts):
+        streams = group_streams(rog)
+        fp = footprints.setdefault(host.id, {"host": host.id, "apps": 0, "streams": 0,
+                                             "hugepages_bytes": 0, "ram_bytes": 0})
+        fp["apps"] += 1
+        fp["streams"] += streams
+        fp["hugepages_bytes"] += streams * sizes["data"]["bytes"] + sizes["tp"]["bytes"]
+        fp["ram_bytes"] += streams * queues["rawWIBInput"] * data_frame + queues["tpInput"] * tp_frame
+    return list(footprints.values())
+
+
+def check_budgets(model, footprints):
+    """Return a message for each budget of model["hosts"] exceeded by
+    footprints"""
+    errors = []
+    hosts = model["hosts"]
+    for fp in footprints:
+        budget = hosts.get(fp["host"], hosts.get("default"))
+        if budget is None:
+            continue
+        for name in ["hugepages_bytes", "ram_bytes"]:
+            if name in budget and fp[name] > budget[name]:
+                errors.append(f"Host {fp['host']} needs {fp[name] / 2**30:.2f} GiB of {name.removesuffix('_bytes')} "
+                              f"for {fp['apps']} applications of {fp['streams']} streams, "
+                              f"its budget is {budget[name] / 2**30:.2f} GiB")
+    return errors
+
+
+def report_footprints(footprints):
+    print(f"{'Host':<30} {'Apps':>4} {'Streams':>7} {'Hugepages GiB':>13} {'RAM GiB':>8}")
+    for fp in footprints:
+        print(f"{fp['host']:<30} {fp['apps']:>4} {fp['streams']:>7} "
+              f"{fp['hugepages_bytes'] / 2**30:>13.2f} {fp['ram_bytes'] / 2**30:>8.2f}")
@@ -0,0 +1,213 @@
+import os
+import json
+
+# Topology of the hosts readout runs on, as read by load_topology:
+#
+#   {"hosts": {"<hostname>": {"numa_nodes": {"<node>": [cpu, ...]},
+#                             "nics": {"<pcie address>": <node>},
+#                             "housekeeping": [cpu, ...]}}}
+#
+# housekeeping lists the CPUs left to the operating system and other
+# processes, which no readout thread is placed on. A host named
+# "default" describes every host not listed.
+DEFAULT_HOST = "default"
+
+# PCI class of network controllers
+NETWORK_CLASS = "0x02"
+
+
+def parse_cpulist(text):
+    """Return the CPUs of a kernel cpulist such as 0-3,8,10-11"""
+    cpus = []
+    for part in text.strip().split(","):
+        if part == "":
+            continue
+        first, _, last = part.partition("-")
+        cpus.extend(range(int(first), int(last or first) + 1))
+    return cpus
+
+
+def _read(filename, default=""):
+    try:
+        with open(filename) as f:
+            return f.read().strip()
+    except OSError:
+        return default
+
+
+def describe(numa_nodes, nics, cores=None, isolated=(), housekeeping_cores=1):
+    """Return the description of a host with the CPUs numa_nodes (node ->
+    CPUs) and NICs nics (PCI address -> node).
+
+    The housekeeping CPUs are those not isolated from the scheduler if
+    isolated is given, else the first housekeeping_cores cores of each
+    node with all their CPUs (hyperthreads), cores mapping each CPU to
+    its core, unless that would leave a node no CPUs"""
+    cpus = sorted(c for node_cpus in numa_nodes.values() for c in node_cpus)
+    if len(isolated) > 0:
+        housekeeping = [c for c in cpus if c not in set(isolated)]
+    else:
+        cores = cores or {}
+        housekeeping = []
+        for node_cpus in numa_nodes.values():
+            node_cores = list(dict.fromkeys(cores.get(c, c) for c in sorted(node_cpus)))
+            kept = set(node_cores[:housekeeping_cores])
+            if len(kept) < len(node_cores):
+                housekeeping += [c for c in node_cpus if cores.get(c, c) in kept]
+        housekeeping.sort()
+    return {
+        "numa_nodes": {str(node): sorted(node_cpus) for node, node_cpus in sorted(numa_nodes.items(), key=lambda n: int(n[0]))},
+        "nics": nics,
+        "housekeeping": housekeeping,
+    }
+
+
+def read_local_topology(root="/sys", housekeeping_cores=1):
+    """Read the topology of this machine from /sys: the CPUs of each NUMA
+    node, the node of each network PCI device, and as housekeeping the
+    CPUs not isolated from the scheduler (isolcpus) or if none are the
+    first housekeeping_cores cores of each node (see describe)"""
+    numa_nodes = {}
+    node_dir = os.path.join(root, "devices/system/node")
+    if os.path.isdir(node_dir):
+        for name in sorted(os.listdir(node_dir)):
+            if name.startswith("node") and name[4:].isdigit():
+                numa_nodes[name[4:]] = parse_cpulist(_read(os.path.join(node_dir, name, "cpulist")))
+    if len(numa_nodes) == 0:
+        numa_nodes["0"] = parse_cpulist(_read(os.path.join(root, "devices/system/cpu/online"), "0"))
+
+    cores = {}
+    for node_cpus in numa_nodes.values():
+        for cpu in node_cpus:
+            cpu_dir = os.path.join(root, f"devices/system/cpu/cpu{cpu}/topology")
+            cores[cpu] = (_read(os.path.join(cpu_dir, "physical_package_id")), _read(os.path.join(cpu_dir, "core_id"), str(cpu)))
+
+    nics = {}
+    pci_dir = os.path.join(root, "bus/pci/devices")
+    if os.path.isdir(pci_dir):
+        for address in sorted(os.listdir(pci_dir)):
+            if not _read(os.path.join(pci_dir, address, "class")).startswith(NETWORK_CLASS):
+                continue
+            node = int(_read(os.path.join(pci_dir, address, "numa_node"), "-1"))
+            # -1 if the machine does not say, i.e. it has a single node
+            nics[address] = max(node, 0) if len(numa_nodes) == 1 or node >= 0 else None
+
+    isolated = parse_cpulist(_read(os.path.join(root, "devices/system/cpu/isolated")))
+    return describe(numa_nodes, nics, cores, isolated, housekeeping_cores)
+
+
+def parse_lscpu(text, housekeeping_cores=1):
+    """Return the description of the host whose lscpu -p output is text.
+    lscpu does not list PCI devices, so it has no NICs."""
+    columns = None
+    numa_nodes = {}
+    cores = {}
+    for line in text.splitlines():
+        if line.startswith("#"):
+            fields = line.lstrip("# ").split(",")
+            if "CPU" in fields:
+                columns = {name: i for i, name in enumerate(fields) if name}
+            continue
+        if line.strip() == "":
+            continue
+        if columns is None:
+            raise ValueError("No '# CPU,Core,...' header line, expected the output of lscpu -p")
+        values = line.split(",")
+
+        def value(name):
+            i = columns.get(name)
+            return values[i] if i is not None and i < len(values) and values[i] != "" else None
+
+        cpu = int(value("CPU"))
+        numa_nodes.setdefault(value("Node") or "0", []).append(cpu)
+        cores[cpu] = (value("Socket"), value("Core") or cpu)
+    if len(numa_nodes) == 0:
+        raise ValueError("No CPUs found in lscpu -p output")
+    return describe(numa_nodes, {}, cores, (), housekeeping_cores)
+
+
+def parse_cpuset(cpuset):
+    """Return the CPUs of an hwloc cpuset such as 0x000000ff,0xffffffff"""
+    if "..." in cpuset:
+        # 0xf...f, an infinite set
+        return []
+    mask = 0
+    for word in cpuset.split(","):
+        mask = (mask << 32) | int(word, 16)
+    return [cpu for cpu in range(mask.bit_length()) if mask >> cpu & 1]
+
+
+def parse_hwloc(text, housekeeping_cores=1):
+    """Return the hostname (None if not recorded) and description of the
+    host whose hwloc XML topology (lstopo --of xml) is text. A network
+    PCI device is on the NUMA node whose CPUs are local to its nearest
+    ancestor object that has a cpuset."""
+    import xml.etree.ElementTree as ET
+
+    root = ET.fromstring(text)
+    hostname = None
+    for info in root.iter("info"):
+        if info.get("name") == "HostName":
+            hostname = info.get("value")
+            break
+
+    numa_nodes = {}
+    cores = {}
+    nics = {}
+    # (object, cpuset of its nearest ancestor with one, core os_index)
+    stack = [(obj, None, None) for obj in root.findall("object")]
+    while stack:
+        obj, local, core = stack.pop()
+        kind = obj.get("type")
+        if obj.get("cpuset"):
+            local = obj.get("cpuset")
+        if kind == "Core":
+            core = (obj.get("os_index"), local)
+        elif kind == "NUMANode":
+            numa_nodes[obj.get("os_index", "0")] = parse_cpuset(local or "0x0")
+        elif kind == "PU":
+            cores[int(obj.get("os_index"))] = core or int(obj.get("os_index"))
+        elif kind == "PCIDev" and obj.get("pci_type", "").startswith("02"):
+            nics[obj.get("pci_busid")] = local
+        stack.extend((child, local, core) for child in obj.findall("object"))
+    if len(numa_nodes) == 0:
+        numa_nodes["0"] = sorted(cores)
+    for address, cpuset in nics.items():
+        local = set(parse_cpuset(cpuset)) if cpuset else set()
+        nodes = [node for node, cpus in numa_nodes.items() if local >= set(cpus) or set(cpus) >= local]
+        nics[address] = int(nodes[0]) if len(nodes) == 1 else None
+    return hostname, describe(numa_nodes, dict(sorted(nics.items())), cores, (), housekeeping_cores)
+
+
+def load_topology(source):
+    """Return the topology in the JSON file source, or that of this
+    machine if source is "local", in which case it also describes every
+    other host"""
+    if source == "local":
+        import socket
+
+        local = read_local_topology()
+        return {"hosts": {socket.gethostname(): local, DEFAULT_HOST: local}}
+    with open(source) as f:
+        topology = json.load(f)
+    if "hosts" not in topology:
+        raise ValueError(f"Topology file {source} has no hosts")
+    return topology
+
+
+def host_topology(topology, host):
+    """Return the description of host in topology, or None"""
+    hosts = topology["hosts"]
+    return hosts.get(host, hosts.get(DEFAULT_HOST))
+
+
+def node_cpus(description, node=None):
+    """CPUs of the NUMA node of a host description (of every node if
+    node is None or unknown) that are not housekeeping CPUs"""
+    nodes = description["numa_nodes"]
+    if node is not None and str(node) in nodes:
+        cpus = nodes[str(node)]
+    else:
+        cpus = sorted(c for node_cpus in nodes.values() for c in node_cpus)
+    housekeeping = set(description.get("housekeeping", []))
+    return [c for c in cpus if c not in housekeeping]